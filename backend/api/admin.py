@@ -1,4 +1,7 @@
 from django.contrib import admin
+from django.contrib.admin.widgets import AutocompleteSelect
+from django.forms.models import BaseInlineFormSet
+
 from .models import (Ingredient, Recipe,
                      IngredientInRecipe, Favorite, ShoppingCart)
 
@@ -6,35 +9,89 @@ from .models import (Ingredient, Recipe,
 @admin.register(Ingredient)
 class IngredientAdmin(admin.ModelAdmin):
     list_display = ('name', 'measurement_unit')
+    list_filter = ('measurement_unit',)
     search_fields = ('name',)
-    list_filter = ('name',)
+    show_full_result_count = False
+
+
+class LoadedAutocompleteSelect(AutocompleteSelect):
+    """
+    AutocompleteSelect, который берёт подпись выбранного значения из уже
+    загруженного объекта (loaded), а не запросом на каждую строку инлайна.
+    """
+    loaded = None
+
+    def optgroups(self, name, value, attr=None):
+        selected = {str(item) for item in value
+                    if str(item) not in self.choices.field.empty_values}
+        if (self.loaded is None or not selected
+                or selected != {str(self.loaded.pk)}):
+            return super().optgroups(name, value, attr)
+        options = []
+        if not self.is_required:
+            options.append(self.create_option(name, '', '', False, 0))
+        options.append(self.create_option(
+            name, self.loaded.pk,
+            self.choices.field.label_from_instance(self.loaded),
+            selected, len(options)))
+        return [(None, options, 0)]
+
+
+class IngredientInRecipeFormSet(BaseInlineFormSet):
+    """Передаёт виджету ингредиент, загруженный вместе со строкой."""
+
+    def _construct_form(self, i, **kwargs):
+        form = super()._construct_form(i, **kwargs)
+        widget = form.fields['ingredient'].widget
+        # Админка оборачивает виджет в RelatedFieldWidgetWrapper.
+        widget = getattr(widget, 'widget', widget)
+        widget.loaded = IngredientInRecipe.ingredient.field.get_cached_value(
+            form.instance, default=None)
+        return form
 
 
 class IngredientInRecipeInline(admin.TabularInline):
     model = IngredientInRecipe
+    formset = IngredientInRecipeFormSet
     extra = 1
     min_num = 1
+    autocomplete_fields = ('ingredient',)
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('ingredient')
+
+    def formfield_for_foreignkey(self, db_field, request, **kwargs):
+        if db_field.name == 'ingredient':
+            kwargs['widget'] = LoadedAutocompleteSelect(
+                db_field, self.admin_site, using=kwargs.get('using'))
+        return super().formfield_for_foreignkey(db_field, request, **kwargs)
 
 
 @admin.register(Recipe)
 class RecipeAdmin(admin.ModelAdmin):
-    list_display = ('name', 'author', 'favorited_count')
+    list_display = ('name', 'author', 'favorites_count',
+                    'short_link_clicks')
+    list_select_related = ('author',)
     search_fields = ('name', 'author__username')
-    list_filter = ('author', 'name')
+    date_hierarchy = 'pub_date'
+    autocomplete_fields = ('author',)
+    show_full_result_count = False
     inlines = (IngredientInRecipeInline,)
 
-    def favorited_count(self, obj):
-        return obj.favorited_by.count()
-    favorited_count.short_description = 'Число добавлений в избранное'
-
 
 @admin.register(Favorite)
 class FavoriteAdmin(admin.ModelAdmin):
     list_display = ('user', 'recipe')
+    list_select_related = ('user', 'recipe')
     search_fields = ('user__username', 'recipe__name')
+    autocomplete_fields = ('user', 'recipe')
+    show_full_result_count = False
 
 
 @admin.register(ShoppingCart)
 class ShoppingCartAdmin(admin.ModelAdmin):
     list_display = ('user', 'recipe')
+    list_select_related = ('user', 'recipe')
     search_fields = ('user__username', 'recipe__name')
+    autocomplete_fields = ('user', 'recipe')
+    show_full_result_count = False
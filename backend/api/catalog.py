@@ -0,0 +1,74 @@
+import threading
+import time
+from bisect import bisect_left
+
+from django.conf import settings
+
+from .models import Ingredient
+from .versions import bump_version_on_commit, get_version
+
+
+class IngredientIndex:
+    """
+    Индекс каталога ингредиентов в памяти процесса.
+
+    Хранит отсортированный по name.casefold() список и отвечает на поиск
+    по префиксу двоичным поиском, не обращаясь к БД. Индекс строится
+    лениво при первом обращении и перестраивается, когда меняется версия
+    в общем кеше (см. invalidate) или истекает INGREDIENT_INDEX_TTL —
+    на случай кеша, не разделяемого между процессами.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # (ключи, записи, версия, время построения) или None.
+        self._state = None
+
+    def _is_fresh(self, state):
+        if state is None:
+            return False
+        ttl = getattr(settings, 'INGREDIENT_INDEX_TTL', 300)
+        if ttl and time.monotonic() - state[3] > ttl:
+            return False
+        return get_version('ingredients') == state[2]
+
+    def _build(self):
+        version = get_version('ingredients')
+        rows = sorted(
+            Ingredient.objects.values('id', 'name', 'measurement_unit'),
+            key=lambda row: (row['name'].casefold(), row['id'])
+        )
+        keys = [row['name'].casefold() for row in rows]
+        return keys, rows, version, time.monotonic()
+
+    def _get_state(self):
+        state = self._state
+        if not self._is_fresh(state):
+            with self._lock:
+                state = self._state
+                if not self._is_fresh(state):
+                    state = self._state = self._build()
+        return state
+
+    def all(self):
+        return list(self._get_state()[1])
+
+    def search(self, prefix):
+        """Ингредиенты, название которых начинается с prefix."""
+        keys, items = self._get_state()[:2]
+        key = prefix.casefold()
+        start = bisect_left(keys, key)
+        end = bisect_left(keys, key + '\U0010ffff', lo=start)
+        return items[start:end]
+
+    def invalidate(self):
+        """
+        Сбрасывает индекс во всех процессах, разделяющих кеш. Версия
+        меняется после фиксации транзакции, иначе параллельный запрос мог
+        бы построить индекс по старым строкам под новой версией.
+        """
+        bump_version_on_commit('ingredients')
+        self._state = None
+
+
+ingredient_index = IngredientIndex()
@@ -0,0 +1,77 @@
+"""
+Условные GET-запросы: ETag и Last-Modified для ответов на чтение.
+
+Валидаторы считаются по updated_at и версиям данных (api/versions.py)
+без сериализации, поэтому повторный запрос клиента с If-None-Match или
+If-Modified-Since обычно заканчивается ответом 304 без тела.
+"""
+from datetime import datetime
+from functools import wraps
+
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date
+
+from .versions import get_version
+
+
+def make_etag(*parts):
+    """ETag из частей; дата и время берутся с точностью до микросекунд."""
+    return '"{}"'.format('-'.join(
+        str(int(part.timestamp() * 1000000))
+        if isinstance(part, datetime) else str(part) for part in parts))
+
+
+def viewer_version(user):
+    """
+    Версия избранного, списка покупок и подписок читателя: от них
+    зависят is_favorited, is_in_shopping_cart и is_subscribed.
+    """
+    if not user.is_authenticated:
+        return 'anonymous'
+    return f'{user.pk}.{get_version("relations", user.pk)}'
+
+
+def not_modified_or_none(request, etag, last_modified=None):
+    """Ответ 304 (или 412), если у клиента актуальная копия."""
+    timestamp = last_modified and int(last_modified.timestamp())
+    response = get_conditional_response(
+        request, etag=etag, last_modified=timestamp)
+    if response is not None:
+        set_validators(response, etag, last_modified)
+    return response
+
+
+def set_validators(response, etag, last_modified=None):
+    if etag:
+        response['ETag'] = etag
+    if last_modified:
+        response['Last-Modified'] = http_date(last_modified.timestamp())
+    # Ответ зависит от токена: общие кеши не должны отдавать его другим.
+    patch_vary_headers(response, ('Authorization',))
+    return response
+
+
+def conditional(validators):
+    """
+    Декоратор метода представления DRF, аналог django.views.decorators.
+    http.condition. validators(request, *args, **kwargs) возвращает
+    (etag, last_modified) или (None, None), если ответ нельзя проверить
+    без выполнения представления.
+    """
+    def decorator(method):
+        @wraps(method)
+        def wrapper(view, request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD'):
+                return method(view, request, *args, **kwargs)
+            etag, last_modified = validators(request, *args, **kwargs)
+            if etag is None and last_modified is None:
+                return method(view, request, *args, **kwargs)
+            response = not_modified_or_none(request, etag, last_modified)
+            if response is not None:
+                return response
+            response = method(view, request, *args, **kwargs)
+            if response.status_code == 200:
+                set_validators(response, etag, last_modified)
+            return response
+        return wrapper
+    return decorator
@@ -0,0 +1,64 @@
+from django.db.models import (Count, F, OuterRef, QuerySet, Subquery,
+                              Value)
+from django.db.models.functions import Coalesce, Greatest
+
+from users.models import Subscription, User
+from .models import Favorite, Recipe, ShoppingCart
+
+# Модель -> {поле-счётчик: (модель строк, поле ссылки на объект)}.
+COUNTERS = {
+    Recipe: {
+        'favorites_count': (Favorite, 'recipe'),
+        'shopping_cart_count': (ShoppingCart, 'recipe'),
+    },
+    User: {
+        'recipes_count': (Recipe, 'author'),
+        'followers_count': (Subscription, 'author'),
+        'following_count': (Subscription, 'user'),
+    },
+}
+
+
+def shift_counter(model, pk, field, delta):
+    """Атомарно изменяет счётчик на delta, не опускаясь ниже нуля."""
+    shift_counters(model, [pk], field, delta)
+
+
+def shift_counters(model, pks, field, delta):
+    """shift_counter для нескольких объектов одним запросом."""
+    model.objects.filter(pk__in=pks).update(
+        **{field: Greatest(F(field) + delta, Value(0))})
+
+
+def deleted_with(origin, model):
+    """
+    Удаление идёт каскадом от объекта (или queryset) model: обработчики
+    post_delete строк пропускают пересчёт, сделанный заранее пачкой или
+    ненужный вовсе.
+    """
+    if isinstance(origin, QuerySet):
+        return origin.model is model
+    return isinstance(origin, model)
+
+
+def count_subquery(model, field):
+    return Coalesce(Subquery(
+        model.objects.filter(**{field: OuterRef('pk')}).order_by().values(
+            field).annotate(total=Count('pk')).values('total')
+    ), 0)
+
+
+def recount(model, batch_size=10000):
+    """
+    Пересчитывает все счётчики модели по диапазонам первичного ключа.
+    Возвращает число обработанных объектов.
+    """
+    updates = {field: count_subquery(*source)
+               for field, source in COUNTERS[model].items()}
+    last_pk = model.objects.order_by('-pk').values_list(
+        'pk', flat=True).first() or 0
+    updated = 0
+    for start in range(0, last_pk + 1, batch_size):
+        updated += model.objects.filter(
+            pk__gte=start, pk__lt=start + batch_size).update(**updates)
+    return updated
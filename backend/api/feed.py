@@ -0,0 +1,132 @@
+"""
+Лента подписок: рецепты авторов, на которых подписан пользователь.
+
+Лента материализована в таблице FeedEntry и заполняется при записи:
+публикация рецепта добавляет его подписчикам автора запросами
+INSERT ... SELECT по FEED_FANOUT_BATCH_SIZE подписчиков, подписка
+добавляет последние FEED_BACKFILL_RECIPES рецептов автора, отписка и
+удаление рецепта (каскадом) удаляют строки. Чтение ленты — просмотр
+диапазона индекса (user, pub_date, recipe) без соединения с подписками
+и без COUNT.
+
+Рецепты авторов, у которых не меньше FEED_PULL_FOLLOWERS подписчиков,
+не рассылаются: их читает сама лента, см. feed_sources(). Иначе один
+рецепт такого автора стоил бы миллионов вставок. Автор, у которого
+подписчиков стало меньше порога, рассылает только новые рецепты;
+прежние вернёт в ленты rebuild_feeds().
+"""
+from django.conf import settings
+from django.db import connections, router, transaction
+from django.db.models import F
+
+from users.models import Subscription, User
+from .models import FeedEntry, Recipe
+
+# Последние рецепты автора подписчика s, не больше %s.
+LATEST_RECIPES = (
+    f'r.id IN (SELECT id FROM {Recipe._meta.db_table} '
+    'WHERE author_id = s.author_id '
+    'ORDER BY pub_date DESC, id DESC LIMIT %s)')
+
+
+def _fill(condition, params):
+    """
+    Добавляет в ленты пары (подписчик, рецепт автора) по условию. Авторы
+    с FEED_PULL_FOLLOWERS подписчиков и больше пропускаются.
+    """
+    # Запись: всегда на основную БД, даже внутри чтения с реплики.
+    with connections[router.db_for_write(FeedEntry)].cursor() as cursor:
+        cursor.execute(
+            f'INSERT INTO {FeedEntry._meta.db_table} '
+            '(user_id, recipe_id, author_id, pub_date) '
+            'SELECT s.user_id, r.id, r.author_id, r.pub_date '
+            f'FROM {Subscription._meta.db_table} s '
+            f'JOIN {User._meta.db_table} a ON a.id = s.author_id '
+            f'JOIN {Recipe._meta.db_table} r ON r.author_id = s.author_id '
+            # WHERE обязателен: без него SQLite не разберёт ON CONFLICT
+            # после INSERT ... SELECT с JOIN.
+            f'WHERE a.followers_count < %s AND {condition} '
+            'ON CONFLICT (user_id, recipe_id) DO NOTHING',
+            [settings.FEED_PULL_FOLLOWERS, *params])
+
+
+def publish(recipe_id):
+    """
+    Новый рецепт — в ленты всех подписчиков автора. Подписчики берутся
+    пачками по возрастанию id, и каждая пачка — отдельный короткий
+    запрос: у популярного автора рассылка не держит блокировки одной
+    большой вставкой.
+    """
+    author = Recipe.objects.filter(pk=recipe_id).values_list(
+        'author_id', 'author__followers_count').first()
+    if author is None or author[1] >= settings.FEED_PULL_FOLLOWERS:
+        return
+    subscribers = Subscription.objects.filter(
+        author_id=author[0]).order_by('user_id').values_list(
+        'user_id', flat=True)
+    size = settings.FEED_FANOUT_BATCH_SIZE
+    last = 0
+    while True:
+        batch = list(subscribers.filter(user_id__gt=last)[:size])
+        if not batch:
+            return
+        _fill('r.id = %s AND s.user_id >= %s AND s.user_id <= %s',
+              [recipe_id, batch[0], batch[-1]])
+        if len(batch) < size:
+            return
+        last = batch[-1]
+
+
+def publish_on_commit(recipe_id):
+    """Рассылка после фиксации: создание рецепта её не ждёт."""
+    transaction.on_commit(lambda: publish(recipe_id))
+
+
+def follow(user_id, author_id):
+    """Последние рецепты автора — в ленту нового подписчика."""
+    _fill(f's.user_id = %s AND s.author_id = %s AND {LATEST_RECIPES}',
+          [user_id, author_id, settings.FEED_BACKFILL_RECIPES])
+
+
+def unfollow(user_id, author_id):
+    FeedEntry.objects.filter(user_id=user_id, author_id=author_id).delete()
+
+
+def rebuild_feeds():
+    """
+    Полное перестроение лент, например после bulk_create: по
+    FEED_FANOUT_BATCH_SIZE подписчиков за раз, каждому — последние
+    FEED_BACKFILL_RECIPES рецептов каждого автора, как при подписке.
+    """
+    size = settings.FEED_FANOUT_BATCH_SIZE
+    last_pk = User.objects.order_by('-pk').values_list(
+        'pk', flat=True).first() or 0
+    for start in range(0, last_pk + 1, size):
+        end = start + size - 1
+        with transaction.atomic(router.db_for_write(FeedEntry)):
+            FeedEntry.objects.filter(
+                user_id__gte=start, user_id__lte=end).delete()
+            _fill(f's.user_id >= %s AND s.user_id <= %s AND {LATEST_RECIPES}',
+                  [start, end, settings.FEED_BACKFILL_RECIPES])
+
+
+def feed_sources(user):
+    """
+    Источники ленты, упорядоченные по (pub_date, recipe_id): строки
+    FeedEntry и рецепты авторов, которые читаются при чтении ленты.
+    Рецепт автора, перешедшего порог, может оказаться в обоих.
+    """
+    entries = FeedEntry.objects.filter(user=user).select_related(
+        'recipe__author')
+    pulled = Recipe.objects.filter(author__in=Subscription.objects.filter(
+        user=user,
+        author__followers_count__gte=settings.FEED_PULL_FOLLOWERS,
+    ).values('author_id')).annotate(recipe_id=F('id')).select_related(
+        'author')
+    return entries, pulled
+
+
+def feed_recipes(items):
+    """Рецепты элементов ленты из любого источника feed_sources()."""
+    return [item.recipe if isinstance(item, FeedEntry) else item
+            for item in items]
@@ -0,0 +1,21 @@
+from django.core.files.storage import default_storage
+from rest_framework import serializers
+
+
+class ImageVariantsField(serializers.ReadOnlyField):
+    """
+    Ссылки на уменьшенные копии картинки: {вариант: {формат: url}}.
+    Пустой объект, пока варианты ещё не готовы.
+    """
+
+    def to_representation(self, value):
+        request = self.context.get('request')
+        result = {}
+        for variant, files in (value or {}).items():
+            result[variant] = {}
+            for extension, name in files.items():
+                url = default_storage.url(name)
+                if request is not None:
+                    url = request.build_absolute_uri(url)
+                result[variant][extension] = url
+        return result
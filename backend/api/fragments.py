@@ -0,0 +1,141 @@
+"""
+Кеш представлений рецептов, не зависящих от читателя.
+
+Фрагмент — вывод RecipeListSerializer для анонима: автор, ингредиенты,
+ссылки на картинки. Ключ включает версии ('recipe', pk),
+('author', author_id) и ('ingredients',), поэтому правка рецепта, его
+автора или каталога делает фрагмент недоступным. Правка профиля автора
+увеличивает одну версию, сколько бы у него ни было рецептов. Признаки
+is_favorited, is_in_shopping_cart и author.is_subscribed накладываются
+при ответе одним запросом на страницу.
+"""
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.db.models import Prefetch, Value, prefetch_related_objects
+
+from users.models import Subscription
+from .metrics import timed_serialization
+from .models import Favorite, IngredientInRecipe, Recipe, ShoppingCart
+from .routing import primary_reads
+from .serializers import RecipeListSerializer
+from .versions import get_versions
+
+
+def ingredient_list_prefetch():
+    return Prefetch(
+        'ingredient_list',
+        queryset=IngredientInRecipe.objects.select_related('ingredient'))
+
+
+class AnonymousRequest:
+    """Запрос от имени анонима: ссылки строятся по исходному запросу."""
+    user = AnonymousUser()
+
+    def __init__(self, request):
+        self._request = request
+
+    def __getattr__(self, name):
+        return getattr(self._request, name)
+
+
+def fragment_keys(request, recipes):
+    author_ids = list({recipe.author_id for recipe in recipes})
+    *versions, ingredients_version = get_versions(
+        *(('recipe', recipe.pk) for recipe in recipes),
+        *(('author', author_id) for author_id in author_ids),
+        ('ingredients',))
+    recipe_versions = versions[:len(recipes)]
+    author_versions = dict(zip(author_ids, versions[len(recipes):]))
+    # Ссылки на картинки абсолютные, поэтому ключ зависит от хоста.
+    base = request.build_absolute_uri('/')
+    return {
+        recipe.pk: (f'recipe_fragment:{recipe.pk}:{version}:'
+                    f'{author_versions[recipe.author_id]}:'
+                    f'{ingredients_version}:{base}')
+        for recipe, version in zip(recipes, recipe_versions)
+    }
+
+
+def viewer_flags(user, fragments):
+    """
+    Избранное, список покупок и подписки читателя среди рецептов
+    страницы: один запрос UNION ALL.
+    """
+    recipe_ids = [fragment['id'] for fragment in fragments]
+    author_ids = {fragment['author']['id'] for fragment in fragments}
+    rows = Favorite.objects.filter(
+        user=user, recipe_id__in=recipe_ids,
+    ).order_by().annotate(kind=Value('favorite')).values_list(
+        'recipe_id', 'kind',
+    ).union(
+        ShoppingCart.objects.filter(
+            user=user, recipe_id__in=recipe_ids,
+        ).order_by().annotate(kind=Value('cart')).values_list(
+            'recipe_id', 'kind'),
+        Subscription.objects.filter(
+            user=user, author_id__in=author_ids,
+        ).order_by().annotate(kind=Value('author')).values_list(
+            'author_id', 'kind'),
+        all=True,
+    )
+    flags = {'favorite': set(), 'cart': set(), 'author': set()}
+    for pk, kind in rows:
+        flags[kind].add(pk)
+    return flags
+
+
+def overlay(fragment, flags):
+    data = dict(fragment)
+    data['author'] = dict(fragment['author'])
+    data['author']['is_subscribed'] = (
+        fragment['author']['id'] in flags['author'])
+    data['is_favorited'] = fragment['id'] in flags['favorite']
+    data['is_in_shopping_cart'] = fragment['id'] in flags['cart']
+    return data
+
+
+def build_fragments(request, recipes, keys):
+    """
+    Фрагменты рецептов: {ключ из keys: данные}. Фрагменты общие и живут
+    долго, поэтому строятся по основной БД, даже если рецепты прочитаны
+    с реплики: она может отставать от версий в ключах (api/routing.py).
+    """
+    with primary_reads() as reloaded:
+        if reloaded:
+            recipes = Recipe.objects.select_related('author').filter(
+                pk__in=[recipe.pk for recipe in recipes])
+        recipes = list(recipes)
+        prefetch_related_objects(recipes, ingredient_list_prefetch())
+        with timed_serialization():
+            return {
+                keys[item['id']]: item for item in RecipeListSerializer(
+                    recipes, many=True,
+                    context={'request': AnonymousRequest(request)}).data
+            }
+
+
+def render_recipes(request, recipes):
+    """
+    Представления рецептов (объектов с загруженным автором) для
+    request.user. Сериализуются только рецепты без фрагмента в кеше.
+    """
+    recipes = list(recipes)
+    if not recipes:
+        return []
+    keys = fragment_keys(request, recipes)
+    fragments = cache.get_many(keys.values())
+    missing = [recipe for recipe in recipes
+               if keys[recipe.pk] not in fragments]
+    if missing:
+        created = build_fragments(request, missing, keys)
+        cache.set_many(created, settings.RECIPE_FRAGMENT_TIMEOUT)
+        fragments.update(created)
+    # Рецепт, удалённый на основной БД, но ещё видный на реплике,
+    # пропускается.
+    fragments = [fragments[keys[recipe.pk]] for recipe in recipes
+                 if keys[recipe.pk] in fragments]
+    if not request.user.is_authenticated:
+        return fragments
+    flags = viewer_flags(request.user, fragments)
+    return [overlay(fragment, flags) for fragment in fragments]
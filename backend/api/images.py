@@ -0,0 +1,199 @@
+import io
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import connection, transaction
+from django.dispatch import Signal
+from django.utils import timezone
+from PIL import Image, ImageOps
+
+logger = logging.getLogger(__name__)
+
+# Расширение файла -> формат Pillow; WebP основной, JPEG запасной.
+VARIANT_FORMATS = (('webp', 'WEBP'), ('jpeg', 'JPEG'))
+
+# Отправляется, когда варианты сохранены: sender — модель, pk — объект.
+variants_ready = Signal()
+
+_executor = None
+_executor_lock = threading.Lock()
+# Места в очереди пула: задачи сверх IMAGE_VARIANT_QUEUE_SIZE
+# выполняются в потоке запроса, замедляя клиента вместо роста очереди.
+_slots = None
+
+
+def _get_executor():
+    global _executor, _slots
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _slots = threading.BoundedSemaphore(
+                    settings.IMAGE_VARIANT_QUEUE_SIZE)
+                _executor = ThreadPoolExecutor(
+                    max_workers=settings.IMAGE_VARIANT_WORKERS,
+                    thread_name_prefix='image-variants')
+    return _executor
+
+
+def _open_rgb(storage, name):
+    with storage.open(name, 'rb') as file:
+        with Image.open(file) as source:
+            image = ImageOps.exif_transpose(source)
+            if image.mode in ('RGBA', 'LA', 'P'):
+                image = image.convert('RGBA')
+                background = Image.new('RGB', image.size, 'white')
+                background.paste(image, mask=image.getchannel('A'))
+                return background
+            return image.convert('RGB')
+
+
+def build_variants(storage, name):
+    """
+    Создаёт уменьшенные копии картинки для каждого размера из
+    IMAGE_VARIANT_SIZES во всех форматах VARIANT_FORMATS.
+    Возвращает {вариант: {расширение: имя файла в хранилище}}.
+    """
+    directory, filename = os.path.split(os.path.splitext(name)[0])
+    image = _open_rgb(storage, name)
+    variants = {}
+    for variant, size in settings.IMAGE_VARIANT_SIZES.items():
+        resized = image.copy()
+        resized.thumbnail((size, size), Image.LANCZOS)
+        variants[variant] = {}
+        for extension, image_format in VARIANT_FORMATS:
+            buffer = io.BytesIO()
+            resized.save(buffer, image_format,
+                         quality=settings.IMAGE_VARIANT_QUALITY)
+            variant_name = os.path.join(
+                directory, 'variants', f'{filename}_{variant}.{extension}')
+            if storage.exists(variant_name):
+                storage.delete(variant_name)
+            variants[variant][extension] = storage.save(
+                variant_name, ContentFile(buffer.getvalue()))
+    return variants
+
+
+def process_variants(model, pk, field_name, name):
+    """
+    Строит варианты картинки name и сохраняет их в объект, если картинка
+    не сменилась. Возвращает True, если варианты сохранены.
+    """
+    storage = model._meta.get_field(field_name).storage
+    try:
+        variants = build_variants(storage, name)
+        changes = {f'{field_name}_variants': variants}
+        if any(field.name == 'updated_at'
+               for field in model._meta.concrete_fields):
+            # update() не трогает auto_now, а от updated_at зависят ETag
+            # и Last-Modified профиля.
+            changes['updated_at'] = timezone.now()
+        # Картинку могли заменить, пока шла обработка.
+        updated = model.objects.filter(pk=pk, **{field_name: name}).update(
+            **changes)
+        if updated:
+            variants_ready.send(sender=model, pk=pk)
+        return bool(updated)
+    except Exception:
+        logger.exception('Не удалось подготовить варианты %s', name)
+        return False
+
+
+def rebuild_variants(model, field_name, rebuild_all=False, batch_size=100):
+    """
+    Синхронно строит варианты для объектов с картинкой: по умолчанию
+    только тех, у которых вариантов нет (задача пула потеряна при
+    перезапуске процесса или загружена до появления вариантов).
+    Объекты читаются пачками по batch_size по возрастанию pk.
+    Возвращает, у скольких объектов варианты сохранены и у скольких нет.
+    """
+    queryset = model.objects.exclude(**{field_name: ''}).exclude(
+        **{f'{field_name}__isnull': True})
+    if not rebuild_all:
+        queryset = queryset.filter(**{f'{field_name}_variants': {}})
+    queryset = queryset.order_by('pk').values_list('pk', field_name)
+    rebuilt = failed = 0
+    last = 0
+    while True:
+        batch = list(queryset.filter(pk__gt=last)[:batch_size])
+        for pk, name in batch:
+            if process_variants(model, pk, field_name, name):
+                rebuilt += 1
+            else:
+                failed += 1
+        if len(batch) < batch_size:
+            return rebuilt, failed
+        last = batch[-1][0]
+
+
+def _run_in_pool(model, pk, field_name, name):
+    try:
+        process_variants(model, pk, field_name, name)
+    finally:
+        _slots.release()
+        connection.close()
+
+
+def remove_variant_files(instance, field_name, variants=None):
+    """
+    Удаляет файлы вариантов после фиксации транзакции: при откате
+    запись о них остаётся верной. По умолчанию берёт варианты из объекта,
+    например удалённого.
+    """
+    if variants is None:
+        variants = getattr(instance, f'{field_name}_variants')
+    storage = instance._meta.get_field(field_name).storage
+    names = [name for files in variants.values() for name in files.values()]
+    if not names:
+        return
+
+    def remove():
+        for name in names:
+            storage.delete(name)
+
+    transaction.on_commit(remove)
+
+
+def delete_variants(instance, field_name):
+    """
+    Сбрасывает варианты поля в объекте и удаляет их файлы. Варианты
+    читаются из БД: объект мог быть загружен до их готовности, например
+    снимок пользователя из кеша токенов.
+    """
+    variants_field = f'{field_name}_variants'
+    stored = type(instance).objects.filter(pk=instance.pk).values_list(
+        variants_field, flat=True).first()
+    remove_variant_files(instance, field_name, stored or {})
+    setattr(instance, variants_field, {})
+
+
+def schedule_variants(instance, field_name):
+    """
+    Сбрасывает варианты поля и ставит их пересборку в пул потоков после
+    фиксации транзакции. При IMAGE_VARIANT_WORKERS = 0 и при заполненной
+    очереди работает синхронно. Файлы прежних вариантов удаляет
+    delete_variants, который вызывается до сохранения новой картинки.
+    Задачи, потерянные при перезапуске процесса, восстанавливает команда
+    rebuild_image_variants.
+    """
+    model = type(instance)
+    variants_field = f'{field_name}_variants'
+    setattr(instance, variants_field, {})
+    model.objects.filter(pk=instance.pk).update(**{variants_field: {}})
+    name = getattr(instance, field_name).name
+    if not name:
+        return
+
+    def submit():
+        if settings.IMAGE_VARIANT_WORKERS > 0:
+            executor = _get_executor()
+            if _slots.acquire(blocking=False):
+                executor.submit(
+                    _run_in_pool, model, instance.pk, field_name, name)
+                return
+        process_variants(model, instance.pk, field_name, name)
+
+    transaction.on_commit(submit)
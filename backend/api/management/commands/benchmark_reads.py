@@ -0,0 +1,78 @@
+import statistics
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+
+DEFAULT_PATHS = (
+    '/api/recipes/',
+    '/api/recipes/?page=2',
+    '/api/ingredients/?name=%D1%81%D0%B0',
+)
+
+
+class Command(BaseCommand):
+    """
+    Management command to measure concurrent read throughput of a running
+    server. Each request gets a unique query parameter, so anonymous
+    responses are not served from the response cache; pass --cached to
+    measure cache hits instead.
+    Usage: python manage.py benchmark_reads http://localhost:8000
+    """
+    help = 'Benchmark concurrent GET requests against a running server'
+
+    def add_arguments(self, parser):
+        parser.add_argument('base_url')
+        parser.add_argument('--path', action='append', dest='paths',
+                            help='Path to request; may be repeated.')
+        parser.add_argument('--concurrency', type=int, default=50)
+        parser.add_argument('--requests', type=int, default=1000)
+        parser.add_argument('--token', help='Authorization token.')
+        parser.add_argument('--cached', action='store_true',
+                            help='Repeat the same URL for every request.')
+
+    def fetch(self, url, token):
+        request = urllib.request.Request(url)
+        if token:
+            request.add_header('Authorization', f'Token {token}')
+        started = time.perf_counter()
+        try:
+            with urllib.request.urlopen(request, timeout=30) as response:
+                response.read()
+                ok = response.status == 200
+        except (urllib.error.URLError, OSError):
+            ok = False
+        return ok, time.perf_counter() - started
+
+    @staticmethod
+    def url_for(url, number, cached):
+        if cached:
+            return url
+        separator = '&' if '?' in url else '?'
+        return f'{url}{separator}nocache={number}'
+
+    def handle(self, *args, **options):
+        paths = options['paths'] or DEFAULT_PATHS
+        base_url = options['base_url'].rstrip('/')
+        for path in paths:
+            url = base_url + path
+            with ThreadPoolExecutor(options['concurrency']) as executor:
+                started = time.perf_counter()
+                results = list(executor.map(
+                    lambda number: self.fetch(
+                        self.url_for(url, number, options['cached']),
+                        options['token']),
+                    range(options['requests'])))
+                elapsed = time.perf_counter() - started
+            latencies = sorted(latency for _, latency in results)
+            errors = sum(not ok for ok, _ in results)
+            quantiles = statistics.quantiles(latencies, n=100)
+            self.stdout.write(
+                f'{path}: {len(results) / elapsed:.1f} req/s, '
+                f'p50 {quantiles[49] * 1000:.1f} ms, '
+                f'p95 {quantiles[94] * 1000:.1f} ms, '
+                f'p99 {quantiles[98] * 1000:.1f} ms, '
+                f'errors {errors}'
+            )
@@ -0,0 +1,209 @@
+import io
+import random
+import time
+from array import array
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+
+from django.contrib.auth.hashers import make_password
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from PIL import Image
+
+from api.counters import COUNTERS, recount
+from api.models import (Favorite, Ingredient, IngredientInRecipe, Recipe,
+                        ShoppingCart)
+from api.feed import rebuild_feeds
+from api.search import rebuild_search_index
+from api.shortlinks import encode
+from api.versions import bump_version
+from users.models import Subscription, User
+
+PLACEHOLDER_IMAGE = 'recipes/images/placeholder.jpg'
+
+# Рецепты публикуются в течение года до этой даты: от текущего времени
+# результат с одним seed менялся бы от запуска к запуску.
+BASE_DATE = datetime(2026, 1, 1, tzinfo=timezone.utc)
+
+# Пресеты размеров: (пользователи, рецепты).
+PRESETS = {
+    '10k': (1_000, 10_000),
+    '1m': (100_000, 1_000_000),
+    '10m': (1_000_000, 10_000_000),
+}
+
+
+@contextmanager
+def explicit_pub_date():
+    """Позволяет задать pub_date вместо auto_now_add при bulk_create."""
+    field = Recipe._meta.get_field('pub_date')
+    field.auto_now_add = False
+    try:
+        yield
+    finally:
+        field.auto_now_add = True
+
+
+class Command(BaseCommand):
+    """
+    Management command to generate synthetic data for load testing.
+    Usage: python manage.py generate_data --preset 10k --seed 42
+    """
+    help = ('Generate users, recipes, favorites, shopping carts and '
+            'subscriptions with a power-law popularity distribution')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--preset', choices=PRESETS,
+                            help='Size preset: number of recipes.')
+        parser.add_argument('--users', type=int)
+        parser.add_argument('--recipes', type=int)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument(
+            '--skew', type=float, default=3.0,
+            help='Popularity skew: 1 is uniform, larger is more skewed.')
+
+    def handle(self, *args, **options):
+        users, recipes = PRESETS.get(options['preset'], (None, None))
+        users = options['users'] or users
+        recipes = options['recipes'] or recipes
+        if not users or not recipes:
+            raise CommandError('Укажите --preset или --users и --recipes.')
+        self.random = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        self.skew = options['skew']
+        self.prefix = f'synthetic{options["seed"]}_'
+
+        ingredient_ids = array('q', Ingredient.objects.order_by(
+            'id').values_list('id', flat=True))
+        if not ingredient_ids:
+            raise CommandError(
+                'Ингредиенты не загружены, сначала выполните load_data.')
+        if User.objects.filter(username__startswith=self.prefix).exists():
+            raise CommandError(
+                f'Данные с seed={options["seed"]} уже сгенерированы.')
+
+        self.ensure_placeholder_image()
+        user_ids = self.create_users(users)
+        recipe_ids = self.create_recipes(recipes, user_ids, ingredient_ids)
+        self.create_relations(Favorite, 'recipe', user_ids, recipe_ids,
+                              mean_per_user=8)
+        self.create_relations(ShoppingCart, 'recipe', user_ids, recipe_ids,
+                              mean_per_user=2)
+        self.create_relations(Subscription, 'author', user_ids, user_ids,
+                              mean_per_user=5, exclude_self=True)
+        # bulk_create не отправляет сигналы: пересчитываем счётчики,
+        # поисковый индекс, ленты подписок и сбрасываем кеш ленты вручную.
+        for model in COUNTERS:
+            recount(model, self.batch_size)
+        rebuild_search_index()
+        rebuild_feeds()
+        bump_version('recipes')
+        bump_version('recipe_ingredients')
+
+    def popular(self, ids):
+        """Элемент ids; первые элементы выбираются чаще (степенной закон)."""
+        return ids[int(len(ids) * self.random.random() ** self.skew)]
+
+    def per_user(self, mean):
+        """Число связей пользователя: распределение Парето."""
+        return int(self.random.paretovariate(1.2) * mean / 6)
+
+    def report(self, label, created, started):
+        elapsed = time.monotonic() - started
+        self.stdout.write(
+            f'{label}: {created} ({created / max(elapsed, 1e-6):.0f}/s)')
+
+    def batches(self, total):
+        for start in range(0, total, self.batch_size):
+            yield start, min(start + self.batch_size, total)
+
+    def ensure_placeholder_image(self):
+        if default_storage.exists(PLACEHOLDER_IMAGE):
+            return
+        buffer = io.BytesIO()
+        Image.new('RGB', (640, 480), (230, 230, 230)).save(buffer, 'JPEG')
+        default_storage.save(PLACEHOLDER_IMAGE,
+                             ContentFile(buffer.getvalue()))
+
+    def create_users(self, total):
+        started = time.monotonic()
+        # Хеширование пароля медленное, поэтому он общий для всех;
+        # соль от префикса, чтобы данные с одним seed совпадали.
+        password = make_password('synthetic-password',
+                                 salt=self.prefix.rstrip('_'))
+        user_ids = array('q')
+        for start, end in self.batches(total):
+            with transaction.atomic():
+                created = User.objects.bulk_create(
+                    User(
+                        username=f'{self.prefix}{i}',
+                        email=f'{self.prefix}{i}@example.com',
+                        first_name='Имя', last_name=f'Фамилия {i}',
+                        password=password,
+                    )
+                    for i in range(start, end)
+                )
+            user_ids.extend(user.pk for user in created)
+            self.report('Users', end, started)
+        return user_ids
+
+    def create_recipes(self, total, user_ids, ingredient_ids):
+        started = time.monotonic()
+        span = timedelta(days=365).total_seconds()
+        recipe_ids = array('q')
+        with explicit_pub_date():
+            for start, end in self.batches(total):
+                recipes = [
+                    Recipe(
+                        author_id=self.popular(user_ids),
+                        name=f'Рецепт {i}',
+                        text='Описание. ' * self.random.randint(1, 50),
+                        image=PLACEHOLDER_IMAGE,
+                        cooking_time=self.random.randint(5, 240),
+                        pub_date=BASE_DATE - timedelta(
+                            seconds=self.random.random() * span),
+                    )
+                    for i in range(start, end)
+                ]
+                with transaction.atomic():
+                    Recipe.objects.bulk_create(recipes)
+                    for recipe in recipes:
+                        recipe.short_code = encode(recipe.pk)
+                    Recipe.objects.bulk_update(recipes, ['short_code'])
+                    IngredientInRecipe.objects.bulk_create(
+                        IngredientInRecipe(
+                            recipe_id=recipe.pk, ingredient_id=ingredient_id,
+                            amount=self.random.randint(1, 1000))
+                        for recipe in recipes
+                        for ingredient_id in self.random.sample(
+                            ingredient_ids,
+                            min(self.random.randint(3, 20),
+                                len(ingredient_ids)))
+                    )
+                recipe_ids.extend(recipe.pk for recipe in recipes)
+                self.report('Recipes', end, started)
+        return recipe_ids
+
+    def create_relations(self, model, target, user_ids, target_ids,
+                         mean_per_user, exclude_self=False):
+        started = time.monotonic()
+        created = 0
+        rows = []
+        for user_id in user_ids:
+            targets = {self.popular(target_ids)
+                       for _ in range(self.per_user(mean_per_user))}
+            if exclude_self:
+                targets.discard(user_id)
+            rows.extend(model(user_id=user_id, **{f'{target}_id': target_id})
+                        for target_id in targets)
+            if len(rows) >= self.batch_size:
+                model.objects.bulk_create(rows)
+                created += len(rows)
+                rows = []
+                self.report(model._meta.verbose_name_plural, created, started)
+        model.objects.bulk_create(rows)
+        created += len(rows)
+        self.report(model._meta.verbose_name_plural, created, started)
@@ -1,71 +1,199 @@
+import csv
+import io
 import json
+import os
+import time
+from itertools import islice
+
 from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from api.catalog import ingredient_index
 from api.models import Ingredient
 
+FORMATS = {
+    '.json': 'json',
+    '.ndjson': 'ndjson',
+    '.jsonl': 'ndjson',
+    '.csv': 'csv',
+}
+CHUNK_SIZE = 64 * 1024
 
-class Command(BaseCommand):
+
+def iter_json_array(file, chunk_size=CHUNK_SIZE):
     """
-    Management command to load ingredients data from a JSON file.
-    Usage: python manage.py load_data
+    Читает JSON-массив объектов по одному элементу, не загружая файл
+    целиком в память.
     """
-    help = 'Load ingredients data from data/ingredients.json'
+    decoder = json.JSONDecoder()
+    buffer = ''
+    position = 0
+    started = False
+    eof = False
+    while True:
+        # Пропускаем пробелы и разделители между элементами.
+        while True:
+            while position < len(buffer) and buffer[position] in ' \t\r\n,':
+                position += 1
+            if position < len(buffer) or eof:
+                break
+            chunk = file.read(chunk_size)
+            eof = not chunk
+            buffer, position = buffer[position:] + chunk, 0
+        if position >= len(buffer):
+            raise json.JSONDecodeError('Unexpected end of file', buffer, 0)
+        if not started:
+            if buffer[position] != '[':
+                raise json.JSONDecodeError('Expected a JSON array',
+                                           buffer, position)
+            started = True
+            position += 1
+            continue
+        if buffer[position] == ']':
+            return
+        try:
+            item, position = decoder.raw_decode(buffer, position)
+        except json.JSONDecodeError:
+            if eof:
+                raise
+            chunk = file.read(chunk_size)
+            eof = not chunk
+            buffer, position = buffer[position:] + chunk, 0
+            continue
+        yield item
 
-    def handle(self, *args, **kwargs):
 
-        file_path = 'data/ingredients.json'
-        self.stdout.write(self.style.NOTICE(
-            f'Starting to load ingredients from {file_path}...'))
+def iter_ndjson(file):
+    for line in file:
+        if line.strip():
+            yield json.loads(line)
 
-        try:
-            with open(file_path, 'r', encoding='utf-8') as file:
-                data = json.load(file)
 
-            ingredients_to_create = []
+def iter_csv(file):
+    for row in csv.reader(file):
+        if not row or row == ['name', 'measurement_unit']:
+            continue
+        yield dict(zip(('name', 'measurement_unit'), row))
 
-            existing_ingredients = set(
-                Ingredient.objects.values_list('name', 'measurement_unit')
-            )
 
-            for item in data:
-                name = item.get('name')
-                measurement_unit = item.get('measurement_unit')
+READERS = {
+    'json': iter_json_array,
+    'ndjson': iter_ndjson,
+    'csv': iter_csv,
+}
 
-                if not name or not measurement_unit:
-                    self.stdout.write(self.style.WARNING(
-                        f"Skipping invalid item: {item}"))
-                    continue
 
-                if (name, measurement_unit) in existing_ingredients:
-                    continue
+class Command(BaseCommand):
+    """
+    Management command to load ingredients from JSON, NDJSON or CSV.
+    Usage: python manage.py load_data [path] [--format csv]
+    """
+    help = 'Load ingredients data from data/ingredients.json or another file'
 
-                ingredients_to_create.append(
-                    Ingredient(name=name, measurement_unit=measurement_unit)
-                )
+    def add_arguments(self, parser):
+        parser.add_argument('path', nargs='?',
+                            default='data/ingredients.json')
+        parser.add_argument('--format', choices=READERS,
+                            help='Defaults to the file extension.')
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--no-copy', action='store_true',
+                            help='Do not use COPY on PostgreSQL.')
 
-                existing_ingredients.add((name, measurement_unit))
+    def handle(self, *args, **options):
+        file_path = options['path']
+        file_format = options['format'] or FORMATS.get(
+            os.path.splitext(file_path)[1].lower())
+        if file_format is None:
+            self.stdout.write(self.style.ERROR(
+                f'Unknown file format: {file_path}. Use --format.'))
+            return
+        use_copy = (connection.vendor == 'postgresql'
+                    and connection.Database.__name__ == 'psycopg2'
+                    and not options['no_copy'])
+        self.stdout.write(self.style.NOTICE(
+            f'Starting to load ingredients from {file_path} '
+            f'({file_format}, {"COPY" if use_copy else "batched insert"})...'
+        ))
 
-            if ingredients_to_create:
-                Ingredient.objects.bulk_create(ingredients_to_create)
+        try:
+            count_before = Ingredient.objects.count()
+            self.started = time.monotonic()
+            self.read = 0
+            with open(file_path, 'r', encoding='utf-8', newline='') as file:
+                rows = self.valid_rows(READERS[file_format](file))
+                batch_size = options['batch_size']
+                while True:
+                    batch = list(islice(rows, batch_size))
+                    if not batch:
+                        break
+                    if use_copy:
+                        self.copy_batch(batch)
+                    else:
+                        Ingredient.objects.bulk_create(
+                            [Ingredient(name=name, measurement_unit=unit)
+                             for name, unit in batch],
+                            ignore_conflicts=True)
+                    self.report_progress()
+            created = Ingredient.objects.count() - count_before
+            if created:
+                # bulk_create и COPY не отправляют post_save.
+                ingredient_index.invalidate()
                 self.stdout.write(self.style.SUCCESS(
-                    f'Successfully loaded {len(ingredients_to_create)} new'
-                    'ingredients.'
-                ))
+                    f'Successfully loaded {created} new ingredients.'))
             else:
                 self.stdout.write(self.style.SUCCESS(
-                    'All ingredients are already up to date.'
-                ))
+                    'All ingredients are already up to date.'))
 
         except FileNotFoundError:
             self.stdout.write(self.style.ERROR(
                 f'File not found: {file_path}. '
-                'Make sure the data folder with ingredients.json is in the'
+                'Make sure the data folder with ingredients is in the '
                 'backend root directory.'
             ))
-        except json.JSONDecodeError:
+        except (json.JSONDecodeError, csv.Error) as e:
             self.stdout.write(self.style.ERROR(
-                f'Error decoding JSON from {file_path}. Please check if the'
-                'file is a valid JSON.'
-            ))
+                f'Error parsing {file_path}: {e}'))
         except Exception as e:
             self.stdout.write(self.style.ERROR(
                 f'An unexpected error occurred: {e}'))
+
+    def valid_rows(self, items):
+        for item in items:
+            self.read += 1
+            name = item.get('name') if isinstance(item, dict) else None
+            measurement_unit = (item.get('measurement_unit')
+                                if isinstance(item, dict) else None)
+            if not name or not measurement_unit:
+                self.stdout.write(self.style.WARNING(
+                    f'Skipping invalid item: {item}'))
+                continue
+            yield name.strip(), measurement_unit.strip()
+
+    def report_progress(self):
+        elapsed = time.monotonic() - self.started
+        self.stdout.write(
+            f'Processed {self.read} rows '
+            f'({self.read / max(elapsed, 1e-6):.0f} rows/s)')
+
+    def copy_batch(self, batch):
+        """
+        COPY пачки во временную таблицу и перенос новых строк
+        в api_ingredient с пропуском уже существующих.
+        """
+        table = Ingredient._meta.db_table
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(batch)
+        buffer.seek(0)
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(
+                'CREATE TEMP TABLE ingredient_import '
+                '(name varchar(200), measurement_unit varchar(200))')
+            cursor.copy_expert(
+                'COPY ingredient_import (name, measurement_unit) '
+                'FROM STDIN WITH (FORMAT csv)', buffer)
+            cursor.execute(
+                f'INSERT INTO {table} (name, measurement_unit) '
+                'SELECT DISTINCT name, measurement_unit '
+                'FROM ingredient_import '
+                'ON CONFLICT (name, measurement_unit) DO NOTHING')
+            cursor.execute('DROP TABLE ingredient_import')
@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand
+
+from api.images import rebuild_variants
+from api.models import Recipe
+from users.models import User
+
+IMAGE_FIELDS = ((Recipe, 'image'), (User, 'avatar'))
+
+
+class Command(BaseCommand):
+    """
+    Management command to build missing image variants of recipes and
+    avatars, e.g. after pool tasks were lost on a worker restart.
+    Usage: python manage.py rebuild_image_variants [--all]
+    """
+    help = ('Build size variants of recipe images and avatars that have '
+            'none; with --all rebuild every variant')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', dest='rebuild_all',
+                            help='Rebuild variants that already exist.')
+        parser.add_argument('--batch-size', type=int, default=100)
+
+    def handle(self, *args, **options):
+        for model, field_name in IMAGE_FIELDS:
+            rebuilt, failed = rebuild_variants(
+                model, field_name, options['rebuild_all'],
+                options['batch_size'])
+            style = self.style.WARNING if failed else self.style.SUCCESS
+            self.stdout.write(style(
+                f'{model._meta.verbose_name_plural}: {rebuilt} rebuilt, '
+                f'{failed} failed.'))
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from api.counters import COUNTERS, recount
+
+
+class Command(BaseCommand):
+    """
+    Management command to recompute denormalized counters.
+    Usage: python manage.py repair_counters
+    """
+    help = ('Recompute favorite and shopping cart counts of recipes and '
+            'recipe, follower and following counts of users')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=10000)
+
+    def handle(self, *args, **options):
+        for model in COUNTERS:
+            updated = recount(model, options['batch_size'])
+            self.stdout.write(self.style.SUCCESS(
+                f'{model._meta.verbose_name_plural}: {updated} updated.'))
@@ -0,0 +1,275 @@
+"""
+Метрики запросов: число и время SQL-запросов, время сериализации,
+размер ответа и длительность обработки.
+
+Сериализацией считается отрисовка тела ответа DRF (замеряется
+промежуточным слоем вокруг render()), to_representation() сериализаторов
+проекта (TimedRepresentationMixin), в том числе вызванный через .data
+внутри представления, и блоки timed_serialization(), например сборка
+фрагментов рецептов.
+
+RequestMetricsMiddleware (включается REQUEST_METRICS) собирает их для
+каждого запроса, отдаёт в заголовке Server-Timing и накапливает по
+имени представления и действия, например RecipeViewSet.list. Сводка
+публикуется в текстовом формате Prometheus на /api/_metrics. Сводка
+своя у каждого процесса: при нескольких воркерах каждый из них нужно
+опрашивать отдельно.
+"""
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.http import Http404, HttpResponse
+from rest_framework.decorators import api_view, permission_classes
+from rest_framework.permissions import IsAdminUser
+
+# Границы корзин гистограмм.
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+_current = ContextVar('request_metrics', default=None)
+
+
+class RequestMetrics:
+    """Метрики одного запроса."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.db_time = 0.0
+        self.serialize_time = 0.0
+        self.serializing = False
+
+
+def record_query(execute, sql, params, many, context):
+    """Обёртка connection.execute_wrapper для всех соединений."""
+    metrics = _current.get()
+    if metrics is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        metrics.queries += 1
+        metrics.db_time += time.perf_counter() - started
+
+
+def instrument(connection, **kwargs):
+    # Обёртка ставится на соединение насовсем, а не на время запроса:
+    # асинхронные представления обращаются к БД из других потоков.
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+@contextmanager
+def timed_serialization():
+    """Учитывает время блока как сериализацию текущего запроса."""
+    metrics = _current.get()
+    # Вложенные блоки учтены во внешнем.
+    if metrics is None or metrics.serializing:
+        yield
+        return
+    metrics.serializing = True
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics.serialize_time += time.perf_counter() - started
+        metrics.serializing = False
+
+
+class TimedRepresentationMixin:
+    """Время to_representation() сериализатора учитывается как сериализация."""
+
+    def to_representation(self, instance):
+        with timed_serialization():
+            return super().to_representation(instance)
+
+
+class Histogram:
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[index] += 1
+        self.sum += value
+        self.count += 1
+
+
+class ViewStats:
+
+    def __init__(self):
+        self.duration = Histogram(DURATION_BUCKETS)
+        self.queries = Histogram(QUERY_BUCKETS)
+        self.db_time = 0.0
+        self.serialize_time = 0.0
+        self.response_bytes = 0
+
+
+class MetricsRegistry:
+    """Сводка метрик процесса по представлениям."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._views = {}
+
+    def observe(self, view, metrics, duration, size):
+        with self._lock:
+            stats = self._views.get(view)
+            if stats is None:
+                stats = self._views[view] = ViewStats()
+            stats.duration.observe(duration)
+            stats.queries.observe(metrics.queries)
+            stats.db_time += metrics.db_time
+            stats.serialize_time += metrics.serialize_time
+            stats.response_bytes += size
+
+    def clear(self):
+        with self._lock:
+            self._views.clear()
+
+    def render(self):
+        """Сводка в текстовом формате Prometheus."""
+        with self._lock:
+            views = sorted(self._views.items())
+            lines = []
+            self._render_histogram(
+                lines, views, 'duration', 'foodgram_request_duration_seconds',
+                'Request processing time.')
+            self._render_histogram(
+                lines, views, 'queries', 'foodgram_request_db_queries',
+                'SQL queries per request.')
+            for attr, name, help_text in (
+                ('db_time', 'foodgram_db_duration_seconds_total',
+                 'Time spent in SQL queries.'),
+                ('serialize_time',
+                 'foodgram_serializer_duration_seconds_total',
+                 'Time spent serializing responses.'),
+                ('response_bytes', 'foodgram_response_bytes_total',
+                 'Size of non-streaming response bodies.'),
+            ):
+                lines.append(f'# HELP {name} {help_text}')
+                lines.append(f'# TYPE {name} counter')
+                for view, stats in views:
+                    lines.append(
+                        f'{name}{{view="{view}"}} {getattr(stats, attr)}')
+        return '\n'.join(lines) + '\n'
+
+    @staticmethod
+    def _render_histogram(lines, views, attr, name, help_text):
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} histogram')
+        for view, stats in views:
+            histogram = getattr(stats, attr)
+            for bound, count in zip(histogram.buckets, histogram.counts):
+                lines.append(
+                    f'{name}_bucket{{view="{view}",le="{bound}"}} {count}')
+            lines.append(
+                f'{name}_bucket{{view="{view}",le="+Inf"}} '
+                f'{histogram.count}')
+            lines.append(f'{name}_sum{{view="{view}"}} {histogram.sum}')
+            lines.append(f'{name}_count{{view="{view}"}} {histogram.count}')
+
+
+registry = MetricsRegistry()
+
+
+def view_name(request):
+    """Имя представления и действия, например RecipeViewSet.list."""
+    match = request.resolver_match
+    if match is None:
+        return 'unresolved'
+    func = match.func
+    view_class = getattr(func, 'cls', None)
+    if view_class is None:
+        return f'{func.__module__}.{func.__qualname__}'
+    method = request.method.lower()
+    actions = getattr(func, 'actions', None) or {}
+    return f'{view_class.__name__}.{actions.get(method, method)}'
+
+
+def server_timing(metrics, duration):
+    return ', '.join((
+        f'db;dur={metrics.db_time * 1000:.2f};'
+        f'desc="{metrics.queries} queries"',
+        f'serialize;dur={metrics.serialize_time * 1000:.2f}',
+        f'total;dur={duration * 1000:.2f}',
+    ))
+
+
+class RequestMetricsMiddleware:
+    """Метрики запроса в Server-Timing и в сводку registry."""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.REQUEST_METRICS:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+        connection_created.connect(
+            instrument, dispatch_uid='api.metrics.instrument')
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        # Соединения, открытые до подключения сигнала.
+        for connection in connections.all(initialized_only=True):
+            instrument(connection)
+        metrics = RequestMetrics()
+        token = _current.set(metrics)
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.finish(request, response, metrics)
+
+    async def __acall__(self, request):
+        metrics = RequestMetrics()
+        token = _current.set(metrics)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.finish(request, response, metrics)
+
+    def process_template_response(self, request, response):
+        # Ответ DRF отрисовывается сразу после этого шага.
+        metrics = _current.get()
+        if metrics is not None:
+            started = time.perf_counter()
+
+            def rendered(response):
+                metrics.serialize_time += time.perf_counter() - started
+
+            response.add_post_render_callback(rendered)
+        return response
+
+    def finish(self, request, response, metrics):
+        duration = time.perf_counter() - metrics.started
+        size = 0 if response.streaming else len(response.content)
+        registry.observe(view_name(request), metrics, duration, size)
+        response['Server-Timing'] = server_timing(metrics, duration)
+        return response
+
+
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def metrics_view(request):
+    if not settings.REQUEST_METRICS:
+        raise Http404
+    return HttpResponse(registry.render(),
+                        content_type='text/plain; version=0.0.4')
@@ -0,0 +1,53 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:43
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+TABLE = 'api_ingredientinrecipe'
+CONSTRAINT = 'unique_ingredient_in_recipe'
+
+
+def include_amount(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(
+            f'ALTER TABLE {TABLE} DROP CONSTRAINT {CONSTRAINT}, '
+            f'ADD CONSTRAINT {CONSTRAINT} '
+            'UNIQUE (recipe_id, ingredient_id) INCLUDE (amount)')
+
+
+def exclude_amount(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(
+            f'ALTER TABLE {TABLE} DROP CONSTRAINT {CONSTRAINT}, '
+            f'ADD CONSTRAINT {CONSTRAINT} UNIQUE (recipe_id, ingredient_id)')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0003_image_variants'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='recipe',
+            name='author',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='recipes', to=settings.AUTH_USER_MODEL, verbose_name='Автор'),
+        ),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(fields=['pub_date', 'id'], name='recipe_pub_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(fields=['author', 'pub_date'], name='recipe_author_pub_date_idx'),
+        ),
+        # Список покупок читает amount из индекса уникальности (recipe,
+        # ingredient): в PostgreSQL amount включается в него. В SQLite
+        # INCLUDE нет, и amount читается из строки таблицы. INCLUDE не
+        # входит в состояние моделей: UniqueConstraint с include в
+        # SQLite не создаётся вовсе.
+        migrations.RunPython(include_amount, exclude_amount),
+    ]
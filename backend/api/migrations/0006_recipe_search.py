@@ -0,0 +1,50 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:55
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.conf import settings
+from django.db import migrations
+
+SEARCH_INDEX = django.contrib.postgres.indexes.GinIndex(
+    django.contrib.postgres.search.SearchVector(
+        'name', 'text', config='russian'),
+    name='recipe_search_idx')
+
+
+def create_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        schema_editor.add_index(apps.get_model('api', 'Recipe'), SEARCH_INDEX)
+    elif vendor == 'sqlite':
+        schema_editor.execute(
+            'CREATE VIRTUAL TABLE api_recipe_fts USING fts5('
+            "name, text, tokenize = 'unicode61 remove_diacritics 2')")
+        schema_editor.execute(
+            'INSERT INTO api_recipe_fts (rowid, name, text) '
+            "SELECT id, replace(replace(name, 'ё', 'е'), 'Ё', 'Е'), "
+            "replace(replace(text, 'ё', 'е'), 'Ё', 'Е') FROM api_recipe")
+
+
+def drop_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        schema_editor.remove_index(
+            apps.get_model('api', 'Recipe'), SEARCH_INDEX)
+    elif vendor == 'sqlite':
+        schema_editor.execute('DROP TABLE api_recipe_fts')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0005_counters'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        # GIN-индекс существует только в PostgreSQL, в SQLite вместо него
+        # создаётся таблица FTS5. В состояние моделей индекс не входит:
+        # иначе SQLite пытался бы создать его при пересоздании таблицы
+        # рецептов в следующих миграциях.
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
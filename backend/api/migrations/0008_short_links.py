@@ -0,0 +1,59 @@
+from django.db import migrations, models
+
+ALPHABET = (
+    '0123456789abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ')
+CODE_LENGTH = 6
+CODE_MULTIPLIER = 2_971_215_073
+NUMERIC_CODE_PREFIX = 'x'
+
+
+def encode(pk):
+    # Копия api.shortlinks.encode на момент миграции.
+    number = pk * CODE_MULTIPLIER % len(ALPHABET) ** CODE_LENGTH
+    chars = []
+    for _ in range(CODE_LENGTH):
+        number, digit = divmod(number, len(ALPHABET))
+        chars.append(ALPHABET[digit])
+    code = ''.join(reversed(chars))
+    if code.isdigit():
+        return NUMERIC_CODE_PREFIX + code
+    return code
+
+
+def fill_short_codes(apps, schema_editor):
+    Recipe = apps.get_model('api', 'Recipe')
+    recipes = Recipe.objects.filter(short_code__isnull=True).only('pk')
+    batch = []
+    for recipe in recipes.iterator(chunk_size=2000):
+        recipe.short_code = encode(recipe.pk)
+        batch.append(recipe)
+        if len(batch) == 2000:
+            Recipe.objects.bulk_update(batch, ['short_code'])
+            batch = []
+    Recipe.objects.bulk_update(batch, ['short_code'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0006_recipe_search'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='short_code',
+            field=models.CharField(blank=True, editable=False, max_length=16, null=True, verbose_name='Код короткой ссылки'),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='short_link_clicks',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Переходы по короткой ссылке'),
+        ),
+        migrations.RunPython(fill_short_codes, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='recipe',
+            name='short_code',
+            field=models.CharField(blank=True, editable=False, max_length=16, null=True, unique=True, verbose_name='Код короткой ссылки'),
+        ),
+    ]
@@ -0,0 +1,22 @@
+class CountersMixin:
+    """
+    Поля-счётчики меняются только через update() с F(), поэтому обычный
+    save() существующего объекта их не перезаписывает: значения в памяти
+    могли устареть. Вставка и явный update_fields пишут их как обычно.
+    """
+    counter_fields = ()
+
+    def save(self, *args, **kwargs):
+        if self.pk is None and not self._state.adding:
+            # Копия сохранённого объекта (pk = None) начинает с нуля.
+            for name in self.counter_fields:
+                setattr(self, name, self._meta.get_field(name).get_default())
+        super().save(*args, **kwargs)
+
+    def _do_update(self, base_qs, using, pk_val, values, update_fields,
+                   forced_update):
+        if update_fields is None:
+            values = [value for value in values
+                      if value[0].name not in self.counter_fields]
+        return super()._do_update(base_qs, using, pk_val, values,
+                                  update_fields, forced_update)
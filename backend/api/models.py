@@ -1,6 +1,7 @@
 from django.db import models
 from django.core.validators import MinValueValidator
 from users.models import User
+from .mixins import CountersMixin
 
 
 class Ingredient(models.Model):
@@ -18,15 +19,19 @@ class Ingredient(models.Model):
         return f'{self.name}, {self.measurement_unit}'
 
 
-class Recipe(models.Model):
+class Recipe(CountersMixin, models.Model):
     author = models.ForeignKey(
         User,
         on_delete=models.CASCADE,
         related_name='recipes',
-        verbose_name='Автор'
+        verbose_name='Автор',
+        # Покрывается составным индексом (author, pub_date).
+        db_index=False,
     )
     name = models.CharField('Название', max_length=200)
     image = models.ImageField('Картинка', upload_to='recipes/images/')
+    image_variants = models.JSONField(
+        'Варианты картинки', default=dict, blank=True, editable=False)
     text = models.TextField('Описание')
     ingredients = models.ManyToManyField(
         Ingredient,
@@ -42,15 +47,42 @@ class Recipe(models.Model):
         ]
     )
     pub_date = models.DateTimeField('Дата публикации', auto_now_add=True)
+    favorites_count = models.PositiveIntegerField(
+        'Число добавлений в избранное', default=0, editable=False)
+    shopping_cart_count = models.PositiveIntegerField(
+        'Число добавлений в список покупок', default=0, editable=False)
+    short_code = models.CharField(
+        'Код короткой ссылки', max_length=16, unique=True, null=True,
+        blank=True, editable=False)
+    short_link_clicks = models.PositiveIntegerField(
+        'Переходы по короткой ссылке', default=0, editable=False)
+
+    counter_fields = ('favorites_count', 'shopping_cart_count',
+                      'short_link_clicks')
 
     class Meta:
         verbose_name = 'Рецепт'
         verbose_name_plural = 'Рецепты'
         ordering = ('-pub_date',)
+        indexes = [
+            # Лента и курсорная пагинация.
+            models.Index(fields=['pub_date', 'id'],
+                         name='recipe_pub_date_idx'),
+            # Фильтр по автору и превью рецептов в подписках.
+            models.Index(fields=['author', 'pub_date'],
+                         name='recipe_author_pub_date_idx'),
+        ]
 
     def __str__(self):
         return self.name
 
+    def save(self, *args, **kwargs):
+        if self.pk is None:
+            # Код вычисляется из pk, см. api/shortlinks.py; копия рецепта
+            # получает свой после вставки.
+            self.short_code = None
+        super().save(*args, **kwargs)
+
 
 class IngredientInRecipe(models.Model):
     recipe = models.ForeignKey(
@@ -69,6 +101,8 @@ class IngredientInRecipe(models.Model):
         verbose_name = 'Ингредиент в рецепте'
         verbose_name_plural = 'Ингредиенты в рецептах'
         constraints = [
+            # В PostgreSQL индекс ограничения покрывает и amount
+            # (INCLUDE, миграция 0004) для суммирования списка покупок.
             models.UniqueConstraint(
                 fields=['recipe', 'ingredient'],
                 name='unique_ingredient_in_recipe'
@@ -100,3 +134,45 @@ class ShoppingCart(models.Model):
         verbose_name_plural = 'Списки покупок'
         constraints = [models.UniqueConstraint(
             fields=['user', 'recipe'], name='unique_shopping_cart')]
+
+
+class FeedEntry(models.Model):
+    """
+    Рецепт в ленте подписок пользователя. Строки добавляются при
+    публикации рецепта и подписке, удаляются при отписке и удалении
+    рецепта (см. api/feed.py); author и pub_date повторяют поля рецепта.
+    """
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='feed_entries',
+        verbose_name='Подписчик',
+        # Покрывается индексом ленты (user, pub_date, recipe).
+        db_index=False,
+    )
+    recipe = models.ForeignKey(
+        Recipe, on_delete=models.CASCADE, related_name='+',
+        verbose_name='Рецепт')
+    author = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='+',
+        verbose_name='Автор',
+        # Покрывается индексом (author, user).
+        db_index=False,
+    )
+    pub_date = models.DateTimeField('Дата публикации')
+
+    class Meta:
+        verbose_name = 'Запись ленты подписок'
+        verbose_name_plural = 'Записи ленты подписок'
+        indexes = [
+            # Чтение ленты — просмотр диапазона индекса.
+            models.Index(fields=['user', '-pub_date', '-recipe'],
+                         name='feed_user_pub_date_idx'),
+            # Очистка ленты при отписке.
+            models.Index(fields=['author', 'user'],
+                         name='feed_author_user_idx'),
+        ]
+        constraints = [models.UniqueConstraint(
+            fields=['user', 'recipe'], name='unique_feed_entry')]
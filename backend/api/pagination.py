@@ -1,4 +1,10 @@
-from rest_framework.pagination import PageNumberPagination
+import json
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import (CursorPagination, Cursor,
+                                       PageNumberPagination)
 
 
 class CustomPageNumberPagination(PageNumberPagination):
@@ -6,3 +12,160 @@ class CustomPageNumberPagination(PageNumberPagination):
     Custom pagination class to use 'limit' as the page size query parameter.
     """
     page_size_query_param = 'limit'
+
+
+class KeysetCursorPagination(CursorPagination):
+    """
+    Cursor pagination that seeks on every ordering field.
+
+    DRF's CursorPagination seeks on the first field only and steps over
+    ties with an offset, which stops working past offset_cutoff. Here the
+    cursor holds all ordering values of the boundary row, and the next
+    page is selected with a tuple comparison such as
+    (pub_date < x) OR (pub_date = x AND id < y). The last ordering field
+    must be unique.
+
+    Several querysets can be paginated together: each is read up to the
+    page size past the cursor, and the rows are merged. Rows of the
+    later querysets must carry the ordering fields of the first model,
+    possibly as annotations; rows with equal ordering values count once.
+    """
+
+    def paginate_queryset(self, queryset, request, view=None):
+        sources = (queryset if isinstance(queryset, (list, tuple))
+                   else [queryset])
+        self.model = sources[0].model
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+        self.base_url = request.build_absolute_uri()
+        self.ordering = self.get_ordering(request, sources[0], view)
+        self.cursor = self.decode_cursor(request)
+        reverse = self.cursor is not None and self.cursor.reverse
+        position = self.cursor and self.cursor.position
+        ordering = self.ordering
+        if reverse:
+            ordering = [field[1:] if field.startswith('-') else f'-{field}'
+                        for field in ordering]
+        values = (self._decode_position(self.model, position)
+                  if position is not None else None)
+        results = []
+        for source in sources:
+            source = source.order_by(*ordering)
+            if values is not None:
+                source = source.filter(self._seek(ordering, values))
+            results.extend(source[:self.page_size + 1])
+        if len(sources) > 1:
+            results = self._merge(results, ordering)[:self.page_size + 1]
+        self.page = results[:self.page_size]
+        has_more = len(results) > self.page_size
+        if reverse:
+            self.page.reverse()
+            self.has_next, self.has_previous = position is not None, has_more
+        else:
+            self.has_next, self.has_previous = has_more, position is not None
+        self.display_page_controls = self.has_next or self.has_previous
+        return self.page
+
+    def _merge(self, rows, ordering):
+        """Rows of several querysets in the given ordering, deduplicated."""
+        def values(row):
+            return [field.value_from_object(row)
+                    for field in self._fields(self.model)]
+
+        # The sort is stable: sorting by the last field first orders by
+        # all fields with their own directions.
+        for index, field in reversed(list(enumerate(ordering))):
+            rows.sort(key=lambda row: values(row)[index],
+                      reverse=field.startswith('-'))
+        merged = []
+        for row in rows:
+            if not merged or values(merged[-1]) != values(row):
+                merged.append(row)
+        return merged
+
+    @staticmethod
+    def _seek(ordering, values):
+        """Rows after values in the given ordering."""
+        condition = Q()
+        equal = {}
+        for field, value in zip(ordering, values):
+            name = field.lstrip('-')
+            lookup = 'lt' if field.startswith('-') else 'gt'
+            condition |= Q(**equal, **{f'{name}__{lookup}': value})
+            equal[name] = value
+        return condition
+
+    def _fields(self, model):
+        return [model._meta.get_field(field.lstrip('-'))
+                for field in self.ordering]
+
+    def _encode_position(self, instance):
+        return json.dumps([field.value_to_string(instance)
+                           for field in self._fields(self.model)])
+
+    def _decode_position(self, model, position):
+        try:
+            values = json.loads(position)
+            fields = self._fields(model)
+            if not isinstance(values, list) or len(values) != len(fields):
+                raise ValueError
+            return [field.to_python(value)
+                    for field, value in zip(fields, values)]
+        except (ValueError, TypeError, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(Cursor(
+            offset=0, reverse=False,
+            position=self._encode_position(self.page[-1])))
+
+    def get_previous_link(self):
+        if not self.has_previous or not self.page:
+            return None
+        return self.encode_cursor(Cursor(
+            offset=0, reverse=True,
+            position=self._encode_position(self.page[0])))
+
+
+class RecipeCursorPagination(KeysetCursorPagination):
+    """
+    Keyset pagination over (pub_date, id) without COUNT(*) and OFFSET.
+    """
+    ordering = ('-pub_date', '-id')
+    page_size_query_param = 'limit'
+
+
+class FeedCursorPagination(KeysetCursorPagination):
+    """Keyset pagination over the subscription feed index."""
+    ordering = ('-pub_date', '-recipe_id')
+    page_size_query_param = 'limit'
+
+
+class SubscriptionCursorPagination(CursorPagination):
+    """Keyset pagination over followed authors in subscription order."""
+    ordering = ('id',)
+    page_size_query_param = 'limit'
+
+
+class OptionalCursorPaginationMixin:
+    """
+    Switches a view to cursor_pagination_class when the client asks for it
+    with ?pagination=cursor. Page-number pagination stays the default.
+    """
+    cursor_pagination_class = None
+
+    @property
+    def paginator(self):
+        if not hasattr(self, '_paginator'):
+            pagination_class = self.pagination_class
+            if (self.cursor_pagination_class is not None
+                    and self.request.query_params.get(
+                        'pagination') == 'cursor'):
+                pagination_class = self.cursor_pagination_class
+            self._paginator = (
+                pagination_class() if pagination_class is not None else None)
+        return self._paginator
@@ -0,0 +1,63 @@
+"""
+Добавление рецептов в избранное и список покупок и удаление из них.
+
+Каждая операция — один запрос INSERT ... SELECT ... ON CONFLICT DO
+NOTHING или DELETE с RETURNING, поэтому повторные и одновременные
+запросы не приводят к IntegrityError, а ответ и счётчики строятся по
+реально изменённым строкам. Сигналы post_save/post_delete при этом не
+отправляются, вместо них отправляется recipes_linked (см.
+api/signals.py).
+"""
+from django.db import connections, router, transaction
+from django.dispatch import Signal
+
+from .models import Recipe
+
+# sender — модель связи, user_id, recipe_ids — изменённые рецепты,
+# delta: 1 — добавлены, -1 — удалены.
+recipes_linked = Signal()
+
+
+def _placeholders(values):
+    return ', '.join(['%s'] * len(values))
+
+
+def _change(model, user, recipe_ids, sql, delta):
+    recipe_ids = list(dict.fromkeys(recipe_ids))
+    if not recipe_ids:
+        return []
+    using = router.db_for_write(model)
+    # Запрос и счётчики меняются вместе; точка сохранения не нужна.
+    with transaction.atomic(using, savepoint=False):
+        with connections[using].cursor() as cursor:
+            cursor.execute(sql.format(
+                link=model._meta.db_table, recipe=Recipe._meta.db_table,
+                ids=_placeholders(recipe_ids)), [user.pk, *recipe_ids])
+            changed = {row[0] for row in cursor.fetchall()}
+        changed = [pk for pk in recipe_ids if pk in changed]
+        if changed:
+            recipes_linked.send(sender=model, user_id=user.pk,
+                                recipe_ids=changed, delta=delta)
+    return changed
+
+
+def link_recipes(model, user, recipe_ids):
+    """
+    Добавляет существующие рецепты из recipe_ids, пропуская уже
+    добавленные. Возвращает id добавленных в порядке recipe_ids.
+    """
+    return _change(
+        model, user, recipe_ids,
+        'INSERT INTO {link} (user_id, recipe_id) '
+        'SELECT %s, id FROM {recipe} WHERE id IN ({ids}) '
+        'ON CONFLICT (user_id, recipe_id) DO NOTHING RETURNING recipe_id',
+        1)
+
+
+def unlink_recipes(model, user, recipe_ids):
+    """Удаляет рецепты из recipe_ids. Возвращает id удалённых."""
+    return _change(
+        model, user, recipe_ids,
+        'DELETE FROM {link} WHERE user_id = %s AND recipe_id IN ({ids}) '
+        'RETURNING recipe_id',
+        -1)
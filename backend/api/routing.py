@@ -0,0 +1,163 @@
+"""
+Чтение с реплики БД с гарантией чтения своих записей.
+
+ReadReplicaMiddleware (включается, если задан READ_REPLICA_DATABASE)
+отправляет запросы GET, HEAD и OPTIONS к представлениям с атрибутом
+read_from_replica (у класса или у функции, см. декоратор) на реплику,
+а ReadReplicaRouter направляет туда чтение моделей api и users.
+Токены, сессии и запись, в том числе запросы SQL без ORM в
+api/feed.py, api/search.py и api/relations.py, всегда идут на основную
+БД. Поиск читает таблицу FTS внутри запроса ORM и следует за ним.
+
+Ответ на успешный изменяющий запрос несёт время записи в мс: в cookie
+LAST_WRITE_COOKIE и в заголовке LAST_WRITE_HEADER. Клиент, который
+вернул его в cookie или в том же заголовке, READ_REPLICA_STICKY_SECONDS
+секунд читает с основной БД и видит свои изменения, пока они доходят до
+реплики. Общего состояния между процессами для этого не нужно.
+
+Общие кеши (фрагменты рецептов, ответы анонимам) хранятся под версиями
+данных и живут долго. Реплика может отставать от уже увеличенной
+версии, поэтому кеши заполняются чтением с основной БД, см.
+primary_reads(). Промах кеша обходится в запрос к основной БД, а
+попадание — без обращения к БД вовсе.
+
+Проверка на SQLite: скопировать db.sqlite3 в replica.sqlite3 и
+запустить сервер с DB_REPLICA_NAME=replica.sqlite3.
+"""
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import DEFAULT_DB_ALIAS
+from rest_framework.permissions import SAFE_METHODS
+
+# Приложения, модели которых читаются с реплики.
+REPLICA_APPS = frozenset({'api', 'users'})
+LAST_WRITE_COOKIE = 'last_write'
+LAST_WRITE_HEADER = 'X-Last-Write'
+
+_current = ContextVar('read_routing', default=None)
+
+
+class ReadRouting:
+    """Куда читает текущий запрос: alias реплики или None — основная БД."""
+
+    def __init__(self):
+        self.alias = None
+
+
+def _now_ms():
+    return int(time.time() * 1000)
+
+
+def last_write(request):
+    """Время последней записи клиента в мс или None."""
+    value = (request.COOKIES.get(LAST_WRITE_COOKIE)
+             or request.headers.get(LAST_WRITE_HEADER))
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def wrote_recently(request):
+    written = last_write(request)
+    # Время из будущего — ошибка клиента, а не повод читать с основной БД.
+    return (written is not None and 0 <= _now_ms() - written
+            < settings.READ_REPLICA_STICKY_SECONDS * 1000)
+
+
+def read_from_replica(view):
+    """Отмечает функцию-представление для чтения с реплики."""
+    view.read_from_replica = True
+    return view
+
+
+@contextmanager
+def primary_reads():
+    """
+    Чтение внутри блока идёт на основную БД. Значение блока — True, если
+    до него запрос читал с реплики и прочитанное стоит перечитать.
+    """
+    state = _current.get()
+    if state is None or state.alias is None:
+        yield False
+        return
+    alias, state.alias = state.alias, None
+    try:
+        yield True
+    finally:
+        state.alias = alias
+
+
+class ReadReplicaRouter:
+
+    def db_for_read(self, model, **hints):
+        state = _current.get()
+        if (state is None or state.alias is None
+                or model._meta.app_label not in REPLICA_APPS):
+            return None
+        return state.alias
+
+    def db_for_write(self, model, **hints):
+        return None
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Объекты с реплики и основной БД — одни и те же строки.
+        databases = {DEFAULT_DB_ALIAS, settings.READ_REPLICA_DATABASE}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+
+class ReadReplicaMiddleware:
+    """Выбор БД для чтения и привязка клиента к основной БД после записи."""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.READ_REPLICA_DATABASE:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        token = _current.set(ReadRouting())
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.finish(request, response)
+
+    async def __acall__(self, request):
+        token = _current.set(ReadRouting())
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.finish(request, response)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        state = _current.get()
+        view = getattr(view_func, 'cls', view_func)
+        if (state is not None and request.method in SAFE_METHODS
+                and getattr(view, 'read_from_replica', False)
+                and not wrote_recently(request)):
+            state.alias = settings.READ_REPLICA_DATABASE
+        return None
+
+    def finish(self, request, response):
+        if request.method not in SAFE_METHODS and response.status_code < 400:
+            written = str(_now_ms())
+            response[LAST_WRITE_HEADER] = written
+            response.set_cookie(
+                LAST_WRITE_COOKIE, written,
+                max_age=settings.READ_REPLICA_STICKY_SECONDS,
+                httponly=True, samesite='Lax')
+        return response
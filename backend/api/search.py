@@ -0,0 +1,136 @@
+"""
+Полнотекстовый поиск рецептов по названию и описанию.
+
+PostgreSQL: выражение to_tsvector('russian', ...) с GIN-индексом
+recipe_search_idx (миграция api 0006), индекс обновляется самой СУБД.
+SQLite (локальный запуск): таблица FTS5 api_recipe_fts, которую
+синхронизируют сигналы сохранения и удаления рецепта.
+"""
+import re
+
+from django.contrib.postgres.search import (SearchQuery, SearchRank,
+                                            SearchVector)
+from django.db import connection, connections, router
+from django.db.models.expressions import RawSQL
+
+from .models import Recipe
+
+SEARCH_CONFIG = 'russian'
+FTS_TABLE = 'api_recipe_fts'
+# То же, что normalize(), для переиндексации одним запросом.
+FTS_NORMALIZE = ', '.join(
+    f"replace(replace({column}, 'ё', 'е'), 'Ё', 'Е')"
+    for column in ('name', 'text'))
+
+# Окончания для упрощённого стемминга запроса в SQLite: основа слова
+# ищется как префикс, поэтому «пирожки» находит и «пирожков».
+RUSSIAN_ENDINGS = sorted((
+    'иями', 'ями', 'ами', 'ого', 'его', 'ому', 'ему', 'ыми', 'ими', 'ать',
+    'ять', 'ить', 'еть', 'ешь', 'ишь', 'ой', 'ей', 'ий', 'ый', 'ая', 'яя',
+    'ое', 'ее', 'ые', 'ие', 'ов', 'ев', 'ам', 'ям', 'ах', 'ях', 'ом', 'ем',
+    'ую', 'юю', 'ет', 'ит', 'ут', 'ют', 'ат', 'ят', 'ал', 'ил', 'а', 'я',
+    'о', 'е', 'ы', 'и', 'у', 'ю', 'ь', 'й',
+), key=len, reverse=True)
+MIN_STEM_LENGTH = 3
+
+
+def recipe_search_vector():
+    """Выражение фильтра; совпадает с индексом recipe_search_idx."""
+    return SearchVector('name', 'text', config=SEARCH_CONFIG)
+
+
+def stem(word):
+    for ending in RUSSIAN_ENDINGS:
+        if (word.endswith(ending)
+                and len(word) - len(ending) >= MIN_STEM_LENGTH):
+            return word[:-len(ending)]
+    return word
+
+
+def normalize(text):
+    # unicode61 не приравнивает «ё» к «е».
+    return text.replace('ё', 'е').replace('Ё', 'Е')
+
+
+def fts_query(text):
+    """Запрос FTS5: все слова обязательны, каждое ищется по основе."""
+    words = re.findall(r'\w+', normalize(text.lower()))
+    return ' '.join(f'"{stem(word)}"*' for word in words)
+
+
+def search_recipes(queryset, text):
+    """Отбирает рецепты по запросу и сортирует их по релевантности."""
+    if connection.vendor == 'postgresql':
+        query = SearchQuery(text, config=SEARCH_CONFIG,
+                            search_type='websearch')
+        # Ранг считается только для найденных строк, поэтому название
+        # может весить больше описания без отдельного индекса.
+        weighted = (
+            SearchVector('name', config=SEARCH_CONFIG, weight='A')
+            + SearchVector('text', config=SEARCH_CONFIG, weight='B'))
+        return queryset.annotate(
+            search=recipe_search_vector(),
+            search_rank=SearchRank(weighted, query),
+        ).filter(search=query).order_by('-search_rank', '-pub_date')
+    match = fts_query(text)
+    if not match:
+        return queryset.none()
+    table = queryset.model._meta.db_table
+    return queryset.filter(id__in=RawSQL(
+        f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s',
+        (match,),
+    )).annotate(search_rank=RawSQL(
+        # bm25: чем меньше, тем релевантнее; название весит больше.
+        f'SELECT bm25({FTS_TABLE}, 10.0, 1.0) FROM {FTS_TABLE} '
+        f'WHERE {FTS_TABLE} MATCH %s AND rowid = "{table}"."id"',
+        (match,),
+    )).order_by('search_rank', '-pub_date')
+
+
+def uses_fts_table():
+    return connection.vendor == 'sqlite'
+
+
+def _index_cursor():
+    # Индекс меняется только на основной БД, как и сами рецепты.
+    return connections[router.db_for_write(Recipe)].cursor()
+
+
+def index_recipe(recipe):
+    if not uses_fts_table():
+        return
+    with _index_cursor() as cursor:
+        cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s',
+                       [recipe.pk])
+        cursor.execute(
+            f'INSERT INTO {FTS_TABLE} (rowid, name, text) '
+            'VALUES (%s, %s, %s)',
+            [recipe.pk, normalize(recipe.name), normalize(recipe.text)])
+
+
+def unindex_recipe(recipe_id):
+    if not uses_fts_table():
+        return
+    with _index_cursor() as cursor:
+        cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s',
+                       [recipe_id])
+
+
+def unindex_author(author_id):
+    """Удаляет из индекса все рецепты автора одним запросом."""
+    if not uses_fts_table():
+        return
+    with _index_cursor() as cursor:
+        cursor.execute(
+            f'DELETE FROM {FTS_TABLE} WHERE rowid IN '
+            '(SELECT id FROM api_recipe WHERE author_id = %s)', [author_id])
+
+
+def rebuild_search_index():
+    """Полная переиндексация, например после bulk_create."""
+    if not uses_fts_table():
+        return
+    with _index_cursor() as cursor:
+        cursor.execute(f'DELETE FROM {FTS_TABLE}')
+        cursor.execute(f'INSERT INTO {FTS_TABLE} (rowid, name, text) '
+                       f'SELECT id, {FTS_NORMALIZE} FROM api_recipe')
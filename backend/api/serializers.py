@@ -1,13 +1,28 @@
 from django.db import transaction
+from django.db.models import Prefetch, prefetch_related_objects
+from django.dispatch import Signal
 from rest_framework import serializers
 
+from .fields import ImageVariantsField
+from .images import delete_variants, schedule_variants
+from .metrics import TimedRepresentationMixin
 from .models import (Ingredient, Recipe,
                      IngredientInRecipe)
 from users.serializers import CustomUserSerializer
 from drf_extra_fields.fields import Base64ImageField
 
+# Ограничение размера массовых запросов (например, план питания целиком).
+RECIPE_IDS_MAX_LENGTH = 100
+# Наибольший id (BigAutoField): больший не дошёл бы до БД без ошибки.
+MAX_ID = 2 ** 63 - 1
 
-class IngredientSerializer(serializers.ModelSerializer):
+# Состав рецепта изменён через bulk_update и bulk_create, которые не
+# отправляют post_save: sender — Recipe, recipe_id — рецепт.
+ingredients_changed = Signal()
+
+
+class IngredientSerializer(TimedRepresentationMixin,
+                           serializers.ModelSerializer):
     class Meta:
         model = Ingredient
         fields = ('id', 'name', 'measurement_unit')
@@ -24,35 +39,44 @@ class IngredientInRecipeSerializer(serializers.ModelSerializer):
         fields = ('id', 'name', 'measurement_unit', 'amount')
 
 
-class RecipeListSerializer(serializers.ModelSerializer):
+class RecipeListSerializer(TimedRepresentationMixin,
+                           serializers.ModelSerializer):
     author = CustomUserSerializer(read_only=True)
     ingredients = IngredientInRecipeSerializer(
         source='ingredient_list', many=True, read_only=True)
     is_favorited = serializers.SerializerMethodField()
     is_in_shopping_cart = serializers.SerializerMethodField()
     image = Base64ImageField(read_only=True)
+    image_variants = ImageVariantsField()
 
     class Meta:
         model = Recipe
         fields = ('id', 'author', 'ingredients', 'is_favorited',
-                  'is_in_shopping_cart', 'name', 'image', 'text',
-                  'cooking_time')
+                  'is_in_shopping_cart', 'name', 'image', 'image_variants',
+                  'text', 'cooking_time')
 
     def get_is_favorited(self, obj):
         user = self.context.get('request').user
         if user.is_anonymous:
             return False
+        # Аннотация из RecipeViewSet.get_queryset; после create/update
+        # объект приходит без неё.
+        if hasattr(obj, 'is_favorited'):
+            return obj.is_favorited
         return obj.favorited_by.filter(user=user).exists()
 
     def get_is_in_shopping_cart(self, obj):
         user = self.context.get('request').user
         if user.is_anonymous:
             return False
+        if hasattr(obj, 'is_in_shopping_cart'):
+            return obj.is_in_shopping_cart
         return obj.in_shopping_cart.filter(user=user).exists()
 
 
 class IngredientAmountCreateSerializer(serializers.ModelSerializer):
-    id = serializers.PrimaryKeyRelatedField(queryset=Ingredient.objects.all())
+    # Ингредиенты проверяются одним запросом в validate_ingredients.
+    id = serializers.IntegerField(max_value=MAX_ID)
     amount = serializers.IntegerField(write_only=True, min_value=1)
 
     class Meta:
@@ -70,6 +94,18 @@ class RecipeCreateSerializer(serializers.ModelSerializer):
         fields = ('id', 'ingredients', 'image', 'name',
                   'text', 'cooking_time', 'author')
 
+    def validate_ingredients(self, value):
+        found = Ingredient.objects.in_bulk(item['id'] for item in value)
+        message = serializers.PrimaryKeyRelatedField.default_error_messages[
+            'does_not_exist']
+        errors = [
+            {} if item['id'] in found
+            else {'id': [message.format(pk_value=item['id'])]}
+            for item in value]
+        if any(errors):
+            raise serializers.ValidationError(errors)
+        return [{**item, 'id': found[item['id']]} for item in value]
+
     def validate(self, data):
         ingredients = data.get('ingredients')
         if not ingredients:
@@ -95,24 +131,68 @@ class RecipeCreateSerializer(serializers.ModelSerializer):
             for item in ingredients_data
         ])
 
+    def update_ingredients(self, recipe, ingredients_data):
+        """
+        Приводит ингредиенты рецепта к ingredients_data, меняя только
+        отличающиеся строки. Возвращает True, если что-то изменилось.
+        """
+        # Строки, загруженные вместе с рецептом, используются повторно.
+        existing = {
+            row.ingredient_id: row for row in recipe.ingredient_list.all()}
+        submitted = {item['id'].pk: item for item in ingredients_data}
+        removed = [row.pk for ingredient_id, row in existing.items()
+                   if ingredient_id not in submitted]
+        changed = []
+        for ingredient_id, row in existing.items():
+            item = submitted.get(ingredient_id)
+            if item is not None and row.amount != item['amount']:
+                row.amount = item['amount']
+                changed.append(row)
+        added = [item for ingredient_id, item in submitted.items()
+                 if ingredient_id not in existing]
+        if removed:
+            IngredientInRecipe.objects.filter(pk__in=removed).delete()
+        if changed:
+            IngredientInRecipe.objects.bulk_update(changed, ['amount'])
+        if added:
+            self.create_ingredients(recipe, added)
+        return bool(removed or changed or added)
+
     @transaction.atomic
     def create(self, validated_data):
         ingredients_data = validated_data.pop('ingredients')
         recipe = Recipe.objects.create(
             author=self.context['request'].user, **validated_data)
         self.create_ingredients(recipe, ingredients_data)
+        schedule_variants(recipe, 'image')
         return recipe
 
     @transaction.atomic
     def update(self, instance, validated_data):
         ingredients_data = validated_data.pop('ingredients', None)
-        if ingredients_data is not None:
-            instance.ingredients.clear()
-            self.create_ingredients(instance, ingredients_data)
-        return super().update(instance, validated_data)
+        if (ingredients_data is not None
+                and self.update_ingredients(instance, ingredients_data)):
+            ingredients_changed.send(sender=Recipe, recipe_id=instance.pk)
+        if 'image' in validated_data:
+            delete_variants(instance, 'image')
+        instance = super().update(instance, validated_data)
+        if 'image' in validated_data:
+            schedule_variants(instance, 'image')
+        return instance
 
     def to_representation(self, instance):
+        prefetch_related_objects([instance], Prefetch(
+            'ingredient_list',
+            queryset=IngredientInRecipe.objects.select_related('ingredient')))
         return RecipeListSerializer(instance,
                                     context={
                                         'request': self.context.get('request')}
                                     ).data
+
+
+class RecipeIdsSerializer(serializers.Serializer):
+    """Список рецептов для массового добавления или удаления."""
+    recipes = serializers.ListField(
+        child=serializers.IntegerField(min_value=1, max_value=MAX_ID),
+        allow_empty=False,
+        max_length=RECIPE_IDS_MAX_LENGTH)
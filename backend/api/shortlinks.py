@@ -0,0 +1,200 @@
+"""
+Короткие ссылки на рецепты: /s/<код>/.
+
+Код — base62 фиксированной длины от перестановки первичного ключа,
+поэтому соседние рецепты получают непохожие коды, а по коду не видно
+число рецептов. Код хранится в Recipe.short_code. Код никогда не
+состоит из одних цифр: такие ссылки /s/<id>/ остались от старого
+формата и ведут на рецепт с этим id.
+
+Переходы по ссылке разрешаются через кеш процесса, включая отрицательный
+(неизвестные коды), а счётчик Recipe.short_link_clicks копится в памяти
+и записывается в БД пачками.
+"""
+import atexit
+import logging
+import string
+import threading
+import time
+from collections import Counter, OrderedDict, defaultdict
+
+from django.conf import settings
+from django.urls import get_script_prefix, reverse
+
+from .counters import shift_counters
+from .models import Recipe
+from .serializers import MAX_ID
+
+logger = logging.getLogger(__name__)
+
+ALPHABET = string.digits + string.ascii_letters
+CODE_LENGTH = 6
+CODE_SPACE = len(ALPHABET) ** CODE_LENGTH
+# Простое число, не делящее 62: умножение по модулю CODE_SPACE обратимо.
+CODE_MULTIPLIER = 2_971_215_073
+# Приставка к коду из одних цифр. Такой код длиннее остальных, поэтому
+# не совпадает ни с ними, ни со ссылкой старого вида.
+NUMERIC_CODE_PREFIX = 'x'
+
+
+def encode(pk):
+    """Код рецепта; разным pk < CODE_SPACE соответствуют разные коды."""
+    number = pk * CODE_MULTIPLIER % CODE_SPACE
+    chars = []
+    for _ in range(CODE_LENGTH):
+        number, digit = divmod(number, len(ALPHABET))
+        chars.append(ALPHABET[digit])
+    code = ''.join(reversed(chars))
+    if code.isdigit():
+        return NUMERIC_CODE_PREFIX + code
+    return code
+
+
+def assign_code(recipe):
+    """Сохраняет код только что созданного рецепта."""
+    recipe.short_code = encode(recipe.pk)
+    Recipe.objects.filter(pk=recipe.pk).update(short_code=recipe.short_code)
+
+
+_path_prefixes = {}
+
+
+def short_link_url(request, code):
+    """Абсолютная ссылка /s/<код>/ без reverse() на каждый запрос."""
+    script_prefix = get_script_prefix()
+    prefix = _path_prefixes.get(script_prefix)
+    if prefix is None:
+        prefix = _path_prefixes[script_prefix] = reverse(
+            'recipe-short-link', args=['-'])[:-len('-/')]
+    return f'{request.scheme}://{request.get_host()}{prefix}{code}/'
+
+
+class ShortLinkResolver:
+    """
+    LRU-кеш процесса: код -> pk рецепта или None.
+
+    Найденные коды живут SHORT_LINK_CACHE_TTL секунд, неизвестные —
+    SHORT_LINK_NEGATIVE_TTL, чтобы перебор кодов не нагружал БД, а
+    только что созданный рецепт быстро становился доступен. Удаление
+    рецепта сбрасывает запись сразу (forget).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def cached(self, code):
+        """(True, pk или None) из кеша либо (False, None)."""
+        with self._lock:
+            entry = self._entries.get(code)
+            if entry is None:
+                return False, None
+            pk, expires_at = entry
+            if time.monotonic() > expires_at:
+                del self._entries[code]
+                return False, None
+            self._entries.move_to_end(code)
+        return True, pk
+
+    def _store(self, code, pk):
+        ttl = (settings.SHORT_LINK_CACHE_TTL if pk is not None
+               else settings.SHORT_LINK_NEGATIVE_TTL)
+        with self._lock:
+            self._entries[code] = (pk, time.monotonic() + ttl)
+            self._entries.move_to_end(code)
+            while len(self._entries) > settings.SHORT_LINK_CACHE_SIZE:
+                self._entries.popitem(last=False)
+        return pk
+
+    @staticmethod
+    def _queryset(code):
+        """Рецепт по коду или по id из ссылки старого вида; None — нет."""
+        if code.isdigit():
+            if int(code) > MAX_ID:
+                return None
+            return Recipe.objects.filter(pk=int(code))
+        if len(code) in (CODE_LENGTH, CODE_LENGTH + 1):
+            return Recipe.objects.filter(short_code=code)
+        return None
+
+    def resolve(self, code):
+        found, pk = self.cached(code)
+        if found:
+            return pk
+        queryset = self._queryset(code)
+        if queryset is not None:
+            pk = queryset.values_list('pk', flat=True).first()
+        return self._store(code, pk)
+
+    def forget(self, *codes):
+        with self._lock:
+            for code in codes:
+                self._entries.pop(code, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class ClickBuffer:
+    """
+    Счётчик переходов в памяти процесса.
+
+    record() возвращает True, когда накопилось SHORT_LINK_FLUSH_SIZE
+    переходов или прошло SHORT_LINK_FLUSH_INTERVAL секунд с последней
+    записи; тогда вызывающий код выполняет flush() (в асинхронном
+    представлении — через sync_to_async). Остаток записывается при
+    обычном завершении процесса (atexit). При SIGKILL, в том числе по
+    нехватке памяти или по таймауту воркера, остаток теряется: меньше
+    SHORT_LINK_FLUSH_SIZE переходов на процесс. Счётчик — статистика,
+    а не учёт, поэтому такая потеря допустима.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts = Counter()
+        self._total = 0
+        self._flushed_at = time.monotonic()
+
+    def record(self, pk):
+        with self._lock:
+            self._counts[pk] += 1
+            self._total += 1
+            return (
+                self._total >= settings.SHORT_LINK_FLUSH_SIZE
+                or time.monotonic() - self._flushed_at
+                >= settings.SHORT_LINK_FLUSH_INTERVAL)
+
+    def pending(self):
+        with self._lock:
+            return dict(self._counts)
+
+    def flush(self):
+        """Записывает накопленное: один UPDATE на каждое значение прироста."""
+        with self._lock:
+            counts, self._counts = self._counts, Counter()
+            self._total = 0
+            self._flushed_at = time.monotonic()
+        by_delta = defaultdict(list)
+        for pk, delta in counts.items():
+            by_delta[delta].append(pk)
+        for delta, pks in by_delta.items():
+            try:
+                shift_counters(Recipe, pks, 'short_link_clicks', delta)
+            except Exception:
+                logger.exception('Не удалось записать переходы по ссылкам')
+                with self._lock:
+                    self._counts.update(dict.fromkeys(pks, delta))
+                    self._total += delta * len(pks)
+
+
+short_links = ShortLinkResolver()
+click_buffer = ClickBuffer()
+
+
+def _flush_at_exit():
+    if click_buffer.pending():
+        click_buffer.flush()
+
+
+atexit.register(_flush_at_exit)
@@ -0,0 +1,199 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from users.models import Subscription, User
+from .catalog import ingredient_index
+from .counters import deleted_with, shift_counter, shift_counters
+from .feed import follow, publish_on_commit, unfollow
+from .images import remove_variant_files, variants_ready
+from .models import (Favorite, Ingredient, IngredientInRecipe, Recipe,
+                     ShoppingCart)
+from .relations import recipes_linked
+from .search import index_recipe, unindex_author, unindex_recipe
+from .serializers import ingredients_changed
+from .shortlinks import assign_code, short_links
+from .versions import bump_version, bump_version_on_commit
+
+
+@receiver(post_save, sender=Ingredient)
+@receiver(post_delete, sender=Ingredient)
+def invalidate_ingredient_index(sender, **kwargs):
+    ingredient_index.invalidate()
+
+
+@receiver(post_save, sender=ShoppingCart)
+@receiver(post_delete, sender=ShoppingCart)
+def bump_shopping_cart_version(sender, instance, **kwargs):
+    bump_version_on_commit('shopping_cart', instance.user_id)
+
+
+@receiver(recipes_linked, sender=ShoppingCart)
+def bump_linked_shopping_cart_version(sender, user_id, **kwargs):
+    bump_version_on_commit('shopping_cart', user_id)
+
+
+@receiver(post_save, sender=Favorite)
+@receiver(post_delete, sender=Favorite)
+@receiver(post_save, sender=ShoppingCart)
+@receiver(post_delete, sender=ShoppingCart)
+def bump_relations_version(sender, instance, **kwargs):
+    # is_favorited и is_in_shopping_cart входят в ETag читателя.
+    bump_version_on_commit('relations', instance.user_id)
+
+
+@receiver(recipes_linked)
+def bump_linked_relations_version(sender, user_id, **kwargs):
+    bump_version_on_commit('relations', user_id)
+
+
+@receiver(post_save, sender=IngredientInRecipe)
+@receiver(post_delete, sender=IngredientInRecipe)
+def bump_recipe_ingredients_version(sender, **kwargs):
+    # Состав рецептов входит в кешированные списки покупок. При удалении
+    # рецепта его строки уходят из списков покупок вместе с ним.
+    if not deleted_with_recipe_or_user(kwargs.get('origin')):
+        bump_version_on_commit('recipe_ingredients')
+
+
+@receiver(ingredients_changed)
+def bump_changed_ingredients_version(sender, **kwargs):
+    bump_version_on_commit('recipe_ingredients')
+
+
+def bump_recipe_versions(*recipe_ids):
+    """Сбрасывает кеш ленты и страниц рецептов после фиксации транзакции."""
+    def bump():
+        bump_version('recipes')
+        for recipe_id in recipe_ids:
+            bump_version('recipe', recipe_id)
+    transaction.on_commit(bump)
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_delete, sender=Recipe)
+def recipe_changed(sender, instance, **kwargs):
+    bump_recipe_versions(instance.pk)
+
+
+@receiver(post_save, sender=Recipe)
+def update_search_index(sender, instance, **kwargs):
+    index_recipe(instance)
+
+
+@receiver(post_delete, sender=Recipe)
+def remove_from_search_index(sender, instance, **kwargs):
+    if not deleted_with(kwargs.get('origin'), User):
+        unindex_recipe(instance.pk)
+
+
+@receiver(post_save, sender=Recipe)
+def assign_short_code(sender, instance, created, **kwargs):
+    if created and not instance.short_code:
+        assign_code(instance)
+
+
+@receiver(post_save, sender=Recipe)
+def publish_to_feeds(sender, instance, created, **kwargs):
+    # Из лент рецепт удаляется каскадом вместе с ним.
+    if created:
+        publish_on_commit(instance.pk)
+
+
+@receiver(post_save, sender=Subscription)
+def backfill_feed(sender, instance, created, **kwargs):
+    if created:
+        follow(instance.user_id, instance.author_id)
+
+
+@receiver(post_delete, sender=Subscription)
+def prune_feed(sender, instance, **kwargs):
+    # При удалении пользователя ленты очищаются каскадом.
+    if not deleted_with(kwargs.get('origin'), User):
+        unfollow(instance.user_id, instance.author_id)
+
+
+@receiver(post_delete, sender=Recipe)
+def forget_short_link(sender, instance, **kwargs):
+    short_links.forget(instance.short_code, str(instance.pk))
+
+
+@receiver(post_delete, sender=Recipe)
+def remove_recipe_image_variants(sender, instance, **kwargs):
+    remove_variant_files(instance, 'image')
+
+
+@receiver(variants_ready, sender=Recipe)
+def recipe_variants_ready(sender, pk, **kwargs):
+    bump_recipe_versions(pk)
+
+
+@receiver(post_save, sender=User)
+def author_changed(sender, instance, created, update_fields=None, **kwargs):
+    # Вход пользователя обновляет только last_login.
+    if created or update_fields == frozenset({'last_login'}):
+        return
+    # Автор входит в рецепты через версию ('author', id), см.
+    # api/fragments.py: не нужно перебирать его рецепты.
+    bump_version_on_commit('author', instance.pk)
+    bump_version_on_commit('recipes')
+
+
+@receiver(pre_delete, sender=User)
+def user_deleting(sender, instance, **kwargs):
+    """
+    Счётчики рецептов из избранного и списков покупок пользователя и
+    поисковый индекс его рецептов обновляются пачкой до каскадного
+    удаления, а не обработчиками каждой строки.
+    """
+    for model, field in ((Favorite, 'favorites_count'),
+                         (ShoppingCart, 'shopping_cart_count')):
+        shift_counters(
+            Recipe, model.objects.filter(user=instance).values('recipe_id'),
+            field, -1)
+    unindex_author(instance.pk)
+
+
+def deleted_with_recipe_or_user(origin):
+    return deleted_with(origin, Recipe) or deleted_with(origin, User)
+
+
+@receiver(post_save, sender=Favorite)
+@receiver(post_delete, sender=Favorite)
+def update_favorites_count(sender, instance, created=False, **kwargs):
+    if kwargs['signal'] is post_save and not created:
+        return
+    if deleted_with_recipe_or_user(kwargs.get('origin')):
+        return
+    shift_counter(Recipe, instance.recipe_id, 'favorites_count',
+                  1 if created else -1)
+
+
+@receiver(post_save, sender=ShoppingCart)
+@receiver(post_delete, sender=ShoppingCart)
+def update_shopping_cart_count(sender, instance, created=False, **kwargs):
+    if kwargs['signal'] is post_save and not created:
+        return
+    if deleted_with_recipe_or_user(kwargs.get('origin')):
+        return
+    shift_counter(Recipe, instance.recipe_id, 'shopping_cart_count',
+                  1 if created else -1)
+
+
+@receiver(recipes_linked, sender=Favorite)
+@receiver(recipes_linked, sender=ShoppingCart)
+def update_linked_counts(sender, recipe_ids, delta, **kwargs):
+    field = ('favorites_count' if sender is Favorite
+             else 'shopping_cart_count')
+    shift_counters(Recipe, recipe_ids, field, delta)
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_delete, sender=Recipe)
+def update_recipes_count(sender, instance, created=False, **kwargs):
+    if kwargs['signal'] is post_save and not created:
+        return
+    if deleted_with(kwargs.get('origin'), User):
+        return
+    shift_counter(User, instance.author_id, 'recipes_count',
+                  1 if created else -1)
@@ -0,0 +1,1845 @@
+import io
+import json
+import re
+import shutil
+import tempfile
+import threading
+import time
+from unittest import mock, skipUnless
+
+from asgiref.sync import async_to_sync, sync_to_async
+from django.core.cache import cache
+from django.core.exceptions import MiddlewareNotUsed
+from django.core.management import call_command
+from django.db import connection, connections, router, transaction
+from django.db.models import Count, F
+from django.http import HttpResponse
+from django.test import RequestFactory, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import resolve
+from rest_framework.test import APITestCase
+
+from rest_framework.authtoken.models import Token
+from rest_framework.serializers import (BaseSerializer,
+                                        PrimaryKeyRelatedField)
+
+from users.models import User, Subscription
+from users.serializers import SubscriptionSerializer
+from . import images, signals, versions
+from .management.commands.load_data import iter_json_array
+from .catalog import ingredient_index
+from .feed import publish, rebuild_feeds
+from .metrics import registry
+from .models import (Ingredient, Recipe, IngredientInRecipe, Favorite,
+                     FeedEntry, ShoppingCart)
+from .routing import (LAST_WRITE_COOKIE, LAST_WRITE_HEADER,
+                      ReadReplicaMiddleware, ReadReplicaRouter,
+                      primary_reads)
+from .search import rebuild_search_index
+from .shortlinks import click_buffer, encode, short_links
+from .testutils import (TINY_IMAGE, QueryBudgetMixin, create_recipe,
+                        create_user, create_users)
+
+
+class RecipeQueryCountTests(APITestCase):
+    """Число запросов к БД не зависит от количества рецептов на странице."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user('reader')
+        cls.authors = create_users('author', 3)
+        cls.ingredients = [
+            Ingredient.objects.create(name=f'ingredient {i}',
+                                      measurement_unit='г')
+            for i in range(4)
+        ]
+        cls.recipes = []
+        for i in range(6):
+            recipe = create_recipe(cls.authors[i % 3], f'recipe {i}')
+            IngredientInRecipe.objects.bulk_create([
+                IngredientInRecipe(recipe=recipe, ingredient=ingredient,
+                                   amount=5)
+                for ingredient in cls.ingredients
+            ])
+            cls.recipes.append(recipe)
+        Favorite.objects.create(user=cls.user, recipe=cls.recipes[0])
+        ShoppingCart.objects.create(user=cls.user, recipe=cls.recipes[1])
+        Subscription.objects.create(user=cls.user, author=cls.authors[0])
+
+    def setUp(self):
+        cache.clear()
+
+    def authenticate(self):
+        self.client.force_authenticate(self.user)
+
+    def test_anonymous_list(self):
+        # count + recipes with authors + ingredients
+        with self.assertNumQueries(3):
+            response = self.client.get('/api/recipes/')
+        self.assertEqual(len(response.data['results']), 6)
+
+    def test_anonymous_retrieve(self):
+        url = f'/api/recipes/{self.recipes[0].pk}/'
+        # автор для ETag (один раз на рецепт) + рецепт + ингредиенты
+        with self.assertNumQueries(3):
+            self.client.get(url)
+        # Автор рецепта остаётся в кеше после вытеснения ответов.
+        key = f'recipe_author:{self.recipes[0].pk}'
+        author_id = cache.get(key)
+        cache.clear()
+        cache.set(key, author_id, None)
+        with self.assertNumQueries(2):
+            self.client.get(url)
+
+    def test_authenticated_list(self):
+        self.authenticate()
+        # count + recipes with authors + ingredients + viewer flags
+        with self.assertNumQueries(4):
+            response = self.client.get('/api/recipes/')
+        flags = {item['id']: (item['is_favorited'],
+                              item['is_in_shopping_cart'])
+                 for item in response.data['results']}
+        self.assertEqual(flags[self.recipes[0].pk], (True, False))
+        self.assertEqual(flags[self.recipes[1].pk], (False, True))
+        self.assertEqual(flags[self.recipes[2].pk], (False, False))
+        subscribed = {item['author']['id']: item['author']['is_subscribed']
+                      for item in response.data['results']}
+        self.assertEqual(subscribed, {
+            self.authors[0].pk: True,
+            self.authors[1].pk: False,
+            self.authors[2].pk: False,
+        })
+
+    def test_authenticated_retrieve(self):
+        self.authenticate()
+        with self.assertNumQueries(4):
+            response = self.client.get(f'/api/recipes/{self.recipes[0].pk}/')
+        self.assertTrue(response.data['is_favorited'])
+        self.assertFalse(response.data['is_in_shopping_cart'])
+
+    def test_authenticated_list_from_fragments(self):
+        self.client.get('/api/recipes/')
+        self.authenticate()
+        # count + recipes with authors + viewer flags
+        with self.assertNumQueries(3):
+            response = self.client.get('/api/recipes/')
+        flags = {item['id']: (item['is_favorited'],
+                              item['is_in_shopping_cart'],
+                              item['author']['is_subscribed'])
+                 for item in response.data['results']}
+        self.assertEqual(flags[self.recipes[0].pk], (True, False, True))
+        self.assertEqual(flags[self.recipes[1].pk], (False, True, False))
+        self.assertEqual(flags[self.recipes[3].pk], (False, False, True))
+
+
+class RecipeFragmentTests(APITestCase):
+    """Фрагменты рецептов общие для читателей и сбрасываются по версии."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = create_user('chef')
+        cls.reader = create_user('reader')
+        cls.recipe = create_recipe(cls.author, 'Борщ', cooking_time=60)
+        Favorite.objects.create(user=cls.reader, recipe=cls.recipe)
+
+    def setUp(self):
+        cache.clear()
+        self.url = f'/api/recipes/{self.recipe.pk}/'
+
+    def test_flags_are_per_viewer(self):
+        self.client.force_authenticate(self.reader)
+        self.assertTrue(self.client.get(self.url).data['is_favorited'])
+        self.client.force_authenticate(self.author)
+        self.assertFalse(self.client.get(self.url).data['is_favorited'])
+        self.client.force_authenticate(None)
+        self.assertFalse(self.client.get(self.url).data['is_favorited'])
+
+    def test_author_change_invalidates(self):
+        self.client.force_authenticate(self.reader)
+        self.client.get(self.url)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.author.first_name = 'Повар'
+            self.author.save()
+        response = self.client.get('/api/recipes/')
+        self.assertEqual(
+            response.data['results'][0]['author']['first_name'], 'Повар')
+
+    def test_author_change_invalidates_detail(self):
+        etag = self.client.get(self.url)['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            self.author.first_name = 'Повар'
+            self.author.save()
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['author']['first_name'], 'Повар')
+
+    def test_author_change_cost_does_not_grow_with_recipes(self):
+        def bumps():
+            bump = mock.Mock(wraps=versions.bump_version)
+            with mock.patch.object(versions, 'bump_version', bump), \
+                    mock.patch.object(signals, 'bump_version', bump), \
+                    self.captureOnCommitCallbacks(execute=True):
+                self.author.save()
+            return bump.call_count
+
+        few = bumps()
+        for i in range(5):
+            create_recipe(self.author, f'recipe {i}')
+        self.assertEqual(bumps(), few)
+
+    def test_ingredient_change_invalidates(self):
+        salt = Ingredient.objects.create(name='Соль', measurement_unit='г')
+        IngredientInRecipe.objects.create(
+            recipe=self.recipe, ingredient=salt, amount=5)
+        self.client.force_authenticate(self.reader)
+        self.client.get(self.url)
+        salt.name = 'Морская соль'
+        with self.captureOnCommitCallbacks(execute=True):
+            salt.save()
+        response = self.client.get(self.url)
+        self.assertEqual(response.data['ingredients'][0]['name'],
+                         'Морская соль')
+
+
+class IngredientIndexTests(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        for name in ('Сахар', 'сахарная пудра', 'Соль', 'сыр'):
+            Ingredient.objects.create(name=name, measurement_unit='г')
+
+    def setUp(self):
+        # Откат транзакции теста не отправляет post_delete.
+        ingredient_index.invalidate()
+
+    def search(self, name):
+        response = self.client.get('/api/ingredients/', {'name': name})
+        return [item['name'] for item in response.data]
+
+    def test_prefix_search_is_case_insensitive(self):
+        self.assertEqual(self.search('сах'), ['Сахар', 'сахарная пудра'])
+        self.assertEqual(self.search('С'),
+                         ['Сахар', 'сахарная пудра', 'Соль', 'сыр'])
+        self.assertEqual(self.search('перец'), [])
+
+    def test_search_does_not_query_database(self):
+        self.search('с')
+        with self.assertNumQueries(0):
+            self.assertEqual(self.search('соль'), ['Соль'])
+
+    def test_index_invalidated_on_change(self):
+        self.assertEqual(self.search('сыр'), ['сыр'])
+        ingredient = Ingredient.objects.create(name='Сырок',
+                                               measurement_unit='шт')
+        self.assertEqual(self.search('сыр'), ['сыр', 'Сырок'])
+        ingredient.delete()
+        self.assertEqual(self.search('сыр'), ['сыр'])
+
+
+class ShoppingListDownloadTests(APITestCase):
+    url = '/api/recipes/download_shopping_cart/'
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user('cook')
+        salt = Ingredient.objects.create(name='Соль', measurement_unit='г')
+        sugar = Ingredient.objects.create(name='Сахар', measurement_unit='г')
+        cls.recipes = []
+        for amount in (5, 10):
+            recipe = create_recipe(cls.user, f'recipe {amount}')
+            IngredientInRecipe.objects.create(
+                recipe=recipe, ingredient=salt, amount=amount)
+            cls.recipes.append(recipe)
+        IngredientInRecipe.objects.create(
+            recipe=cls.recipes[0], ingredient=sugar, amount=100)
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_authenticate(self.user)
+        for recipe in self.recipes:
+            ShoppingCart.objects.create(user=self.user, recipe=recipe)
+
+    def download(self, **headers):
+        response = self.client.get(self.url, headers=headers)
+        if response.streaming:
+            response.content_text = b''.join(
+                response.streaming_content).decode()
+        elif response.status_code == 200:
+            response.content_text = response.content.decode()
+        return response
+
+    def test_content_is_aggregated(self):
+        response = self.download()
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('• Соль (г) — 15\n', response.content_text)
+        self.assertIn('• Сахар (г) — 100\n', response.content_text)
+
+    def test_repeat_download_uses_cache_and_etag(self):
+        first = self.download()
+        with self.assertNumQueries(0):
+            second = self.download()
+        self.assertEqual(second.content_text, first.content_text)
+        with self.assertNumQueries(0):
+            not_modified = self.download(If_None_Match=first['ETag'])
+        self.assertEqual(not_modified.status_code, 304)
+
+    def test_cart_change_invalidates(self):
+        first = self.download()
+        with self.captureOnCommitCallbacks(execute=True):
+            ShoppingCart.objects.filter(recipe=self.recipes[1]).delete()
+        response = self.download(If_None_Match=first['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], first['ETag'])
+        self.assertIn('• Соль (г) — 5\n', response.content_text)
+
+    def test_ingredient_change_outside_api_invalidates(self):
+        # Админка, команды и ORM меняют строки без сериализатора.
+        row = IngredientInRecipe.objects.get(
+            recipe=self.recipes[1], ingredient__name='Соль')
+        for change in (lambda: row.save(), lambda: row.delete()):
+            first = self.download()
+            with self.captureOnCommitCallbacks(execute=True):
+                row.amount = 20
+                change()
+            response = self.download(If_None_Match=first['ETag'])
+            self.assertEqual(response.status_code, 200)
+        self.assertIn('• Соль (г) — 5\n', response.content_text)
+
+    def test_version_is_bumped_after_commit(self):
+        first = self.download()
+        with self.captureOnCommitCallbacks() as callbacks:
+            ShoppingCart.objects.filter(recipe=self.recipes[1]).delete()
+            # До фиксации параллельный запрос видит старую версию.
+            self.assertEqual(self.download()['ETag'], first['ETag'])
+        for callback in callbacks:
+            callback()
+        self.assertNotEqual(self.download()['ETag'], first['ETag'])
+
+    def test_evicted_version_does_not_repeat_etag(self):
+        first = self.download()
+        cache.clear()
+        response = self.download(If_None_Match=first['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], first['ETag'])
+
+
+@override_settings(IMAGE_VARIANT_WORKERS=0)
+class RecipeImageVariantsTests(APITestCase):
+    """Варианты картинки рецепта создаются, заменяются и удаляются."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.media_root = tempfile.mkdtemp()
+        cls.media_override = override_settings(MEDIA_ROOT=cls.media_root)
+        cls.media_override.enable()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.media_override.disable()
+        shutil.rmtree(cls.media_root, ignore_errors=True)
+        super().tearDownClass()
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = create_user('chef')
+        cls.salt = Ingredient.objects.create(name='Соль',
+                                             measurement_unit='г')
+
+    def setUp(self):
+        self.client.force_authenticate(self.author)
+
+    def recipe_data(self):
+        return {'name': 'Борщ', 'text': 'text', 'cooking_time': 10,
+                'image': TINY_IMAGE,
+                'ingredients': [{'id': self.salt.pk, 'amount': 5}]}
+
+    def create_recipe(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/recipes/', self.recipe_data(),
+                                        format='json')
+        self.assertEqual(response.status_code, 201)
+        return Recipe.objects.get(pk=response.data['id'])
+
+    @staticmethod
+    def variant_files(recipe):
+        return [name for files in recipe.image_variants.values()
+                for name in files.values()]
+
+    def test_created(self):
+        recipe = self.create_recipe()
+        self.assertEqual(set(recipe.image_variants),
+                         {'thumbnail', 'card', 'full'})
+        storage = recipe.image.storage
+        for name in self.variant_files(recipe):
+            self.assertTrue(storage.exists(name))
+
+    def test_replaced_image_removes_old_files(self):
+        recipe = self.create_recipe()
+        old_files = self.variant_files(recipe)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.put(f'/api/recipes/{recipe.pk}/',
+                                       self.recipe_data(), format='json')
+        self.assertEqual(response.status_code, 200)
+        recipe.refresh_from_db()
+        new_files = self.variant_files(recipe)
+        self.assertEqual(len(new_files), len(old_files))
+        storage = recipe.image.storage
+        for name in old_files:
+            self.assertFalse(storage.exists(name))
+        for name in new_files:
+            self.assertTrue(storage.exists(name))
+
+    def test_deleted_recipe_removes_files(self):
+        recipe = self.create_recipe()
+        files = self.variant_files(recipe)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.delete(f'/api/recipes/{recipe.pk}/')
+        for name in files:
+            self.assertFalse(recipe.image.storage.exists(name))
+
+    def test_command_rebuilds_missing_variants(self):
+        kept = self.create_recipe()
+        lost = self.create_recipe()
+        Recipe.objects.filter(pk=lost.pk).update(image_variants={})
+        call_command('rebuild_image_variants', stdout=io.StringIO())
+        lost.refresh_from_db()
+        for name in self.variant_files(lost):
+            self.assertTrue(lost.image.storage.exists(name))
+        self.assertEqual(set(lost.image_variants),
+                         {'thumbnail', 'card', 'full'})
+        out = io.StringIO()
+        call_command('rebuild_image_variants', stdout=out)
+        self.assertIn('0 rebuilt', out.getvalue())
+        call_command('rebuild_image_variants', '--all', stdout=out)
+        kept.refresh_from_db()
+        self.assertIn('2 rebuilt', out.getvalue())
+        for name in self.variant_files(kept):
+            self.assertTrue(kept.image.storage.exists(name))
+
+    @override_settings(IMAGE_VARIANT_WORKERS=1)
+    def test_full_queue_processes_in_request(self):
+        images._get_executor()
+        with mock.patch.object(images, '_slots', threading.Semaphore(0)):
+            recipe = self.create_recipe()
+        # Очередь занята: варианты готовы сразу после ответа.
+        self.assertTrue(self.variant_files(recipe))
+
+
+class AnonymousRecipeCacheTests(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = create_user('chef')
+        cls.recipe = create_recipe(cls.author, 'Борщ', cooking_time=60)
+
+    def setUp(self):
+        cache.clear()
+
+    def assertCached(self, url):
+        first = self.client.get(url)
+        with self.assertNumQueries(0):
+            second = self.client.get(url)
+        self.assertEqual(second.data, first.data)
+        return second
+
+    def test_list_and_detail_cached(self):
+        self.assertCached('/api/recipes/')
+        self.assertCached(f'/api/recipes/{self.recipe.pk}/')
+
+    def test_recipe_update_invalidates(self):
+        self.assertCached('/api/recipes/')
+        self.assertCached(f'/api/recipes/{self.recipe.pk}/')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.recipe.name = 'Щи'
+            self.recipe.save()
+        response = self.client.get('/api/recipes/')
+        self.assertEqual(response.data['results'][0]['name'], 'Щи')
+        response = self.client.get(f'/api/recipes/{self.recipe.pk}/')
+        self.assertEqual(response.data['name'], 'Щи')
+
+    def test_author_update_invalidates(self):
+        self.assertCached(f'/api/recipes/{self.recipe.pk}/')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.author.first_name = 'Повар'
+            self.author.save()
+        response = self.client.get(f'/api/recipes/{self.recipe.pk}/')
+        self.assertEqual(response.data['author']['first_name'], 'Повар')
+
+    def test_authenticated_not_cached(self):
+        self.client.force_authenticate(self.author)
+        self.client.get('/api/recipes/')
+        # count + page + flags: the page is not cached, fragments are
+        with self.assertNumQueries(3):
+            self.client.get('/api/recipes/')
+
+    def test_file_based_cache(self):
+        with tempfile.TemporaryDirectory() as location:
+            with override_settings(CACHES={'default': {
+                'BACKEND': 'django.core.cache.backends.filebased.'
+                           'FileBasedCache',
+                'LOCATION': location,
+            }}):
+                self.assertCached('/api/recipes/?limit=3')
+
+
+class RecipeCursorPaginationTests(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        author = create_user('chef')
+        cls.recipes = [
+            create_recipe(author, f'recipe {i}')
+            for i in range(5)
+        ]
+
+    def test_walks_feed_without_count(self):
+        cache.clear()
+        self.client.force_authenticate(self.recipes[0].author)
+        url = '/api/recipes/?pagination=cursor&limit=2'
+        seen = []
+        while url:
+            # page + ingredients + viewer flags, no COUNT(*)
+            with self.assertNumQueries(3):
+                response = self.client.get(url)
+            self.assertNotIn('count', response.data)
+            seen += [item['id'] for item in response.data['results']]
+            url = response.data['next']
+        self.assertEqual(seen,
+                         [recipe.pk for recipe in reversed(self.recipes)])
+
+    def test_page_number_is_default(self):
+        response = self.client.get('/api/recipes/?limit=2')
+        self.assertEqual(response.data['count'], 5)
+
+    def walk(self, url, link):
+        seen = []
+        while url:
+            with CaptureQueriesContext(connection) as context:
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            for query in context.captured_queries:
+                self.assertNotIn('OFFSET', query['sql'])
+            seen.append([item['id'] for item in response.data['results']])
+            url = response.data[link]
+        return seen
+
+    @override_settings(RECIPE_CACHE_TIMEOUT=0)
+    def test_ties_on_pub_date_are_seeked_by_id(self):
+        # Все рецепты опубликованы одновременно: порядок задаёт только id.
+        Recipe.objects.update(pub_date=self.recipes[0].pub_date)
+        pages = self.walk('/api/recipes/?pagination=cursor&limit=2', 'next')
+        ids = [recipe.pk for recipe in reversed(self.recipes)]
+        self.assertEqual(pages, [ids[:2], ids[2:4], ids[4:]])
+        last = self.client.get(
+            '/api/recipes/?pagination=cursor&limit=2').data['next']
+        last = self.client.get(last).data['next']
+        last_page = self.client.get(last).data
+        self.assertIsNone(last_page['next'])
+        back = self.walk(last_page['previous'], 'previous')
+        self.assertEqual(back, [ids[2:4], ids[:2]])
+
+    def test_invalid_cursor(self):
+        response = self.client.get(
+            '/api/recipes/?pagination=cursor&cursor=cD1bMV0%3D')
+        self.assertEqual(response.status_code, 404)
+
+
+@skipUnless(connection.vendor == 'sqlite', 'EXPLAIN QUERY PLAN из SQLite')
+class RecipeSearchTests(APITestCase):
+    """Поиск ?search= по названию и описанию с учётом словоформ."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = create_user('chef')
+        cls.pies = create_recipe(
+            cls.author, 'Пирожки с капустой', text='Тесто и начинка.',
+            cooking_time=60)
+        cls.soup = create_recipe(
+            cls.author, 'Щи', text='Подавать с пирожками и сметаной.',
+            cooking_time=90)
+        create_recipe(cls.author, 'Салат', text='Огурцы.')
+
+    def setUp(self):
+        # Ответы анонимам кешируются, а версии в TestCase не сбрасываются.
+        self.client.force_authenticate(self.author)
+
+    def search(self, query):
+        response = self.client.get('/api/recipes/', {'search': query})
+        self.assertEqual(response.status_code, 200)
+        return [recipe['id'] for recipe in response.data['results']]
+
+    def test_ranks_name_above_text(self):
+        self.assertEqual(self.search('пирожок'), [])
+        self.assertEqual(self.search('пирожки'),
+                         [self.pies.pk, self.soup.pk])
+
+    def test_all_words_required(self):
+        self.assertEqual(self.search('пирожки сметана'), [self.soup.pk])
+        self.assertEqual(self.search('!!!'), [])
+
+    def test_index_follows_changes(self):
+        self.soup.text = 'Без выпечки.'
+        self.soup.save()
+        self.assertEqual(self.search('пирожки'), [self.pies.pk])
+        self.pies.delete()
+        self.assertEqual(self.search('пирожки'), [])
+        recipe = create_recipe(
+            self.author, 'Пирожок печёный', text='', cooking_time=30)
+        self.assertEqual(self.search('печеные пирожок'), [recipe.pk])
+
+
+class ConditionalGetTests(APITestCase):
+    """Повторные запросы с If-None-Match получают 304 без тела."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user('reader')
+        cls.author = create_user('chef')
+        cls.recipe = create_recipe(cls.author, 'Борщ', cooking_time=60)
+
+    def setUp(self):
+        cache.clear()
+        ingredient_index.invalidate()
+
+    def revalidate(self, url, queries=0):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+        with self.assertNumQueries(queries):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+        return etag
+
+    def test_not_modified_without_queries(self):
+        for url in ('/api/recipes/', f'/api/recipes/{self.recipe.pk}/',
+                    '/api/ingredients/?name=со'):
+            with self.subTest(url=url):
+                self.revalidate(url)
+                self.client.force_authenticate(self.user)
+                self.revalidate(url)
+                self.client.force_authenticate(None)
+
+    def test_recipe_change_changes_etag(self):
+        url = f'/api/recipes/{self.recipe.pk}/'
+        list_etag = self.revalidate('/api/recipes/')
+        etag = self.revalidate(url)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.recipe.name = 'Щи'
+            self.recipe.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['name'], 'Щи')
+        self.assertNotEqual(self.revalidate('/api/recipes/'), list_etag)
+
+    def test_viewer_state_changes_etag(self):
+        self.client.force_authenticate(self.user)
+        url = f'/api/recipes/{self.recipe.pk}/'
+        etag = self.revalidate(url)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(f'{url}favorite/')
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.data['is_favorited'])
+
+    def test_ingredient_change_changes_etag(self):
+        etag = self.revalidate('/api/ingredients/')
+        with self.captureOnCommitCallbacks(execute=True):
+            Ingredient.objects.create(name='Соль', measurement_unit='г')
+        response = self.client.get('/api/ingredients/',
+                                   HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+
+class QueryPlanTests(APITestCase):
+    """
+    Горячие запросы ищут по индексам (SEARCH) на данных, по объёму
+    похожих на рабочие, со статистикой ANALYZE.
+    """
+    AUTHORS = 50
+    RECIPES = 1000
+    INGREDIENTS_PER_RECIPE = 5
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user('reader')
+        authors = User.objects.bulk_create([
+            User(email=f'author{i}@example.com', username=f'author{i}',
+                 first_name='Author', last_name='Test')
+            for i in range(cls.AUTHORS)])
+        cls.author = authors[0]
+        ingredients = Ingredient.objects.bulk_create([
+            Ingredient(name=f'ingredient {i}', measurement_unit='г')
+            for i in range(200)])
+        recipes = Recipe.objects.bulk_create([
+            Recipe(author=authors[i % cls.AUTHORS], name=f'recipe {i}',
+                   image='recipes/images/test.png', text='text',
+                   cooking_time=10)
+            for i in range(cls.RECIPES)])
+        IngredientInRecipe.objects.bulk_create([
+            IngredientInRecipe(
+                recipe=recipe, amount=j + 1,
+                ingredient=ingredients[(i + j * 37) % len(ingredients)])
+            for i, recipe in enumerate(recipes)
+            for j in range(cls.INGREDIENTS_PER_RECIPE)])
+        for model in (Favorite, ShoppingCart):
+            model.objects.bulk_create(
+                [model(user=cls.user, recipe=recipe)
+                 for recipe in recipes[:20]]
+                + [model(user=author, recipe=recipe)
+                   for author in authors for recipe in recipes[:10]])
+        Subscription.objects.bulk_create(
+            [Subscription(user=cls.user, author=author)
+             for author in authors[:10]]
+            + [Subscription(user=author, author=cls.user)
+               for author in authors])
+        rebuild_feeds()
+        rebuild_search_index()
+        cls.recipe = recipes[-1]
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+    def setUp(self):
+        cache.clear()
+
+    def full_scans(self, sql):
+        """
+        Просмотры таблиц и индексов целиком. Допустимы только обход
+        индекса в порядке ORDER BY до LIMIT и COUNT(*) всей таблицы для
+        числа страниц.
+        """
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql)
+            details = [row[3] for row in cursor.fetchall()]
+        coroutines = {detail.split(' ', 1)[1] for detail in details
+                      if detail.startswith('CO-ROUTINE ')}
+        ordered_by_index = (
+            ' LIMIT ' in sql
+            and 'USE TEMP B-TREE FOR ORDER BY' not in details)
+        total_count = (sql.startswith('SELECT COUNT(*)')
+                       and ' WHERE ' not in sql and ' JOIN ' not in sql)
+        return [
+            detail for detail in details
+            if detail.startswith('SCAN ')
+            and not detail.startswith('SCAN (')
+            # Поиск FTS5 по MATCH: «VIRTUAL TABLE INDEX 0:M...».
+            and not re.search(r'VIRTUAL TABLE INDEX \d+:\S', detail)
+            and detail.split(' ', 1)[1] not in coroutines
+            and not (' USING ' in detail
+                     and (ordered_by_index or total_count))
+        ]
+
+    def assertIndexedQueries(self, url, authenticated=True):
+        if authenticated:
+            self.client.force_authenticate(self.user)
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url)
+            if response.streaming:
+                b''.join(response.streaming_content)
+        self.assertEqual(response.status_code, 200)
+        for query in context.captured_queries:
+            if not query['sql'].startswith('SELECT'):
+                continue
+            with self.subTest(url=url, sql=query['sql']):
+                self.assertEqual(self.full_scans(query['sql']), [])
+
+    def test_detects_full_scan(self):
+        self.assertEqual(
+            self.full_scans("SELECT id FROM api_recipe WHERE text = 'x'"),
+            ['SCAN api_recipe'])
+        # Полный обход индекса без LIMIT тоже просмотр всей таблицы.
+        self.assertEqual(
+            self.full_scans('SELECT id FROM api_recipe ORDER BY pub_date'),
+            ['SCAN api_recipe USING COVERING INDEX recipe_pub_date_idx'])
+        self.assertEqual(self.full_scans(
+            'SELECT id FROM api_recipe ORDER BY pub_date LIMIT 6'), [])
+
+    def test_recipe_feed(self):
+        self.assertIndexedQueries('/api/recipes/', authenticated=False)
+        self.assertIndexedQueries('/api/recipes/')
+        self.assertIndexedQueries('/api/recipes/?pagination=cursor')
+
+    def test_recipe_feed_filters(self):
+        self.assertIndexedQueries(f'/api/recipes/?author={self.author.pk}')
+        self.assertIndexedQueries('/api/recipes/?is_favorited=1')
+        self.assertIndexedQueries('/api/recipes/?is_in_shopping_cart=1')
+        self.assertIndexedQueries('/api/recipes/?search=recipe')
+
+    def test_recipe_detail(self):
+        self.assertIndexedQueries(f'/api/recipes/{self.recipe.pk}/')
+
+    def test_subscriptions(self):
+        self.assertIndexedQueries('/api/users/subscriptions/')
+        self.assertIndexedQueries(
+            '/api/users/subscriptions/?recipes_limit=2')
+
+    def test_download_shopping_cart(self):
+        self.assertIndexedQueries('/api/recipes/download_shopping_cart/')
+
+    def test_subscription_feed(self):
+        self.assertIndexedQueries('/api/recipes/feed/')
+        self.assertIndexedQueries('/api/recipes/feed/?pagination=cursor')
+
+
+class GenerateDataTests(APITestCase):
+
+    def test_generates_requested_volume(self):
+        for i in range(30):
+            Ingredient.objects.create(name=f'ingredient {i}',
+                                      measurement_unit='г')
+        with tempfile.TemporaryDirectory() as media_root:
+            with override_settings(MEDIA_ROOT=media_root):
+                call_command('generate_data', users=20, recipes=50,
+                             seed=7, batch_size=16, stdout=io.StringIO())
+        self.assertEqual(User.objects.count(), 20)
+        self.assertEqual(Recipe.objects.count(), 50)
+        per_recipe = IngredientInRecipe.objects.values('recipe').annotate(
+            total=Count('id')).values_list('total', flat=True)
+        self.assertTrue(all(3 <= total <= 20 for total in per_recipe))
+        self.assertFalse(Subscription.objects.filter(
+            user=F('author')).exists())
+
+    def generate(self, seed):
+        """Данные генерации без первичных ключей; затем откат."""
+        with transaction.atomic():
+            with tempfile.TemporaryDirectory() as media_root:
+                with override_settings(MEDIA_ROOT=media_root):
+                    call_command('generate_data', users=20, recipes=50,
+                                 seed=seed, batch_size=16,
+                                 stdout=io.StringIO())
+            data = [
+                list(User.objects.order_by('username').values_list(
+                    'username', 'email', 'password', 'last_name')),
+                list(Recipe.objects.order_by('name').values_list(
+                    'author__username', 'name', 'text', 'cooking_time',
+                    'pub_date')),
+            ] + [
+                sorted(model.objects.values_list(*fields))
+                for model, fields in (
+                    (IngredientInRecipe,
+                     ('recipe__name', 'ingredient_id', 'amount')),
+                    (Favorite, ('user__username', 'recipe__name')),
+                    (ShoppingCart, ('user__username', 'recipe__name')),
+                    (Subscription, ('user__username', 'author__username')),
+                )
+            ]
+            transaction.set_rollback(True)
+        return data
+
+    def test_same_seed_generates_same_data(self):
+        for i in range(30):
+            Ingredient.objects.create(name=f'ingredient {i}',
+                                      measurement_unit='г')
+        first = self.generate(seed=7)
+        self.assertEqual(self.generate(seed=7), first)
+        self.assertNotEqual(self.generate(seed=8)[1], first[1])
+
+
+class LoadDataTests(APITestCase):
+    items = [
+        {'name': 'соль', 'measurement_unit': 'г'},
+        {'name': 'сахар', 'measurement_unit': 'г'},
+        {'name': 'молоко', 'measurement_unit': 'мл'},
+        {'name': 'соль', 'measurement_unit': 'г'},
+        {'name': '', 'measurement_unit': 'г'},
+    ]
+
+    def load(self, suffix, content):
+        with tempfile.NamedTemporaryFile(
+                'w', suffix=suffix, encoding='utf-8') as file:
+            file.write(content)
+            file.flush()
+            call_command('load_data', file.name, batch_size=2,
+                         stdout=io.StringIO())
+        return set(Ingredient.objects.values_list(
+            'name', 'measurement_unit'))
+
+    def test_json_array_is_streamed(self):
+        content = json.dumps(self.items, ensure_ascii=False)
+        items = list(iter_json_array(io.StringIO(content), chunk_size=7))
+        self.assertEqual(items, self.items)
+
+    def test_formats(self):
+        expected = {('соль', 'г'), ('сахар', 'г'), ('молоко', 'мл')}
+        self.assertEqual(
+            self.load('.json', json.dumps(self.items, ensure_ascii=False)),
+            expected)
+        Ingredient.objects.all().delete()
+        self.assertEqual(self.load('.ndjson', '\n'.join(
+            json.dumps(item, ensure_ascii=False) for item in self.items)),
+            expected)
+        Ingredient.objects.all().delete()
+        self.assertEqual(self.load('.csv', ''.join(
+            f'{item["name"]},{item["measurement_unit"]}\n'
+            for item in self.items)), expected)
+
+    def test_repeated_load_ignores_existing(self):
+        content = json.dumps(self.items, ensure_ascii=False)
+        self.load('.json', content)
+        self.load('.json', content)
+        self.assertEqual(Ingredient.objects.count(), 3)
+
+
+class CountersTests(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user('reader')
+        cls.author = create_user('chef')
+        cls.recipe = create_recipe(cls.author, 'Борщ', cooking_time=60)
+
+    def setUp(self):
+        self.client.force_authenticate(self.user)
+
+    def test_favorite_and_cart_counts(self):
+        for endpoint, field in (('favorite', 'favorites_count'),
+                                ('shopping_cart', 'shopping_cart_count')):
+            url = f'/api/recipes/{self.recipe.pk}/{endpoint}/'
+            self.client.post(url)
+            self.recipe.refresh_from_db()
+            self.assertEqual(getattr(self.recipe, field), 1)
+            self.client.delete(url)
+            self.recipe.refresh_from_db()
+            self.assertEqual(getattr(self.recipe, field), 0)
+
+    def test_recipe_and_subscription_counts(self):
+        self.author.refresh_from_db()
+        self.assertEqual(self.author.recipes_count, 1)
+        self.client.post(f'/api/users/{self.author.pk}/subscribe/')
+        self.author.refresh_from_db()
+        self.assertEqual(self.author.followers_count, 1)
+        # Сохранение объекта со старыми значениями не затирает счётчики.
+        self.user.first_name = 'Читатель'
+        self.user.save()
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.following_count, 1)
+        self.recipe.delete()
+        self.author.refresh_from_db()
+        self.assertEqual(self.author.recipes_count, 0)
+
+    def test_copy_starts_with_zero_counters(self):
+        Favorite.objects.create(user=self.user, recipe=self.recipe)
+        recipe = Recipe.objects.get(pk=self.recipe.pk)
+        recipe.pk = recipe.id = None
+        recipe.save()
+        self.assertNotEqual(recipe.pk, self.recipe.pk)
+        recipe.refresh_from_db()
+        self.assertEqual(recipe.favorites_count, 0)
+        self.assertNotEqual(recipe.short_code, self.recipe.short_code)
+        self.author.refresh_from_db()
+        self.assertEqual(self.author.recipes_count, 2)
+        user = User.objects.get(pk=self.author.pk)
+        user.pk = user.id = None
+        user.username, user.email = 'copy', 'copy@example.com'
+        user.save()
+        user.refresh_from_db()
+        self.assertEqual(user.recipes_count, 0)
+
+    def test_save_skips_counters_only_without_update_fields(self):
+        stale = Recipe.objects.get(pk=self.recipe.pk)
+        Favorite.objects.create(user=self.user, recipe=self.recipe)
+        stale.name = 'Щи'
+        with CaptureQueriesContext(connection) as context:
+            stale.save()
+        self.assertNotIn('favorites_count', context.captured_queries[0][
+            'sql'])
+        stale.refresh_from_db()
+        self.assertEqual((stale.name, stale.favorites_count), ('Щи', 1))
+        stale.favorites_count = 5
+        stale.save(update_fields=['favorites_count'])
+        stale.refresh_from_db()
+        self.assertEqual(stale.favorites_count, 5)
+
+    def test_user_deletion_updates_counts_in_bulk(self):
+        Favorite.objects.create(user=self.user, recipe=self.recipe)
+        ShoppingCart.objects.create(user=self.user, recipe=self.recipe)
+        Subscription.objects.create(user=self.user, author=self.author)
+        Subscription.objects.create(user=self.author, author=self.user)
+        self.user.delete()
+        self.recipe.refresh_from_db()
+        self.author.refresh_from_db()
+        self.assertEqual(self.recipe.favorites_count, 0)
+        self.assertEqual(self.recipe.shopping_cart_count, 0)
+        self.assertEqual(self.author.followers_count, 0)
+        self.assertEqual(self.author.following_count, 0)
+
+    def test_repair_counters(self):
+        Favorite.objects.bulk_create([
+            Favorite(user=self.user, recipe=self.recipe)])
+        Subscription.objects.bulk_create([
+            Subscription(user=self.user, author=self.author)])
+        User.objects.update(recipes_count=7)
+        call_command('repair_counters', batch_size=1, stdout=io.StringIO())
+        self.recipe.refresh_from_db()
+        self.author.refresh_from_db()
+        self.user.refresh_from_db()
+        self.assertEqual(self.recipe.favorites_count, 1)
+        self.assertEqual(self.author.recipes_count, 1)
+        self.assertEqual(self.author.followers_count, 1)
+        self.assertEqual(self.user.following_count, 1)
+        self.assertEqual(self.user.recipes_count, 0)
+
+
+class FavoriteCartMutationTests(APITestCase):
+    """Избранное и список покупок меняются одним запросом на операцию."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user('reader')
+        cls.recipes = [
+            create_recipe(cls.user, f'recipe {i}')
+            for i in range(3)
+        ]
+
+    def setUp(self):
+        self.client.force_authenticate(self.user)
+
+    def test_single_add_and_remove(self):
+        url = f'/api/recipes/{self.recipes[0].pk}/favorite/'
+        # INSERT ... RETURNING + счётчик + рецепт для ответа.
+        with self.assertNumQueries(3):
+            response = self.client.post(url)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['id'], self.recipes[0].pk)
+        self.assertEqual(self.client.post(url).status_code, 400)
+        # DELETE ... RETURNING + счётчик.
+        with self.assertNumQueries(2):
+            response = self.client.delete(url)
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(self.client.delete(url).status_code, 400)
+        self.assertEqual(
+            self.client.delete('/api/recipes/0/favorite/').status_code, 404)
+        self.assertEqual(
+            self.client.post('/api/recipes/0/favorite/').status_code, 404)
+        self.assertEqual(self.client.post(
+            f'/api/recipes/{10 ** 20}/favorite/').status_code, 404)
+        self.recipes[0].refresh_from_db()
+        self.assertEqual(self.recipes[0].favorites_count, 0)
+
+    def test_bulk_add_and_remove(self):
+        url = '/api/recipes/shopping_cart/'
+        first, second, third = (recipe.pk for recipe in self.recipes)
+        ShoppingCart.objects.create(user=self.user, recipe=self.recipes[2])
+        response = self.client.post(
+            url, {'recipes': [first, second, third, 10 ** 6, first]},
+            format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertCountEqual(response.data['added'], [first, second])
+        self.assertEqual(
+            ShoppingCart.objects.filter(user=self.user).count(), 3)
+        self.assertEqual(
+            Recipe.objects.filter(shopping_cart_count=1).count(), 3)
+
+        response = self.client.delete(url, {'recipes': [first, second]},
+                                      format='json')
+        self.assertCountEqual(response.data['removed'], [first, second])
+        self.assertEqual(
+            list(Recipe.objects.filter(shopping_cart_count=1).values_list(
+                'pk', flat=True)), [third])
+
+    def test_bulk_validation(self):
+        url = '/api/recipes/favorite/'
+        self.assertEqual(self.client.post(
+            url, {'recipes': []}, format='json').status_code, 400)
+        self.assertEqual(self.client.post(
+            url, {'recipes': ['x']}, format='json').status_code, 400)
+        self.assertEqual(self.client.post(
+            url, {'recipes': [2 ** 63]}, format='json').status_code, 400)
+        self.client.force_authenticate(None)
+        self.assertEqual(self.client.post(
+            url, {'recipes': [self.recipes[0].pk]},
+            format='json').status_code, 401)
+
+
+class RecipeIngredientsUpdateTests(APITestCase):
+    """Правка рецепта переписывает только изменённые ингредиенты."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = create_user('chef')
+        cls.ingredients = [
+            Ingredient.objects.create(name=f'ingredient {i}',
+                                      measurement_unit='г')
+            for i in range(12)
+        ]
+        cls.recipe = create_recipe(cls.author, 'Рагу', cooking_time=60)
+        IngredientInRecipe.objects.bulk_create(
+            IngredientInRecipe(recipe=cls.recipe, ingredient=ingredient,
+                               amount=10)
+            for ingredient in cls.ingredients[:10])
+
+    def setUp(self):
+        self.client.force_authenticate(self.author)
+
+    def patch(self, amounts):
+        return self.client.patch(
+            f'/api/recipes/{self.recipe.pk}/',
+            {'ingredients': [{'id': ingredient.pk, 'amount': amount}
+                             for ingredient, amount in amounts]},
+            format='json')
+
+    def rows(self):
+        return dict(IngredientInRecipe.objects.filter(
+            recipe=self.recipe).values_list('ingredient_id', 'pk'))
+
+    def ingredient_writes(self, amounts):
+        with CaptureQueriesContext(connection) as context:
+            response = self.patch(amounts)
+        self.assertEqual(response.status_code, 200)
+        return sorted(
+            query['sql'].split(' ', 1)[0]
+            for query in context.captured_queries
+            if query['sql'].startswith(('INSERT', 'UPDATE', 'DELETE'))
+            and 'api_ingredientinrecipe' in query['sql'])
+
+    def test_writes_only_changes(self):
+        before = self.rows()
+        amounts = [(ingredient, 10) for ingredient in self.ingredients[1:10]]
+        amounts[0] = (amounts[0][0], 25)
+        amounts.append((self.ingredients[10], 5))
+        self.assertEqual(self.ingredient_writes(amounts),
+                         ['DELETE', 'INSERT', 'UPDATE'])
+        after = self.rows()
+        self.assertNotIn(self.ingredients[0].pk, after)
+        for ingredient in self.ingredients[1:10]:
+            self.assertEqual(after[ingredient.pk], before[ingredient.pk])
+        self.assertEqual(
+            IngredientInRecipe.objects.get(
+                recipe=self.recipe, ingredient=self.ingredients[1]).amount,
+            25)
+
+    def test_unchanged_ingredients_are_not_written(self):
+        amounts = [(ingredient, 10) for ingredient in self.ingredients[:10]]
+        self.assertEqual(self.ingredient_writes(amounts), [])
+
+    def test_unknown_ingredients_checked_in_one_query(self):
+        missing = Ingredient.objects.order_by('-pk').first().pk + 1
+        amounts = [{'id': ingredient.pk, 'amount': 1}
+                   for ingredient in self.ingredients]
+        amounts[3]['id'] = missing
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.patch(
+                f'/api/recipes/{self.recipe.pk}/',
+                {'ingredients': amounts}, format='json')
+        self.assertEqual(response.status_code, 400)
+        errors = response.data['ingredients']
+        # Текст ошибки тот же, что у PrimaryKeyRelatedField.
+        self.assertEqual(
+            errors[3]['id'],
+            [PrimaryKeyRelatedField.default_error_messages[
+                'does_not_exist'].format(pk_value=missing)])
+        self.assertEqual([error for i, error in enumerate(errors) if i != 3],
+                         [{}] * (len(amounts) - 1))
+        self.assertEqual(
+            sum('FROM "api_ingredient"' in query['sql']
+                for query in context.captured_queries), 1)
+
+
+class SubscriptionFeedTests(APITestCase):
+    """Лента подписок заполняется при записи и читается без соединений."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.reader = create_user('reader')
+        cls.author = create_user('chef')
+        cls.other = create_user('other')
+        cls.old_recipe = create_recipe(cls.author, 'Старый')
+        Subscription.objects.create(user=cls.reader, author=cls.author)
+        with cls.captureOnCommitCallbacks(execute=True):
+            cls.new_recipe = create_recipe(cls.author, 'Новый')
+            cls.other_recipe = create_recipe(cls.other, 'Чужой')
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_authenticate(self.reader)
+
+    def feed_ids(self):
+        response = self.client.get('/api/recipes/feed/')
+        self.assertEqual(response.status_code, 200)
+        return [recipe['id'] for recipe in response.data['results']]
+
+    def test_publish_and_backfill(self):
+        self.assertEqual(self.feed_ids(),
+                         [self.new_recipe.pk, self.old_recipe.pk])
+
+    def test_subscribe_and_unsubscribe(self):
+        url = f'/api/users/{self.other.pk}/subscribe/'
+        self.assertEqual(self.client.post(url).status_code, 201)
+        self.assertEqual(
+            self.feed_ids(),
+            [self.other_recipe.pk, self.new_recipe.pk, self.old_recipe.pk])
+        self.assertEqual(self.client.delete(url).status_code, 204)
+        self.assertNotIn(self.other_recipe.pk, self.feed_ids())
+
+    def test_deleted_recipe_leaves_feed(self):
+        self.new_recipe.delete()
+        self.assertEqual(self.feed_ids(), [self.old_recipe.pk])
+
+    def test_flags_and_pagination(self):
+        Favorite.objects.create(user=self.reader, recipe=self.old_recipe)
+        response = self.client.get('/api/recipes/feed/?limit=1')
+        self.assertNotIn('count', response.data)
+        self.assertEqual(response.data['results'][0]['id'],
+                         self.new_recipe.pk)
+        response = self.client.get(response.data['next'])
+        self.assertIsNone(response.data['next'])
+        recipe = response.data['results'][0]
+        self.assertEqual(recipe['id'], self.old_recipe.pk)
+        self.assertTrue(recipe['is_favorited'])
+        self.assertTrue(recipe['author']['is_subscribed'])
+
+    def test_query_count(self):
+        self.client.get('/api/recipes/feed/')
+        # Страница ленты, рецепты популярных авторов и признаки читателя
+        # без COUNT; ингредиенты берутся из фрагментов.
+        with self.assertNumQueries(3):
+            self.client.get('/api/recipes/feed/')
+        with self.assertNumQueries(3):
+            self.client.get('/api/recipes/feed/?pagination=cursor')
+
+    def test_publish_waits_for_commit(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            recipe = create_recipe(self.author, 'Отложенный')
+        self.assertNotIn(recipe.pk, self.feed_ids())
+        for callback in callbacks:
+            callback()
+        self.assertEqual(self.feed_ids()[0], recipe.pk)
+
+    @override_settings(FEED_FANOUT_BATCH_SIZE=2)
+    def test_publish_in_batches(self):
+        readers = [
+            create_user(f'fan{i}', first_name='Fan')
+            for i in range(4)]
+        Subscription.objects.bulk_create(
+            Subscription(user=user, author=self.author) for user in readers)
+        recipe = create_recipe(self.author, 'Для всех')
+        # По пачке подписчиков и вставке на каждые два из пяти.
+        with self.assertNumQueries(7):
+            publish(recipe.pk)
+        self.assertEqual(
+            set(FeedEntry.objects.filter(recipe=recipe).values_list(
+                'user_id', flat=True)),
+            {self.reader.pk, *(user.pk for user in readers)})
+
+    @override_settings(FEED_BACKFILL_RECIPES=1)
+    def test_backfill_is_capped(self):
+        Subscription.objects.filter(user=self.reader).delete()
+        Subscription.objects.create(user=self.reader, author=self.author)
+        self.assertEqual(self.feed_ids(), [self.new_recipe.pk])
+
+    @override_settings(FEED_PULL_FOLLOWERS=1)
+    def test_popular_authors_are_read_not_pushed(self):
+        # У автора один подписчик: он уже выше порога.
+        with self.captureOnCommitCallbacks(execute=True):
+            recipe = create_recipe(self.author, 'Популярный')
+        self.assertFalse(FeedEntry.objects.filter(recipe=recipe).exists())
+        # Прежние строки ленты не повторяются.
+        self.assertEqual(
+            self.feed_ids(),
+            [recipe.pk, self.new_recipe.pk, self.old_recipe.pk])
+        pages = []
+        url = '/api/recipes/feed/?limit=2'
+        while url:
+            response = self.client.get(url)
+            pages.append([item['id'] for item in response.data['results']])
+            url = response.data['next']
+        self.assertEqual(
+            pages, [[recipe.pk, self.new_recipe.pk], [self.old_recipe.pk]])
+        response = self.client.get(response.data['previous'])
+        self.assertEqual([item['id'] for item in response.data['results']],
+                         [recipe.pk, self.new_recipe.pk])
+
+    @override_settings(FEED_FANOUT_BATCH_SIZE=2, FEED_BACKFILL_RECIPES=1)
+    def test_rebuild_in_batches(self):
+        readers = [create_user(f'fan{i}', first_name='Fan')
+                   for i in range(3)]
+        Subscription.objects.bulk_create(
+            Subscription(user=user, author=self.author) for user in readers)
+        rebuild_feeds()
+        self.assertEqual(
+            sorted(FeedEntry.objects.values_list('user_id', 'recipe_id')),
+            sorted((user.pk, self.new_recipe.pk)
+                   for user in (self.reader, *readers)))
+
+    def test_requires_authentication(self):
+        self.client.force_authenticate(None)
+        self.assertEqual(
+            self.client.get('/api/recipes/feed/').status_code, 401)
+
+
+@override_settings(REQUEST_METRICS=True)
+class RequestMetricsTests(APITestCase):
+    """Server-Timing и сводка метрик по представлениям."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = create_user('admin', is_staff=True)
+        cls.recipe = create_recipe(cls.admin, 'Борщ', cooking_time=60)
+
+    def setUp(self):
+        cache.clear()
+        registry.clear()
+
+    def test_server_timing(self):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(f'/api/recipes/{self.recipe.pk}/')
+        timing = response['Server-Timing']
+        self.assertIn(f'desc="{len(context.captured_queries)} queries"',
+                      timing)
+        self.assertRegex(timing, r'serialize;dur=\d+\.\d+')
+        self.assertRegex(timing, r'total;dur=\d+\.\d+')
+
+    def test_aggregated_per_action(self):
+        self.client.get('/api/recipes/')
+        self.client.get('/api/recipes/')
+        self.client.get(f'/api/recipes/{self.recipe.pk}/')
+        self.client.force_authenticate(self.admin)
+        self.client.get('/api/users/subscriptions/')
+        text = self.client.get('/api/_metrics').content.decode()
+        self.assertIn('foodgram_request_duration_seconds_count'
+                      '{view="RecipeViewSet.list"} 2', text)
+        self.assertIn('foodgram_request_db_queries_count'
+                      '{view="RecipeViewSet.retrieve"} 1', text)
+        self.assertIn('{view="CustomUserViewSet.subscriptions"}', text)
+        self.assertIn('# TYPE foodgram_request_duration_seconds histogram',
+                      text)
+        # Фрагмент рецепта сериализован при первом запросе ленты.
+        self.assertRegex(
+            text, r'foodgram_serializer_duration_seconds_total'
+                  r'\{view="RecipeViewSet.list"\} 0\.0*[1-9]')
+
+    def test_serialization_timed_without_patching(self):
+        self.client.force_authenticate(self.admin)
+        response = self.client.get('/api/users/me/')
+        # Отрисовка ответа учтена, сериализаторы DRF не подменены.
+        self.assertRegex(response['Server-Timing'],
+                         r'serialize;dur=(?!0\.00;)\d+\.\d+')
+        self.assertEqual(BaseSerializer.data.fget.__module__,
+                         'rest_framework.serializers')
+
+    def test_serializer_data_in_view_is_timed(self):
+        author = create_user('chef')
+        Subscription.objects.create(user=self.admin, author=author)
+        self.client.force_authenticate(self.admin)
+
+        def slow_count(serializer, obj):
+            time.sleep(0.05)
+            return 0
+
+        # subscriptions вызывает serializer.data в самом представлении.
+        with mock.patch.object(SubscriptionSerializer, 'get_recipes_count',
+                               slow_count):
+            response = self.client.get('/api/users/subscriptions/')
+        serialize = re.search(r'serialize;dur=([\d.]+)',
+                              response['Server-Timing'])
+        self.assertGreaterEqual(float(serialize[1]), 50)
+
+    def test_metrics_endpoint_for_admins_only(self):
+        self.assertEqual(self.client.get('/api/_metrics').status_code, 401)
+        self.client.force_authenticate(self.admin)
+        response = self.client.get('/api/_metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain'))
+
+    @override_settings(REQUEST_METRICS=False)
+    def test_disabled(self):
+        response = self.client.get('/api/recipes/')
+        self.assertNotIn('Server-Timing', response)
+        self.client.force_authenticate(self.admin)
+        self.assertEqual(self.client.get('/api/_metrics').status_code, 404)
+
+
+class ShortLinkTests(APITestCase):
+    """Короткие ссылки разрешаются из кеша, переходы пишутся пачками."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = create_user('chef')
+        cls.recipe = create_recipe(cls.author, 'Борщ', cooking_time=60)
+
+    def setUp(self):
+        short_links.clear()
+        click_buffer.flush()
+        self.addCleanup(click_buffer.flush)
+        self.recipe.refresh_from_db()
+        self.url = f'/api/s/{self.recipe.short_code}/'
+
+    def test_code_assigned_on_create(self):
+        self.assertEqual(self.recipe.short_code, encode(self.recipe.pk))
+        self.assertRegex(self.recipe.short_code, r'^x?[0-9a-zA-Z]{6}$')
+        self.assertNotEqual(encode(1), encode(2))
+
+    def test_get_link_without_queries(self):
+        with self.assertNumQueries(0):
+            response = self.client.get(
+                f'/api/recipes/{self.recipe.pk}/get-link/')
+        self.assertEqual(response.data['short-link'],
+                         f'http://testserver{self.url}')
+
+    def test_redirect_is_cached(self):
+        with self.assertNumQueries(1):
+            response = self.client.get(self.url)
+        self.assertRedirects(response, f'/recipes/{self.recipe.pk}/',
+                             fetch_redirect_response=False)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(self.url).status_code, 302)
+
+    def test_unknown_code_is_cached(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(
+                self.client.get('/api/s/zzzzzz/').status_code, 404)
+        with self.assertNumQueries(0):
+            self.assertEqual(
+                self.client.get('/api/s/zzzzzz/').status_code, 404)
+
+    def test_legacy_pk_link(self):
+        response = self.client.get(f'/api/s/{self.recipe.pk}/')
+        self.assertRedirects(response, f'/recipes/{self.recipe.pk}/',
+                             fetch_redirect_response=False)
+
+    def test_numeric_code_does_not_shadow_legacy_link(self):
+        # Код рецепта 10230 без приставки совпал бы с id 855650.
+        coded = create_recipe(self.author, 'coded', pk=10230, cooking_time=1)
+        legacy = create_recipe(
+            self.author, 'legacy', pk=855650, cooking_time=1)
+        self.assertEqual(coded.short_code, 'x855650')
+        for url, recipe in ((f'/api/s/{coded.short_code}/', coded),
+                            (f'/api/s/{legacy.pk}/', legacy)):
+            with self.subTest(url=url):
+                self.assertRedirects(
+                    self.client.get(url), f'/recipes/{recipe.pk}/',
+                    fetch_redirect_response=False)
+        self.assertEqual(
+            self.client.get(f'/api/s/{10 ** 30}/').status_code, 404)
+
+    def test_deleted_recipe_is_forgotten(self):
+        self.client.get(self.url)
+        self.recipe.delete()
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+
+    @override_settings(SHORT_LINK_FLUSH_SIZE=3,
+                       SHORT_LINK_FLUSH_INTERVAL=3600)
+    def test_clicks_are_flushed_in_batches(self):
+        clicks = self.recipe.short_link_clicks
+        self.client.get(self.url)
+        with self.assertNumQueries(0):
+            self.client.get(self.url)
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.short_link_clicks, clicks)
+        with self.assertNumQueries(1):
+            self.client.get(self.url)
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.short_link_clicks, clicks + 3)
+
+
+@override_settings(READ_REPLICA_DATABASE='replica',
+                   READ_REPLICA_STICKY_SECONDS=5)
+class ReadReplicaRoutingTests(APITestCase):
+    """Чтение с реплики и возврат клиента на основную БД после записи."""
+
+    def setUp(self):
+        cache.clear()
+        self.factory = RequestFactory()
+
+    def route(self, method, path, status=200, during=None, **extra):
+        """
+        Проводит запрос через ReadReplicaMiddleware и возвращает, куда
+        представление читало бы рецепты и токены, и сам ответ.
+        """
+        request = getattr(self.factory, method)(path, **extra)
+        match = resolve(path)
+        seen = {}
+
+        def view(request):
+            middleware.process_view(request, match.func, match.args,
+                                    match.kwargs)
+            seen['recipe'] = router.db_for_read(Recipe)
+            if during is not None:
+                seen['during'] = during()
+            seen['after'] = router.db_for_read(Recipe)
+            seen['token'] = router.db_for_read(Token)
+            return HttpResponse(status=status)
+
+        middleware = ReadReplicaMiddleware(view)
+        seen['response'] = middleware(request)
+        return seen
+
+    def test_safe_requests_read_from_replica(self):
+        for path in ('/api/recipes/', '/api/recipes/1/',
+                     '/api/ingredients/', '/api/users/1/'):
+            with self.subTest(path=path):
+                seen = self.route('get', path)
+                self.assertEqual(seen['recipe'], 'replica')
+                # Токены и сессии только на основной БД.
+                self.assertEqual(seen['token'], 'default')
+                self.assertNotIn(LAST_WRITE_COOKIE,
+                                 seen['response'].cookies)
+
+    def test_writes_and_other_views_use_primary(self):
+        self.assertEqual(
+            self.route('post', '/api/recipes/', status=201)['recipe'],
+            'default')
+        self.assertEqual(
+            self.route('get', '/api/s/abcdef/')['recipe'], 'default')
+        self.assertEqual(self.route('get', '/api/')['recipe'], 'default')
+
+    def test_reads_stick_to_primary_after_write(self):
+        response = self.route('post', '/api/recipes/1/favorite/',
+                              status=201)['response']
+        written = response.cookies[LAST_WRITE_COOKIE].value
+        self.assertEqual(response[LAST_WRITE_HEADER], written)
+        self.assertEqual(response.cookies[LAST_WRITE_COOKIE]['max-age'], 5)
+        failed = self.route('post', '/api/recipes/1/favorite/',
+                            status=400)['response']
+        self.assertNotIn(LAST_WRITE_COOKIE, failed.cookies)
+        self.assertFalse(failed.has_header(LAST_WRITE_HEADER))
+        # Клиент возвращает время записи в cookie или в заголовке.
+        self.factory.cookies[LAST_WRITE_COOKIE] = written
+        self.assertEqual(
+            self.route('get', '/api/recipes/')['recipe'], 'default')
+        del self.factory.cookies[LAST_WRITE_COOKIE]
+        self.assertEqual(
+            self.route('get', '/api/recipes/',
+                       HTTP_X_LAST_WRITE=written)['recipe'], 'default')
+        self.assertEqual(
+            self.route('get', '/api/recipes/')['recipe'], 'replica')
+
+    def test_invalid_last_write_keeps_replica(self):
+        future = str(int(time.time() * 1000) + 60000)
+        for value in ('abc', '', future):
+            with self.subTest(value=value):
+                self.assertEqual(
+                    self.route('get', '/api/recipes/',
+                               HTTP_X_LAST_WRITE=value)['recipe'],
+                    'replica')
+
+    @override_settings(READ_REPLICA_STICKY_SECONDS=0)
+    def test_stickiness_expires(self):
+        response = self.route('post', '/api/users/1/subscribe/',
+                              status=201)['response']
+        self.assertEqual(
+            self.route('get', '/api/users/', HTTP_X_LAST_WRITE=response[
+                LAST_WRITE_HEADER])['recipe'],
+            'replica')
+
+    def test_primary_reads(self):
+        def during():
+            with primary_reads() as reloaded:
+                return reloaded, router.db_for_read(Recipe)
+
+        seen = self.route('get', '/api/recipes/', during=during)
+        self.assertEqual(seen['recipe'], 'replica')
+        # Прочитанное с реплики перечитывается с основной БД.
+        self.assertEqual(seen['during'], (True, 'default'))
+        self.assertEqual(seen['after'], 'replica')
+        seen = self.route('post', '/api/recipes/', status=201,
+                          during=during)
+        self.assertEqual(seen['during'], (False, 'default'))
+
+    def test_sync_to_async_follows_routing(self):
+        seen = self.route(
+            'get', '/api/recipes/',
+            during=lambda: async_to_sync(sync_to_async(
+                lambda: router.db_for_read(Recipe)))())
+        self.assertEqual(seen['during'], 'replica')
+
+    @override_settings(READ_REPLICA_DATABASE='')
+    def test_disabled(self):
+        with self.assertRaises(MiddlewareNotUsed):
+            ReadReplicaMiddleware(lambda request: HttpResponse())
+        self.assertIsNone(ReadReplicaRouter().db_for_read(Recipe))
+
+
+def has_separate_replica():
+    replica = connections.settings.get('replica')
+    return replica is not None and not replica['TEST'].get('MIRROR')
+
+
+@skipUnless(has_separate_replica(), 'нужна отдельная БД replica')
+@override_settings(READ_REPLICA_DATABASE='replica',
+                   READ_REPLICA_STICKY_SECONDS=5)
+class ReadReplicaDatabaseTests(APITestCase):
+    """
+    Маршрутизация на двух настоящих БД: реплика пуста, потому что
+    репликации между тестовыми базами нет.
+    """
+    databases = {'default', 'replica'}
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user('reader')
+        cls.recipe = create_recipe(cls.user, 'Только на основной БД')
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_authenticate(self.user)
+        self.url = f'/api/recipes/{self.recipe.pk}/'
+
+    def test_last_write_reads_primary(self):
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+        self.assertEqual(
+            self.client.get('/api/recipes/').data['results'], [])
+        response = self.client.post(f'{self.url}favorite/')
+        self.assertEqual(response.status_code, 201)
+        written = response[LAST_WRITE_HEADER]
+        # Тестовый клиент возвращает cookie сам.
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.data['is_favorited'])
+        self.assertEqual(
+            [recipe['id'] for recipe in
+             self.client.get('/api/recipes/').data['results']],
+            [self.recipe.pk])
+        self.client.cookies.clear()
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+        self.assertEqual(self.client.get(
+            self.url, headers={LAST_WRITE_HEADER: written}).status_code, 200)
+
+    def test_writes_go_to_primary(self):
+        self.client.post(f'{self.url}shopping_cart/')
+        self.assertTrue(ShoppingCart.objects.using('default').filter(
+            user=self.user, recipe=self.recipe).exists())
+        self.assertFalse(ShoppingCart.objects.using('replica').exists())
+
+
+class AdminQueryCountTests(APITestCase):
+    """Страницы админки не делают запросов на каждую строку."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser(
+            email='admin@example.com', username='admin',
+            first_name='Admin', last_name='Test', password='pass')
+        cls.ingredients = [
+            Ingredient.objects.create(name=f'ingredient {i}',
+                                      measurement_unit='г')
+            for i in range(10)
+        ]
+
+    def setUp(self):
+        self.client.force_login(self.admin)
+
+    def add_rows(self, count):
+        for _ in range(count):
+            number = User.objects.count()
+            user = create_user(f'user{number}', first_name='User')
+            recipe = create_recipe(user, f'recipe {number}')
+            IngredientInRecipe.objects.bulk_create([
+                IngredientInRecipe(recipe=recipe, ingredient=ingredient,
+                                   amount=1)
+                for ingredient in self.ingredients
+            ])
+            Favorite.objects.create(user=user, recipe=recipe)
+            ShoppingCart.objects.create(user=user, recipe=recipe)
+            Subscription.objects.create(user=user, author=self.admin)
+        return recipe
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(context.captured_queries)
+
+    def test_changelists_do_not_grow_with_rows(self):
+        urls = [f'/admin/{model}/' for model in (
+            'api/ingredient', 'api/recipe', 'api/favorite',
+            'api/shoppingcart', 'users/user', 'users/subscription')]
+        self.add_rows(2)
+        small = [self.count_queries(url) for url in urls]
+        self.add_rows(8)
+        large = [self.count_queries(url) for url in urls]
+        self.assertEqual(dict(zip(urls, large)), dict(zip(urls, small)))
+        # Фильтры не перечисляют всех авторов.
+        response = self.client.get('/admin/api/recipe/')
+        self.assertNotContains(response, 'author__id__exact')
+        self.assertContains(response, 'pub_date__year=')
+        Ingredient.objects.create(name='молоко', measurement_unit='мл')
+        response = self.client.get('/admin/api/ingredient/')
+        self.assertContains(response, '?measurement_unit=')
+
+    def test_inline_does_not_render_whole_catalog(self):
+        recipe = self.add_rows(1)
+        Ingredient.objects.create(name='unused ingredient',
+                                  measurement_unit='г')
+        response = self.client.get(f'/admin/api/recipe/{recipe.pk}/change/')
+        self.assertNotContains(response, 'unused ingredient')
+
+    def test_inline_rows_do_not_add_queries(self):
+        recipe = self.add_rows(1)
+        url = f'/admin/api/recipe/{recipe.pk}/change/'
+        many = self.count_queries(url)
+        recipe.ingredient_list.exclude(
+            ingredient=self.ingredients[0]).delete()
+        self.assertEqual(self.count_queries(url), many)
+        response = self.client.get(url)
+        self.assertContains(response, 'ingredient 0')
+
+    def test_change_forms(self):
+        recipe = self.add_rows(1)
+        favorite = Favorite.objects.get(recipe=recipe)
+        # Автокомплит подгружает только выбранные значения, а подписи
+        # строк инлайна берутся из загруженных вместе с ними ингредиентов.
+        budgets = {
+            f'/admin/api/recipe/{recipe.pk}/change/': 6,
+            f'/admin/api/favorite/{favorite.pk}/change/': 6,
+            f'/admin/api/ingredient/{self.ingredients[0].pk}/change/': 4,
+        }
+        for url, budget in budgets.items():
+            with self.subTest(url=url):
+                self.assertLessEqual(self.count_queries(url), budget)
+
+
+class ApiQueryBudgetTests(QueryBudgetMixin, APITestCase):
+    """Бюджеты запросов маршрутов api/urls.py."""
+    urlconf = 'api.urls'
+    budgets = {
+        'APIRootView.get': (0, 200),
+        'IngredientViewSet.list': (1, 200),
+        'IngredientViewSet.retrieve': (1, 200),
+        'RecipeViewSet.list': (4, 200),
+        'RecipeViewSet.create': (15, 201),
+        'RecipeViewSet.retrieve': (4, 200),
+        'RecipeViewSet.update': (13, 200),
+        'RecipeViewSet.partial_update': (11, 200),
+        'RecipeViewSet.destroy': (12, 204),
+        'RecipeViewSet.download_shopping_cart': (1, 200),
+        'RecipeViewSet.favorite_bulk': (5, 200),
+        'RecipeViewSet.shopping_cart_bulk': (5, 200),
+        'RecipeViewSet.feed': (3, 200),
+        'RecipeViewSet.favorite': (5, 201),
+        'RecipeViewSet.shopping_cart': (5, 201),
+        'RecipeViewSet.get_link': (0, 200),
+        'api.views.RecipeViewSet.recipe_redirect_short_link': (1, 302),
+        'metrics_view.get': (0, 200),
+    }
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.reader = create_user('reader', password=None)
+        cls.admin = create_user('admin', password=None, is_staff=True)
+        cls.ingredients = Ingredient.objects.bulk_create(
+            Ingredient(name=f'ingredient {i}', measurement_unit='г')
+            for i in range(max(cls.sizes)))
+
+    def make_recipe(self, author, ingredients=2):
+        recipe = create_recipe(author)
+        IngredientInRecipe.objects.bulk_create(
+            IngredientInRecipe(recipe=recipe, ingredient=ingredient,
+                               amount=1)
+            for ingredient in self.ingredients[:ingredients])
+        return recipe
+
+    def make_recipes(self, count):
+        return [self.make_recipe(author)
+                for author in create_users('author', count)]
+
+    def recipe_data(self, size):
+        return {
+            'name': 'Новый рецепт', 'text': 'text', 'cooking_time': 5,
+            'image': TINY_IMAGE,
+            'ingredients': [{'id': ingredient.pk, 'amount': 2}
+                            for ingredient in self.ingredients[:size]],
+        }
+
+    def get(self, url, user=None):
+        self.client.force_authenticate(user)
+        return lambda: self.client.get(url)
+
+    def scenario_APIRootView__get(self, size):
+        return self.get('/api/')
+
+    def scenario_IngredientViewSet__list(self, size):
+        return self.get('/api/ingredients/')
+
+    def scenario_IngredientViewSet__retrieve(self, size):
+        return self.get(f'/api/ingredients/{self.ingredients[0].pk}/')
+
+    def scenario_RecipeViewSet__list(self, size):
+        self.make_recipes(size)
+        return self.get(f'/api/recipes/?limit={size}', self.reader)
+
+    def scenario_RecipeViewSet__create(self, size):
+        self.client.force_authenticate(self.reader)
+        return lambda: self.client.post(
+            '/api/recipes/', self.recipe_data(size), format='json')
+
+    def scenario_RecipeViewSet__retrieve(self, size):
+        recipe = self.make_recipe(self.admin, ingredients=size)
+        return self.get(f'/api/recipes/{recipe.pk}/', self.reader)
+
+    def scenario_RecipeViewSet__update(self, size):
+        recipe = self.make_recipe(self.reader, ingredients=size)
+        self.client.force_authenticate(self.reader)
+        return lambda: self.client.put(
+            f'/api/recipes/{recipe.pk}/', self.recipe_data(size),
+            format='json')
+
+    def scenario_RecipeViewSet__partial_update(self, size):
+        recipe = self.make_recipe(self.reader, ingredients=size)
+        data = self.recipe_data(size)
+        del data['image']
+        self.client.force_authenticate(self.reader)
+        return lambda: self.client.patch(
+            f'/api/recipes/{recipe.pk}/', data, format='json')
+
+    def scenario_RecipeViewSet__destroy(self, size):
+        recipe = self.make_recipe(self.reader, ingredients=size)
+        for author in create_users('author', size):
+            Favorite.objects.create(user=author, recipe=recipe)
+            ShoppingCart.objects.create(user=author, recipe=recipe)
+        self.client.force_authenticate(self.reader)
+        return lambda: self.client.delete(f'/api/recipes/{recipe.pk}/')
+
+    def scenario_RecipeViewSet__download_shopping_cart(self, size):
+        for recipe in self.make_recipes(size):
+            ShoppingCart.objects.create(user=self.reader, recipe=recipe)
+        return self.get('/api/recipes/download_shopping_cart/', self.reader)
+
+    def bulk(self, url, size):
+        ids = [recipe.pk for recipe in self.make_recipes(size)]
+        self.client.force_authenticate(self.reader)
+        return lambda: self.client.post(url, {'recipes': ids}, format='json')
+
+    def scenario_RecipeViewSet__favorite_bulk(self, size):
+        return self.bulk('/api/recipes/favorite/', size)
+
+    def scenario_RecipeViewSet__shopping_cart_bulk(self, size):
+        return self.bulk('/api/recipes/shopping_cart/', size)
+
+    def scenario_RecipeViewSet__feed(self, size):
+        for author in create_users('author', size):
+            Subscription.objects.create(user=self.reader, author=author)
+            self.make_recipe(author)
+        return self.get(f'/api/recipes/feed/?limit={size}', self.reader)
+
+    def add_to(self, model, url_name, size):
+        for recipe in self.make_recipes(size):
+            model.objects.create(user=self.reader, recipe=recipe)
+        recipe = self.make_recipe(self.admin)
+        self.client.force_authenticate(self.reader)
+        return lambda: self.client.post(
+            f'/api/recipes/{recipe.pk}/{url_name}/')
+
+    def scenario_RecipeViewSet__favorite(self, size):
+        return self.add_to(Favorite, 'favorite', size)
+
+    def scenario_RecipeViewSet__shopping_cart(self, size):
+        return self.add_to(ShoppingCart, 'shopping_cart', size)
+
+    def scenario_RecipeViewSet__get_link(self, size):
+        recipe = self.make_recipe(self.admin)
+        return self.get(f'/api/recipes/{recipe.pk}/get-link/')
+
+    def scenario_api__views__RecipeViewSet__recipe_redirect_short_link(
+            self, size):
+        recipe = self.make_recipe(self.admin)
+        return self.get(f'/api/s/{recipe.short_code}/')
+
+    def scenario_metrics_view__get(self, size):
+        self.client.force_authenticate(self.admin)
+
+        def request():
+            with override_settings(REQUEST_METRICS=True):
+                return self.client.get('/api/_metrics')
+        return request
@@ -0,0 +1,196 @@
+"""
+Общее для тестов api и users: пользователи и рецепты для фикстур и
+проверка бюджетов запросов маршрутов (QueryBudgetMixin).
+"""
+import os
+import shutil
+import tempfile
+import traceback
+from collections import defaultdict
+from importlib import import_module
+
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.test import override_settings
+from django.urls import URLResolver
+
+from users.models import User
+from .catalog import ingredient_index
+from .metrics import view_name
+from .models import Recipe
+from .shortlinks import click_buffer, short_links
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# PNG 1x1 для создания рецептов через API.
+TINY_IMAGE = (
+    'data:image/png;base64,iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAIAAACQd1PeAAAA'
+    'DElEQVR4nGM4YWQEAALyAS2saifrAAAAAElFTkSuQmCC')
+
+
+def create_user(username, password='pass', **fields):
+    """
+    Пользователь username@example.com. По умолчанию имя — username с
+    заглавной буквы, фамилия — Test; password=None не хеширует пароль.
+    """
+    fields.setdefault('first_name', username.capitalize())
+    fields.setdefault('last_name', 'Test')
+    return User.objects.create_user(
+        email=f'{username}@example.com', username=username,
+        password=password, **fields)
+
+
+def create_users(prefix, count, password=None):
+    """Пользователи prefix0, prefix1, ... с фамилиями 0, 1, ..."""
+    return [create_user(f'{prefix}{i}', password=password,
+                        first_name=prefix.capitalize(), last_name=str(i))
+            for i in range(count)]
+
+
+def create_recipe(author, name='recipe', **fields):
+    """Рецепт без ингредиентов с картинкой-заглушкой."""
+    fields.setdefault('image', 'recipes/images/test.png')
+    fields.setdefault('text', 'text')
+    fields.setdefault('cooking_time', 10)
+    return Recipe.objects.create(author=author, name=name, **fields)
+
+
+def callsite():
+    """
+    Ближайшая к запросу строка кода проекта (не тестов), а если её нет —
+    ближайшая строка библиотеки вне ORM, например поля DRF.
+    """
+    stack = traceback.extract_stack()[:-2]
+    for frame in reversed(stack):
+        path = frame.filename
+        if (path.startswith(BACKEND_DIR) and 'site-packages' not in path
+                and not path.endswith(('tests.py', 'testutils.py',
+                                       'metrics.py', 'manage.py'))):
+            return (f'{os.path.relpath(path, BACKEND_DIR)}:{frame.lineno} '
+                    f'in {frame.name}')
+    for frame in reversed(stack):
+        path = frame.filename.replace(os.sep, '/')
+        if ('/django/db/' not in path and '/django/test/' not in path
+                and 'site-packages/' in path):
+            return (f'{path.split("site-packages/", 1)[1]}:{frame.lineno} '
+                    f'in {frame.name}')
+    return '<неизвестно>'
+
+
+class QueryRecorder:
+    """execute_wrapper: SQL-запросы вместе с местом вызова."""
+
+    def __init__(self):
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        self.queries.append((sql, callsite()))
+        return execute(sql, params, many, context)
+
+    def report(self):
+        """Запросы, сгруппированные по месту вызова."""
+        groups = defaultdict(list)
+        for sql, site in self.queries:
+            groups[site].append(sql)
+        lines = []
+        for site, queries in sorted(groups.items(),
+                                    key=lambda item: -len(item[1])):
+            lines.append(f'  {len(queries)} x {site}')
+            lines.extend(f'      {sql[:300]}'
+                         for sql in dict.fromkeys(queries))
+        return '\n'.join(lines)
+
+
+def route_names(patterns):
+    """Имена представлений маршрутов в формате api.metrics.view_name."""
+    names = set()
+    for pattern in patterns:
+        if isinstance(pattern, URLResolver):
+            names |= route_names(pattern.url_patterns)
+            continue
+        func = pattern.callback
+        view_class = getattr(func, 'cls', None)
+        if view_class is None:
+            names.add(f'{func.__module__}.{func.__qualname__}')
+        elif getattr(func, 'actions', None):
+            names |= {f'{view_class.__name__}.{action}'
+                      for action in func.actions.values()}
+        else:
+            names |= {f'{view_class.__name__}.{method}'
+                      for method in ('get', 'post', 'put', 'patch', 'delete')
+                      if hasattr(view_class, method)}
+    return names
+
+
+class QueryBudgetMixin:
+    """
+    Бюджеты запросов для всех маршрутов urlconf.
+
+    budgets: имя представления -> (бюджет, ожидаемый статус). Для имени
+    Class.action определяется метод scenario_Class__action(size): он
+    создаёт данные размера size (например, size рецептов на странице) и
+    возвращает функцию, выполняющую запрос. Каждый сценарий выполняется
+    для всех sizes с пустыми кешами; тест падает, если число запросов
+    зависит от размера или превышает бюджет, и выводит SQL по местам
+    вызова.
+    """
+    urlconf = None
+    budgets = {}
+    sizes = (1, 50)
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.media_root = tempfile.mkdtemp()
+        cls.media_override = override_settings(
+            MEDIA_ROOT=cls.media_root, IMAGE_VARIANT_WORKERS=0)
+        cls.media_override.enable()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.media_override.disable()
+        shutil.rmtree(cls.media_root, ignore_errors=True)
+        super().tearDownClass()
+
+    def reset_caches(self):
+        cache.clear()
+        ingredient_index.invalidate()
+        short_links.clear()
+
+    def measure(self, name, size):
+        with transaction.atomic():
+            request = getattr(self, f'scenario_{name.replace(".", "__")}')(
+                size)
+            self.reset_caches()
+            recorder = QueryRecorder()
+            with connection.execute_wrapper(recorder):
+                response = request()
+                if response.streaming:
+                    b''.join(response.streaming_content)
+            click_buffer.flush()
+            self.client.force_authenticate(None)
+            transaction.set_rollback(True)
+        return response, recorder
+
+    def test_every_route_has_budget(self):
+        self.assertEqual(
+            route_names(import_module(self.urlconf).urlpatterns),
+            set(self.budgets))
+
+    def test_query_budgets(self):
+        for name, (budget, status) in sorted(self.budgets.items()):
+            with self.subTest(view=name):
+                recorders = {}
+                for size in self.sizes:
+                    response, recorders[size] = self.measure(name, size)
+                    self.assertEqual(response.status_code, status,
+                                     getattr(response, 'data', None))
+                    self.assertEqual(view_name(response.wsgi_request), name)
+                counts = {size: len(recorder.queries)
+                          for size, recorder in recorders.items()}
+                if len(set(counts.values())) > 1 or max(
+                        counts.values()) > budget:
+                    self.fail(
+                        f'{name}: запросов {counts}, бюджет {budget}\n'
+                        + '\n'.join(
+                            f'size={size}:\n{recorder.report()}'
+                            for size, recorder in recorders.items()))
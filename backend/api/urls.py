@@ -1,5 +1,6 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
+from .metrics import metrics_view
 from .views import IngredientViewSet, RecipeViewSet
 
 
@@ -9,6 +10,7 @@ router.register('recipes', RecipeViewSet, basename='recipes')
 
 urlpatterns = [
     path('', include(router.urls)),
-    path('s/<int:recipe_pk>/', RecipeViewSet.recipe_redirect_short_link,
+    path('s/<str:code>/', RecipeViewSet.recipe_redirect_short_link,
          name='recipe-short-link'),
+    path('_metrics', metrics_view, name='metrics'),
 ]
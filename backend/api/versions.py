@@ -0,0 +1,52 @@
+import time
+
+from django.core.cache import cache
+from django.db import transaction
+
+
+def _version_key(parts):
+    return 'version:' + ':'.join(str(part) for part in parts)
+
+
+def _initial_version():
+    # Версии входят в ETag, поэтому после вытеснения ключа из кеша
+    # отсчёт начинается не с единицы, а с текущего времени в мс:
+    # иначе старый ETag мог бы совпасть с новой версией.
+    return int(time.time() * 1000)
+
+
+def get_version(*parts):
+    """Текущая версия набора данных, например ('shopping_cart', user_id)."""
+    return cache.get_or_set(_version_key(parts), _initial_version, None)
+
+
+def get_versions(*parts_list):
+    """get_version для нескольких наборов данных за одно обращение к кешу."""
+    keys = [_version_key(parts) for parts in parts_list]
+    versions = cache.get_many(keys)
+    missing = [key for key in keys if key not in versions]
+    if missing:
+        # add() не затирает версию, заданную параллельным запросом.
+        for key in missing:
+            cache.add(key, _initial_version(), None)
+        versions.update(cache.get_many(missing))
+    return [versions[key] for key in keys]
+
+
+def bump_version(*parts):
+    """Увеличивает версию, делая устаревшими все производные от неё кеши."""
+    key = _version_key(parts)
+    try:
+        return cache.incr(key)
+    except ValueError:
+        version = _initial_version()
+        cache.set(key, version, None)
+        return version
+
+
+def bump_version_on_commit(*parts):
+    """
+    bump_version после фиксации транзакции: иначе параллельный запрос мог
+    бы запомнить старые данные под новой версией.
+    """
+    transaction.on_commit(lambda: bump_version(*parts))
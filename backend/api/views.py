@@ -1,6 +1,10 @@
-from django.db.models import Sum
-from django.http import HttpResponse
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Exists, OuterRef, Sum
+from django.http import Http404, HttpResponse, StreamingHttpResponse
 from django.shortcuts import redirect
+from django.utils.cache import get_conditional_response
+from django.utils.http import urlencode
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework import viewsets, status
 from rest_framework.decorators import action
@@ -8,73 +12,255 @@ from rest_framework.generics import get_object_or_404
 from rest_framework.permissions import IsAuthenticated, AllowAny
 from rest_framework.response import Response
 
+from .catalog import ingredient_index
+from .conditional import conditional, make_etag, viewer_version
+from .feed import feed_recipes, feed_sources
+from .fragments import ingredient_list_prefetch, render_recipes
 from .models import (Ingredient, Recipe, Favorite,
                      ShoppingCart, IngredientInRecipe)
-from .serializers import (IngredientSerializer,
+from .relations import link_recipes, unlink_recipes
+from .routing import primary_reads
+from .shortlinks import click_buffer, encode, short_link_url, short_links
+from .serializers import (MAX_ID, IngredientSerializer, RecipeIdsSerializer,
                           RecipeListSerializer, RecipeCreateSerializer)
+from .pagination import (FeedCursorPagination,
+                         OptionalCursorPaginationMixin,
+                         RecipeCursorPagination)
 from .permissions import IsAuthorOrReadOnly
+from .versions import get_version
 from .filters import IngredientSearchFilter, RecipeFilter
 from users.serializers import RecipeMinifiedSerializer
-from django.urls import reverse
+
+
+def recipe_queryset(user):
+    """
+    Рецепты для чтения: автор и ингредиенты загружаются заранее, признаки
+    избранного и списка покупок вычисляются в том же запросе.
+    """
+    queryset = Recipe.objects.select_related('author').prefetch_related(
+        ingredient_list_prefetch())
+    if user.is_authenticated:
+        queryset = queryset.annotate(
+            is_favorited=Exists(Favorite.objects.filter(
+                user=user, recipe=OuterRef('pk'))),
+            is_in_shopping_cart=Exists(ShoppingCart.objects.filter(
+                user=user, recipe=OuterRef('pk'))),
+        )
+    return queryset
+
+
+def recipe_list_versions():
+    return (('recipes',), ('ingredients',))
+
+
+def recipe_author_id(pk):
+    """
+    Автор рецепта не меняется, поэтому его id хранится в кеше без срока
+    жизни: запрос к БД нужен только при первом обращении к рецепту.
+    """
+    if not str(pk).isdigit() or int(pk) > MAX_ID:
+        return None
+    key = f'recipe_author:{pk}'
+    author_id = cache.get(key)
+    if author_id is None:
+        author_id = Recipe.objects.filter(pk=pk).values_list(
+            'author_id', flat=True).first()
+        if author_id is not None:
+            cache.set(key, author_id, None)
+    return author_id
+
+
+def recipe_detail_versions(pk):
+    return (('recipe', pk), ('author', recipe_author_id(pk)),
+            ('ingredients',))
+
+
+def recipe_list_validators(request, *args, **kwargs):
+    """ETag ленты: версии рецептов и каталога плюс состояние читателя."""
+    return make_etag(
+        'recipes', *(get_version(*parts) for parts in recipe_list_versions()),
+        viewer_version(request.user)), None
+
+
+def recipe_detail_validators(request, pk, *args, **kwargs):
+    """
+    ETag рецепта по версиям, которые сбрасываются при изменении рецепта,
+    его автора, ингредиентов и вариантов картинки: без запросов к БД,
+    кроме первого определения автора рецепта.
+    """
+    return make_etag(
+        'recipe', pk,
+        *(get_version(*parts) for parts in recipe_detail_versions(pk)),
+        viewer_version(request.user)), None
+
+
+def ingredient_list_validators(request, *args, **kwargs):
+    return make_etag('ingredients', get_version('ingredients')), None
+
+
+def anonymous_cache_key(request, versions):
+    """
+    Ключ кеша ответа для анонимного читателя: хост, путь, параметры
+    запроса и версии данных, поэтому запись рецептов и авторов делает
+    старые ответы недоступными.
+    """
+    query = urlencode(sorted(request.GET.lists()), doseq=True)
+    return 'recipes_response:{}:{}{}?{}'.format(
+        ':'.join(str(get_version(*parts)) for parts in versions),
+        request.get_host(), request.path, query)
 
 
 class IngredientViewSet(viewsets.ReadOnlyModelViewSet):
     queryset = Ingredient.objects.all()
     serializer_class = IngredientSerializer
     permission_classes = (AllowAny,)
+    read_from_replica = True
     filter_backends = (IngredientSearchFilter,)
     search_fields = ('^name',)
     pagination_class = None
 
+    @conditional(ingredient_list_validators)
+    def list(self, request, *args, **kwargs):
+        # Поиск по префиксу обслуживается индексом в памяти, без БД.
+        name = request.query_params.get(self.filter_backends[0].search_param)
+        if name:
+            return Response(ingredient_index.search(name.strip()))
+        return Response(ingredient_index.all())
+
 
-class RecipeViewSet(viewsets.ModelViewSet):
+class RecipeViewSet(OptionalCursorPaginationMixin, viewsets.ModelViewSet):
     queryset = Recipe.objects.all()
     permission_classes = (IsAuthorOrReadOnly,)
+    read_from_replica = True
     filter_backends = (DjangoFilterBackend,)
     filterset_class = RecipeFilter
+    cursor_pagination_class = RecipeCursorPagination
+
+    def get_queryset(self):
+        if self.action in ('list', 'retrieve'):
+            # Остальное берётся из кеша фрагментов (api/fragments.py).
+            return Recipe.objects.select_related('author')
+        return recipe_queryset(self.request.user)
 
     def get_permissions(self):
         if self.action in ['list', 'retrieve', 'get_link']:
             permission_classes = [AllowAny]
-        elif self.action in ['favorite', 'shopping_cart',
-                             'download_shopping_cart', 'create']:
+        elif self.action in ['favorite', 'shopping_cart', 'favorite_bulk',
+                             'shopping_cart_bulk', 'download_shopping_cart',
+                             'feed', 'create']:
             permission_classes = [IsAuthenticated]
         else:
             permission_classes = [IsAuthorOrReadOnly]
         return [permission() for permission in permission_classes]
 
-    def recipe_redirect_short_link(request, recipe_pk):
-        get_object_or_404(Recipe, pk=recipe_pk)
-        return redirect(f"/recipes/{recipe_pk}/")
+    def recipe_redirect_short_link(request, code):
+        pk = short_links.resolve(code)
+        if pk is None:
+            raise Http404('No Recipe matches the given query.')
+        if click_buffer.record(pk):
+            click_buffer.flush()
+        return redirect(f"/recipes/{pk}/")
 
     def get_serializer_class(self):
         if self.action in ('list', 'retrieve'):
             return RecipeListSerializer
         return RecipeCreateSerializer
 
+    def _anonymous_cached(self, request, versions, render):
+        """Отдаёт анонимным читателям сохранённый ответ."""
+        if request.user.is_authenticated:
+            return render()
+        key = anonymous_cache_key(request, versions)
+        data = cache.get(key)
+        if data is not None:
+            return Response(data)
+        # Общий кеш строится по основной БД, см. api/routing.py.
+        with primary_reads():
+            response = render()
+        if response.status_code == status.HTTP_200_OK:
+            cache.set(key, response.data, settings.RECIPE_CACHE_TIMEOUT)
+        return response
+
+    def _render_list(self, request):
+        queryset = self.filter_queryset(self.get_queryset())
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response(
+                render_recipes(request, page))
+        return Response(render_recipes(request, queryset))
+
+    @conditional(recipe_list_validators)
+    def list(self, request, *args, **kwargs):
+        return self._anonymous_cached(
+            request, recipe_list_versions(),
+            lambda: self._render_list(request))
+
+    @conditional(recipe_detail_validators)
+    def retrieve(self, request, *args, **kwargs):
+        return self._anonymous_cached(
+            request, recipe_detail_versions(kwargs['pk']),
+            lambda: Response(
+                render_recipes(request, [self.get_object()])[0]))
+
+    @action(detail=False, methods=['get'],
+            pagination_class=FeedCursorPagination,
+            cursor_pagination_class=FeedCursorPagination)
+    def feed(self, request):
+        """
+        Рецепты авторов из подписок, новые первыми. Лента листается только
+        курсором: номер страницы потребовал бы COUNT и OFFSET по ней.
+        """
+        sources = feed_sources(request.user)
+        page = self.paginate_queryset(sources)
+        if page is not None:
+            return self.get_paginated_response(render_recipes(
+                request, feed_recipes(page)))
+        recipes = {recipe.pk: recipe for source in sources
+                   for recipe in feed_recipes(source)}
+        return Response(render_recipes(request, sorted(
+            recipes.values(), key=lambda recipe: (recipe.pub_date, recipe.pk),
+            reverse=True)))
+
     def _add_or_remove_from(self, model, request, pk):
-        recipe = get_object_or_404(Recipe, pk=pk)
         user = request.user
 
+        recipe_id = int(pk) if pk.isdigit() and int(pk) <= MAX_ID else None
         if request.method == 'POST':
-            # This part is correct
-            if model.objects.filter(user=user, recipe=recipe).exists():
-                return Response({'errors': 'Рецепт уже добавлен.'},
-                                status=status.HTTP_400_BAD_REQUEST)
-            model.objects.create(user=user, recipe=recipe)
-            serializer = RecipeMinifiedSerializer(recipe)
-            return Response(serializer.data, status=status.HTTP_201_CREATED)
-
-        instance = model.objects.filter(user=user, recipe=recipe)
-        if instance.exists():
-            instance.delete()
-            return Response(status=status.HTTP_204_NO_CONTENT)
+            if recipe_id is not None and link_recipes(
+                    model, user, [recipe_id]):
+                serializer = RecipeMinifiedSerializer(
+                    Recipe.objects.get(pk=recipe_id))
+                return Response(serializer.data,
+                                status=status.HTTP_201_CREATED)
+            # Различаем ошибки только после неудачного добавления.
+            get_object_or_404(Recipe, pk=recipe_id)
+            return Response({'errors': 'Рецепт уже добавлен.'},
+                            status=status.HTTP_400_BAD_REQUEST)
 
+        if recipe_id is not None and unlink_recipes(model, user, [recipe_id]):
+            return Response(status=status.HTTP_204_NO_CONTENT)
+        # Различаем ошибки только после неудачного удаления.
+        get_object_or_404(Recipe, pk=recipe_id)
         return Response(
             {'errors': 'Рецепт не был добавлен в этот список.'},
             status=status.HTTP_400_BAD_REQUEST
         )
 
+    def _bulk_add_or_remove(self, model, request):
+        """
+        Добавляет или удаляет рецепты {"recipes": [id, ...]} одним
+        запросом к БД. Несуществующие и уже добавленные (удалённые)
+        рецепты пропускаются.
+        """
+        serializer = RecipeIdsSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        recipe_ids = serializer.validated_data['recipes']
+        if request.method == 'POST':
+            return Response(
+                {'added': link_recipes(model, request.user, recipe_ids)})
+        return Response(
+            {'removed': unlink_recipes(model, request.user, recipe_ids)})
+
     @action(detail=True, methods=['post', 'delete'])
     def favorite(self, request, pk=None):
         return self._add_or_remove_from(Favorite, request, pk)
@@ -83,34 +269,80 @@ class RecipeViewSet(viewsets.ModelViewSet):
     def shopping_cart(self, request, pk=None):
         return self._add_or_remove_from(ShoppingCart, request, pk)
 
-    @action(detail=False, methods=['get'])
-    def download_shopping_cart(self, request):
-        ingredients = IngredientInRecipe.objects.filter(
-            recipe__in_shopping_cart__user=request.user
-        ).values(
-            'ingredient__name', 'ingredient__measurement_unit'
-        ).annotate(total_amount=Sum('amount'))
-
-        shopping_list = "Список покупок для Foodgram:\n\n"
-        for item in ingredients:
+    @action(detail=False, methods=['post', 'delete'], url_path='favorite')
+    def favorite_bulk(self, request):
+        return self._bulk_add_or_remove(Favorite, request)
+
+    @action(detail=False, methods=['post', 'delete'],
+            url_path='shopping_cart')
+    def shopping_cart_bulk(self, request):
+        return self._bulk_add_or_remove(ShoppingCart, request)
+
+    @staticmethod
+    def _shopping_list_lines(ingredients, cache_key):
+        """
+        Строки списка покупок по мере чтения из БД. Готовый текст
+        сохраняется в кеш, если список не слишком большой.
+        """
+        max_items = settings.SHOPPING_LIST_CACHE_MAX_ITEMS
+        header = "Список покупок для Foodgram:\n\n"
+        lines = [header]
+        yield header
+        for item in ingredients.iterator():
             name = item['ingredient__name']
             unit = item['ingredient__measurement_unit']
             amount = item['total_amount']
-            shopping_list += f"• {name} ({unit}) — {amount}\n"
+            line = f"• {name} ({unit}) — {amount}\n"
+            if lines is not None:
+                lines.append(line)
+                if len(lines) > max_items:
+                    lines = None
+            yield line
+        if lines is not None:
+            cache.set(cache_key, ''.join(lines),
+                      settings.SHOPPING_LIST_CACHE_TIMEOUT)
+
+    @action(detail=False, methods=['get'])
+    def download_shopping_cart(self, request):
+        user = request.user
+        etag = '"{}-{}-{}-{}"'.format(
+            user.pk,
+            get_version('shopping_cart', user.pk),
+            get_version('recipe_ingredients'),
+            get_version('ingredients'),
+        )
+        not_modified = get_conditional_response(request, etag=etag)
+        if not_modified is not None:
+            return not_modified
 
-        response = HttpResponse(
-            shopping_list, content_type='text/plain; charset=utf-8')
+        cache_key = f'shopping_list:{etag}'
+        shopping_list = cache.get(cache_key)
+        if shopping_list is not None:
+            response = HttpResponse(
+                shopping_list, content_type='text/plain; charset=utf-8')
+        else:
+            ingredients = IngredientInRecipe.objects.filter(
+                recipe__in_shopping_cart__user=user
+            ).values(
+                'ingredient__name', 'ingredient__measurement_unit'
+            ).annotate(total_amount=Sum('amount')).order_by(
+                'ingredient__name')
+            response = StreamingHttpResponse(
+                self._shopping_list_lines(ingredients, cache_key),
+                content_type='text/plain; charset=utf-8')
         response['Content-Disposition'] = (
             'attachment; filename="shopping_list.txt"'
         )
+        response['ETag'] = etag
+        response['Cache-Control'] = 'private, no-cache'
         return response
 
     @action(
         detail=True, methods=["get"], url_path="get-link"
     )
     def get_link(self, request, pk=None):
-        short_link_path = reverse(
-            "recipe-short-link", args=[pk])
-        absolute_short_link = request.build_absolute_uri(short_link_path)
-        return Response({"short-link": absolute_short_link},
-                        status=status.HTTP_200_OK)
+        # Код вычисляется из pk и совпадает с Recipe.short_code.
+        if not pk.isdigit():
+            raise Http404
+        url = short_link_url(request, encode(int(pk)))
+        return Response({"short-link": url}, status=status.HTTP_200_OK)
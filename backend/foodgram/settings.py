@@ -35,6 +35,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'api.metrics.RequestMetricsMiddleware',
+    'api.routing.ReadReplicaMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -64,6 +66,10 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'foodgram.wsgi.application'
 
+# Метрики запросов (api/metrics.py): заголовок Server-Timing и сводка
+# для Prometheus на /api/_metrics (доступна администраторам).
+REQUEST_METRICS = os.getenv('REQUEST_METRICS', 'False') == 'True'
+
 # Database
 # https://docs.djangoproject.com/en/4.2/ref/settings/#databases
 DATABASES = {
@@ -79,6 +85,47 @@ DATABASES = {
     }
 }
 
+# Реплика для чтения (api/routing.py): PostgreSQL задаётся DB_REPLICA_HOST,
+# для проверки на SQLite достаточно DB_REPLICA_NAME — копии файла БД.
+# После записи клиент READ_REPLICA_STICKY_SECONDS секунд читает с
+# основной БД: время записи он возвращает в cookie last_write или в
+# заголовке X-Last-Write. Интервал должен покрывать отставание реплики.
+REPLICA_CONFIGURED = bool(
+    os.getenv('DB_REPLICA_HOST') or os.getenv('DB_REPLICA_NAME'))
+if REPLICA_CONFIGURED:
+    DATABASES['replica'] = {
+        **DATABASES['default'],
+        'NAME': os.getenv('DB_REPLICA_NAME', DATABASES['default']['NAME']),
+        'HOST': os.getenv('DB_REPLICA_HOST', DATABASES['default']['HOST']),
+        'PORT': os.getenv('DB_REPLICA_PORT', DATABASES['default']['PORT']),
+        'TEST': {'MIRROR': 'default'},
+    }
+elif DATABASES['default']['ENGINE'] == 'django.db.backends.sqlite3':
+    # Отдельная пустая БД для тестов маршрутизации на двух базах: файла
+    # она не создаёт, и без DB_REPLICA_* чтение на неё не направляется.
+    DATABASES['replica'] = {**DATABASES['default'], 'NAME': ':memory:'}
+READ_REPLICA_DATABASE = os.getenv(
+    'READ_REPLICA_DATABASE', 'replica' if REPLICA_CONFIGURED else '')
+READ_REPLICA_STICKY_SECONDS = int(os.getenv('READ_REPLICA_STICKY_SECONDS', 5))
+DATABASE_ROUTERS = ['api.routing.ReadReplicaRouter']
+
+# Cache
+# Локальная память по умолчанию; в продакшене — общий для процессов кеш,
+# например django.core.cache.backends.redis.RedisCache. Версии данных
+# (api/versions.py), по которым проверяются кеши ответов, фрагментов и
+# токенов, другие процессы видят только в общем кеше.
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv(
+            'CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.getenv('CACHE_LOCATION', ''),
+    }
+}
+CACHE_IS_SHARED = CACHES['default']['BACKEND'] not in (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
 AUTH_PASSWORD_VALIDATORS = [
@@ -120,7 +167,7 @@ AUTH_USER_MODEL = 'users.User'
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework.authentication.TokenAuthentication',
+        'users.authentication.CachedTokenAuthentication',
     ),
     'DEFAULT_PERMISSION_CLASSES': (
         'rest_framework.permissions.IsAuthenticatedOrReadOnly',
@@ -129,6 +176,69 @@ REST_FRAMEWORK = {
     'PAGE_SIZE': 6,
 }
 
+# Кеш пользователей по ключу токена. Отзыв токена другие процессы видят
+# только через версию в общем кеше, поэтому по умолчанию кеш включён
+# лишь при CACHE_IS_SHARED, а включённый при кеше в памяти процесса он
+# не проходит проверку users.E001. Далее: размер LRU в процессе, время
+# жизни записи (секунды) и дублирование снимков в общий кеш CACHES.
+TOKEN_AUTH_CACHE = os.getenv(
+    'TOKEN_AUTH_CACHE', str(CACHE_IS_SHARED)) == 'True'
+TOKEN_AUTH_CACHE_SIZE = int(os.getenv('TOKEN_AUTH_CACHE_SIZE', 10_000))
+TOKEN_AUTH_CACHE_TTL = int(os.getenv('TOKEN_AUTH_CACHE_TTL', 60))
+TOKEN_AUTH_SHARED_CACHE = os.getenv(
+    'TOKEN_AUTH_SHARED_CACHE', 'False') == 'True'
+
+# Максимальный возраст индекса ингредиентов в памяти процесса (секунды).
+INGREDIENT_INDEX_TTL = int(os.getenv('INGREDIENT_INDEX_TTL', 300))
+
+# Кеш готовых списков покупок: время жизни (секунды) и максимальный
+# размер списка, который ещё имеет смысл держать в кеше.
+SHOPPING_LIST_CACHE_TIMEOUT = int(
+    os.getenv('SHOPPING_LIST_CACHE_TIMEOUT', 60 * 60))
+SHOPPING_LIST_CACHE_MAX_ITEMS = 5000
+
+# Время жизни кешированных ответов ленты и страниц рецептов для анонимов.
+RECIPE_CACHE_TIMEOUT = int(os.getenv('RECIPE_CACHE_TIMEOUT', 60 * 15))
+
+# Время жизни фрагментов рецептов (api/fragments.py). Устаревшие
+# фрагменты недоступны по ключу сразу, если версии общие для процессов;
+# с кешем в памяти процесса другие воркеры видят изменение лишь по
+# истечении срока, поэтому он короткий.
+RECIPE_FRAGMENT_TIMEOUT = int(os.getenv(
+    'RECIPE_FRAGMENT_TIMEOUT', 60 * 60 if CACHE_IS_SHARED else 60))
+
+# Сколько подписчиков автора получает новый рецепт одним запросом
+# (api/feed.py).
+FEED_FANOUT_BATCH_SIZE = int(os.getenv('FEED_FANOUT_BATCH_SIZE', 1000))
+# Сколько последних рецептов автора попадает в ленту при подписке и
+# перестроении лент: несколько первых страниц ленты.
+FEED_BACKFILL_RECIPES = int(os.getenv('FEED_BACKFILL_RECIPES', 60))
+# Рецепты авторов с таким числом подписчиков не рассылаются по лентам,
+# а читаются при чтении ленты.
+FEED_PULL_FOLLOWERS = int(os.getenv('FEED_PULL_FOLLOWERS', 10000))
+
+# Короткие ссылки (api/shortlinks.py): размер кеша кодов в процессе,
+# время жизни найденных и неизвестных кодов (секунды), а также когда
+# записывать накопленные переходы: по числу переходов или по времени.
+SHORT_LINK_CACHE_SIZE = int(os.getenv('SHORT_LINK_CACHE_SIZE', 100_000))
+SHORT_LINK_CACHE_TTL = int(os.getenv('SHORT_LINK_CACHE_TTL', 60 * 60))
+SHORT_LINK_NEGATIVE_TTL = int(os.getenv('SHORT_LINK_NEGATIVE_TTL', 30))
+SHORT_LINK_FLUSH_SIZE = int(os.getenv('SHORT_LINK_FLUSH_SIZE', 1000))
+SHORT_LINK_FLUSH_INTERVAL = int(os.getenv('SHORT_LINK_FLUSH_INTERVAL', 10))
+
+# Уменьшенные копии картинок рецептов и аватаров: наибольшая сторона
+# в пикселях для каждого варианта, качество, число потоков обработки
+# (0 — обрабатывать синхронно в потоке запроса) и длина очереди пула,
+# сверх которой картинки обрабатываются в потоке запроса.
+IMAGE_VARIANT_SIZES = {
+    'thumbnail': 320,
+    'card': 640,
+    'full': 1280,
+}
+IMAGE_VARIANT_QUALITY = 80
+IMAGE_VARIANT_WORKERS = int(os.getenv('IMAGE_VARIANT_WORKERS', 2))
+IMAGE_VARIANT_QUEUE_SIZE = int(os.getenv('IMAGE_VARIANT_QUEUE_SIZE', 100))
+
 DJOSER = {
     'PASSWORD_RESET_CONFIRM_URL': '#/users/password/reset/confirm/{uid}/{token}',
     'USERNAME_RESET_CONFIRM_URL': '#/users/username/reset/confirm/{uid}/{token}',
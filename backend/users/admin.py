@@ -5,12 +5,17 @@ from .models import User, Subscription
 
 @admin.register(User)
 class UserAdmin(UserAdmin):
-    list_display = ('id', 'username', 'email', 'first_name', 'last_name')
+    list_display = ('id', 'username', 'email', 'first_name', 'last_name',
+                    'recipes_count', 'followers_count')
     search_fields = ('email', 'username')
-    list_filter = ('email', 'username')
+    list_filter = ('is_staff', 'is_active')
+    show_full_result_count = False
 
 
 @admin.register(Subscription)
 class SubscriptionAdmin(admin.ModelAdmin):
     list_display = ('user', 'author')
+    list_select_related = ('user', 'author')
     search_fields = ('user__username', 'author__username')
+    autocomplete_fields = ('user', 'author')
+    show_full_result_count = False
@@ -0,0 +1,102 @@
+import copy
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+
+from api.versions import bump_version, get_version
+
+
+class TokenUserCache:
+    """
+    LRU-кеш процесса: ключ токена -> снимок пользователя.
+
+    Запись действительна TOKEN_AUTH_CACHE_TTL секунд и пока не изменилась
+    версия ('auth_user', id) в общем кеше. Версию увеличивает
+    invalidate_user при выходе, смене пароля, деактивации и любом
+    сохранении пользователя. При TOKEN_AUTH_SHARED_CACHE снимки также
+    хранятся в кеше Django и переиспользуются другими процессами.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    @staticmethod
+    def _shared_key(key):
+        return f'auth_token:{key}'
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+        if entry is None and settings.TOKEN_AUTH_SHARED_CACHE:
+            entry = cache.get(self._shared_key(key))
+            if entry is not None:
+                self._store(key, entry)
+        if entry is None:
+            return None
+        user, version, expires_at = entry
+        if (time.time() > expires_at
+                or get_version('auth_user', user.pk) != version):
+            self.discard(key)
+            return None
+        # Каждый запрос получает свою копию снимка.
+        return copy.copy(user)
+
+    def _store(self, key, entry):
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > settings.TOKEN_AUTH_CACHE_SIZE:
+                self._entries.popitem(last=False)
+
+    def set(self, key, user):
+        ttl = settings.TOKEN_AUTH_CACHE_TTL
+        entry = (copy.copy(user), get_version('auth_user', user.pk),
+                 time.time() + ttl)
+        self._store(key, entry)
+        if settings.TOKEN_AUTH_SHARED_CACHE:
+            cache.set(self._shared_key(key), entry, ttl)
+
+    def discard(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+        if settings.TOKEN_AUTH_SHARED_CACHE:
+            cache.delete(self._shared_key(key))
+
+    def invalidate_user(self, user_id):
+        bump_version('auth_user', user_id)
+        with self._lock:
+            for key in [key for key, (user, _, _) in self._entries.items()
+                        if user.pk == user_id]:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+token_user_cache = TokenUserCache()
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """
+    TokenAuthentication без запроса к БД для недавно виденных токенов.
+    Работает при TOKEN_AUTH_CACHE, то есть только с общим кешем.
+    """
+
+    def authenticate_credentials(self, key):
+        if not settings.TOKEN_AUTH_CACHE:
+            return super().authenticate_credentials(key)
+        user = token_user_cache.get(key)
+        if user is not None:
+            return user, Token(key=key, user=user)
+        user, token = super().authenticate_credentials(key)
+        token_user_cache.set(key, user)
+        return user, token
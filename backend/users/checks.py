@@ -0,0 +1,20 @@
+from django.conf import settings
+from django.core.checks import Error, register
+
+
+@register()
+def token_cache_needs_shared_cache(app_configs, **kwargs):
+    """
+    Кеш токенов проверяет отзыв по версии в CACHES; при кеше в памяти
+    процесса остальные процессы принимали бы отозванный токен до
+    TOKEN_AUTH_CACHE_TTL секунд.
+    """
+    if settings.TOKEN_AUTH_CACHE and not settings.CACHE_IS_SHARED:
+        return [Error(
+            'TOKEN_AUTH_CACHE requires a cache shared between processes.',
+            hint=('Set CACHE_BACKEND, e.g. '
+                  'django.core.cache.backends.redis.RedisCache, '
+                  'or TOKEN_AUTH_CACHE=False.'),
+            id='users.E001',
+        )]
+    return []
@@ -1,14 +1,27 @@
 from django.contrib.auth.models import AbstractUser
 from django.db import models
 
+from api.mixins import CountersMixin
 
-class User(AbstractUser):
+
+class User(CountersMixin, AbstractUser):
     email = models.EmailField(
         'Адрес электронной почты', max_length=254, unique=True)
     first_name = models.CharField('Имя', max_length=150)
     last_name = models.CharField('Фамилия', max_length=150)
     avatar = models.ImageField(
         'Аватар', upload_to='users/avatars/', blank=True, null=True)
+    avatar_variants = models.JSONField(
+        'Варианты аватара', default=dict, blank=True, editable=False)
+    recipes_count = models.PositiveIntegerField(
+        'Число рецептов', default=0, editable=False)
+    followers_count = models.PositiveIntegerField(
+        'Число подписчиков', default=0, editable=False)
+    following_count = models.PositiveIntegerField(
+        'Число подписок', default=0, editable=False)
+    updated_at = models.DateTimeField('Дата изменения', auto_now=True)
+
+    counter_fields = ('recipes_count', 'followers_count', 'following_count')
 
     USERNAME_FIELD = 'email'
     REQUIRED_FIELDS = ['username', 'first_name', 'last_name']
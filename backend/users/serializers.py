@@ -1,36 +1,57 @@
 from djoser.serializers import UserCreateSerializer, UserSerializer
 from rest_framework import serializers
 from .models import User, Subscription
+from api.fields import ImageVariantsField
+from api.metrics import TimedRepresentationMixin
 from api.models import Recipe
 from drf_extra_fields.fields import Base64ImageField
 
 
-class CustomUserCreateSerializer(UserCreateSerializer):
+class CustomUserCreateSerializer(TimedRepresentationMixin,
+                                 UserCreateSerializer):
     class Meta(UserCreateSerializer.Meta):
         model = User
         fields = ('email', 'id', 'username',
                   'first_name', 'last_name', 'password')
 
 
-class RecipeMinifiedSerializer(serializers.ModelSerializer):
+class RecipeMinifiedSerializer(TimedRepresentationMixin,
+                               serializers.ModelSerializer):
+    image_variants = ImageVariantsField()
+
     class Meta:
         model = Recipe
-        fields = ('id', 'name', 'image', 'cooking_time')
+        fields = ('id', 'name', 'image', 'image_variants', 'cooking_time')
 
 
-class CustomUserSerializer(UserSerializer):
+class CustomUserSerializer(TimedRepresentationMixin, UserSerializer):
     is_subscribed = serializers.SerializerMethodField()
+    avatar_variants = ImageVariantsField()
 
     class Meta:
         model = User
         fields = ('email', 'id', 'username', 'first_name',
-                  'last_name', 'is_subscribed', 'avatar')
+                  'last_name', 'is_subscribed', 'avatar', 'avatar_variants')
 
     def get_is_subscribed(self, obj):
-        user = self.context.get('request').user
-        if user.is_anonymous:
+        request = self.context.get('request')
+        if request.user.is_anonymous:
             return False
-        return Subscription.objects.filter(user=user, author=obj).exists()
+        return obj.pk in self.get_subscribed_ids(request)
+
+    @staticmethod
+    def get_subscribed_ids(request):
+        """
+        Множество id авторов, на которых подписан текущий пользователь.
+        Загружается один раз за запрос и переиспользуется всеми
+        вложенными сериализаторами.
+        """
+        subscribed_ids = getattr(request, '_subscribed_ids', None)
+        if subscribed_ids is None:
+            subscribed_ids = set(Subscription.objects.filter(
+                user=request.user).values_list('author_id', flat=True))
+            request._subscribed_ids = subscribed_ids
+        return subscribed_ids
 
 
 class SubscriptionSerializer(CustomUserSerializer):
@@ -43,6 +64,10 @@ class SubscriptionSerializer(CustomUserSerializer):
         read_only_fields = ('email', 'username', 'first_name', 'last_name')
 
     def get_recipes(self, obj):
+        # Подготовлено в CustomUserViewSet.subscriptions.
+        if hasattr(obj, 'recipes_preview'):
+            return RecipeMinifiedSerializer(
+                obj.recipes_preview, many=True).data
         recipes_limit = self.context.get(
             'request').query_params.get('recipes_limit')
         recipes = obj.recipes.all()
@@ -54,7 +79,7 @@ class SubscriptionSerializer(CustomUserSerializer):
         return RecipeMinifiedSerializer(recipes, many=True).data
 
     def get_recipes_count(self, obj):
-        return obj.recipes.count()
+        return obj.recipes_count
 
 
 class SetAvatarSerializer(serializers.ModelSerializer):
@@ -66,8 +91,11 @@ class SetAvatarSerializer(serializers.ModelSerializer):
         fields = ('avatar',)
 
 
-class AvatarSerializer(serializers.ModelSerializer):
+class AvatarSerializer(TimedRepresentationMixin,
+                       serializers.ModelSerializer):
     """Serializer for responding with the avatar URL."""
+    avatar_variants = ImageVariantsField()
+
     class Meta:
         model = User
-        fields = ('avatar',)
+        fields = ('avatar', 'avatar_variants')
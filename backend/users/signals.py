@@ -0,0 +1,66 @@
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+
+from api.counters import deleted_with, shift_counter, shift_counters
+from api.images import remove_variant_files, variants_ready
+from api.versions import bump_version_on_commit
+from .authentication import token_user_cache
+from .models import Subscription, User
+
+
+@receiver(post_save, sender=Subscription)
+@receiver(post_delete, sender=Subscription)
+def update_subscription_counts(sender, instance, created=False, **kwargs):
+    if kwargs['signal'] is post_save and not created:
+        return
+    # is_subscribed входит в ETag подписчика.
+    bump_version_on_commit('relations', instance.user_id)
+    if deleted_with(kwargs.get('origin'), User):
+        # Счётчики уже обновлены в user_deleting_subscriptions.
+        return
+    delta = 1 if created else -1
+    shift_counter(User, instance.user_id, 'following_count', delta)
+    shift_counter(User, instance.author_id, 'followers_count', delta)
+
+
+@receiver(pre_delete, sender=User)
+def user_deleting_subscriptions(sender, instance, **kwargs):
+    """Счётчики подписок пачкой до каскадного удаления подписок."""
+    shift_counters(
+        User, Subscription.objects.filter(user=instance).values('author_id'),
+        'followers_count', -1)
+    shift_counters(
+        User, Subscription.objects.filter(author=instance).values('user_id'),
+        'following_count', -1)
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_cached_user(sender, instance, created=False,
+                           update_fields=None, **kwargs):
+    # Смена пароля, деактивация и правка профиля сохраняют пользователя;
+    # вход обновляет только last_login и снимок не меняет.
+    if created or update_fields == frozenset({'last_login'}):
+        return
+    token_user_cache.invalidate_user(instance.pk)
+
+
+@receiver(post_delete, sender=User)
+def remove_avatar_variants(sender, instance, **kwargs):
+    remove_variant_files(instance, 'avatar')
+
+
+@receiver(variants_ready, sender=User)
+def avatar_variants_ready(sender, pk, **kwargs):
+    # Варианты сохраняются через update(), без post_save: снимок из кеша
+    # токенов и фрагменты рецептов автора иначе остались бы без них.
+    token_user_cache.invalidate_user(pk)
+    bump_version_on_commit('author', pk)
+    bump_version_on_commit('recipes')
+
+
+@receiver(post_delete, sender=Token)
+def invalidate_deleted_token(sender, instance, **kwargs):
+    # djoser удаляет токен при выходе (token/logout).
+    token_user_cache.invalidate_user(instance.user_id)
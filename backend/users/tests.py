@@ -0,0 +1,556 @@
+import base64
+import io
+import shutil
+import tempfile
+from datetime import timedelta
+
+from django.contrib.auth.tokens import default_token_generator
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from djoser.utils import encode_uid
+from PIL import Image
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APITestCase
+
+from api.models import (Favorite, FeedEntry, IngredientInRecipe, Ingredient,
+                        Recipe, ShoppingCart)
+from api.search import FTS_TABLE, uses_fts_table
+from api.shortlinks import short_links
+from api.testutils import (TINY_IMAGE, QueryBudgetMixin, create_recipe,
+                           create_user, create_users)
+from api.versions import get_version
+from .authentication import TokenUserCache, token_user_cache
+from .checks import token_cache_needs_shared_cache
+from .models import User, Subscription
+
+
+class SubscriptionsQueryCountTests(APITestCase):
+    """Страница подписок собирается за фиксированное число запросов."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user('reader')
+        cls.authors = create_users('author', 4)
+        for number, author in enumerate(cls.authors, start=1):
+            Subscription.objects.create(user=cls.user, author=author)
+            for i in range(number):
+                create_recipe(author, f'recipe {i}')
+
+    def setUp(self):
+        self.client.force_authenticate(self.user)
+
+    def test_subscriptions_with_limit(self):
+        # count + authors with recipes_count + recipes + subscribed ids
+        with self.assertNumQueries(4):
+            response = self.client.get(
+                '/api/users/subscriptions/?recipes_limit=2')
+        results = response.data['results']
+        self.assertEqual(len(results), 4)
+        for number, item in enumerate(results, start=1):
+            self.assertEqual(item['recipes_count'], number)
+            self.assertEqual(len(item['recipes']), min(number, 2))
+            self.assertTrue(item['is_subscribed'])
+
+    def test_subscriptions_without_limit(self):
+        with self.assertNumQueries(4):
+            response = self.client.get('/api/users/subscriptions/')
+        for number, item in enumerate(response.data['results'], start=1):
+            self.assertEqual(len(item['recipes']), number)
+
+    def test_recipes_preview_is_newest_first(self):
+        author = self.authors[-1]
+        newest = Recipe.objects.filter(author=author).latest('pub_date')
+        response = self.client.get(
+            '/api/users/subscriptions/?recipes_limit=1')
+        item = next(item for item in response.data['results']
+                    if item['id'] == author.pk)
+        self.assertEqual([recipe['id'] for recipe in item['recipes']],
+                         [newest.pk])
+
+
+@override_settings(TOKEN_AUTH_CACHE=True)
+class CachedTokenAuthenticationTests(APITestCase):
+    """Пользователь по токену берётся из кеша до его инвалидации."""
+
+    def setUp(self):
+        cache.clear()
+        token_user_cache.clear()
+        self.user = create_user('token')
+        self.token = Token.objects.create(user=self.user)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+
+    def token_queries(self):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get('/api/users/me/')
+        self.assertEqual(response.status_code, 200)
+        return [query for query in context.captured_queries
+                if 'authtoken_token' in query['sql']]
+
+    def test_second_request_skips_token_lookup(self):
+        self.assertEqual(len(self.token_queries()), 1)
+        self.assertEqual(self.token_queries(), [])
+
+    def test_profile_change_invalidates(self):
+        self.token_queries()
+        self.user.first_name = 'Changed'
+        self.user.save()
+        self.assertEqual(len(self.token_queries()), 1)
+        self.assertEqual(
+            self.client.get('/api/users/me/').data['first_name'], 'Changed')
+
+    def test_login_does_not_invalidate(self):
+        self.token_queries()
+        response = self.client.post('/api/auth/token/login/', {
+            'email': 'token@example.com', 'password': 'pass'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.token_queries(), [])
+
+    def test_set_password_invalidates(self):
+        self.token_queries()
+        response = self.client.post('/api/users/set_password/', {
+            'current_password': 'pass', 'new_password': 'n3w-Passw0rd!'})
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(len(self.token_queries()), 1)
+
+    def test_deactivation_rejects_cached_token(self):
+        self.token_queries()
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.client.get('/api/users/me/').status_code, 401)
+
+    def test_logout_rejects_cached_token(self):
+        self.token_queries()
+        response = self.client.post('/api/auth/token/logout/')
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(self.client.get('/api/users/me/').status_code, 401)
+
+    @override_settings(TOKEN_AUTH_SHARED_CACHE=True)
+    def test_shared_cache_serves_other_processes(self):
+        self.token_queries()
+        # Пустой LRU, как в соседнем процессе.
+        token_user_cache.clear()
+        self.assertEqual(self.token_queries(), [])
+
+    def test_logout_reaches_other_processes(self):
+        # LRU соседнего процесса; общий у процессов только кеш Django.
+        other = TokenUserCache()
+        other.set(self.token.key, self.user)
+        self.assertIsNotNone(other.get(self.token.key))
+        self.client.post('/api/auth/token/logout/')
+        self.assertIsNone(other.get(self.token.key))
+
+    @override_settings(TOKEN_AUTH_CACHE=False)
+    def test_disabled(self):
+        self.assertEqual(len(self.token_queries()), 1)
+        self.assertEqual(len(self.token_queries()), 1)
+
+    def test_requires_shared_cache(self):
+        with override_settings(CACHE_IS_SHARED=True):
+            self.assertEqual(token_cache_needs_shared_cache(None), [])
+        with override_settings(CACHE_IS_SHARED=False):
+            errors = token_cache_needs_shared_cache(None)
+        self.assertEqual([error.id for error in errors], ['users.E001'])
+        with override_settings(CACHE_IS_SHARED=False,
+                               TOKEN_AUTH_CACHE=False):
+            self.assertEqual(token_cache_needs_shared_cache(None), [])
+
+
+class UserConditionalGetTests(APITestCase):
+    """Профили отдают ETag и Last-Modified по updated_at."""
+
+    def setUp(self):
+        cache.clear()
+        self.user = create_user('reader')
+        self.author = create_user('chef')
+        self.url = f'/api/users/{self.author.pk}/'
+
+    def test_profile_if_modified_since(self):
+        response = self.client.get(self.url)
+        last_modified = response['Last-Modified']
+        response = self.client.get(self.url,
+                                   HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, 304)
+        User.objects.filter(pk=self.author.pk).update(
+            updated_at=timezone.now() + timedelta(days=1))
+        response = self.client.get(self.url,
+                                   HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, 200)
+
+    def test_subscription_changes_etag(self):
+        self.client.force_authenticate(self.user)
+        response = self.client.get(self.url)
+        self.assertNotIn('Last-Modified', response)
+        etag = response['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(f'{self.url}subscribe/')
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.data['is_subscribed'])
+
+    def test_me(self):
+        self.client.force_authenticate(self.user)
+        etag = self.client.get('/api/users/me/')['ETag']
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/users/me/',
+                                       HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.user.first_name = 'Changed'
+        self.user.save()
+        response = self.client.get('/api/users/me/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['first_name'], 'Changed')
+
+    def test_me_etag_ignores_stale_snapshot(self):
+        # request.user — снимок до изменения строки, как из кеша токенов.
+        self.client.force_authenticate(self.user)
+        etag = self.client.get('/api/users/me/')['ETag']
+        User.objects.filter(pk=self.user.pk).update(
+            updated_at=timezone.now())
+        response = self.client.get('/api/users/me/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+
+def make_base64_image(size=(800, 600)):
+    buffer = io.BytesIO()
+    Image.new('RGBA', size, (200, 50, 50, 128)).save(buffer, 'PNG')
+    encoded = base64.b64encode(buffer.getvalue()).decode()
+    return f'data:image/png;base64,{encoded}'
+
+
+@override_settings(IMAGE_VARIANT_WORKERS=0)
+class AvatarVariantsTests(APITestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.media_root = tempfile.mkdtemp()
+        cls.media_override = override_settings(MEDIA_ROOT=cls.media_root)
+        cls.media_override.enable()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.media_override.disable()
+        shutil.rmtree(cls.media_root, ignore_errors=True)
+        super().tearDownClass()
+
+    def setUp(self):
+        cache.clear()
+        self.user = create_user('avatar')
+        self.client.force_authenticate(self.user)
+
+    def test_variants_created_and_deleted(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.put('/api/users/me/avatar/',
+                            {'avatar': make_base64_image()}, format='json')
+        self.user.refresh_from_db()
+        variants = self.user.avatar_variants
+        self.assertEqual(set(variants), {'thumbnail', 'card', 'full'})
+        storage = self.user.avatar.storage
+        with storage.open(variants['thumbnail']['webp']) as file:
+            self.assertEqual(Image.open(file).size, (320, 240))
+        with storage.open(variants['full']['jpeg']) as file:
+            self.assertEqual(Image.open(file).size, (800, 600))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.delete('/api/users/me/avatar/')
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.avatar_variants, {})
+        self.assertFalse(storage.exists(variants['card']['webp']))
+
+    def upload_avatar(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.put('/api/users/me/avatar/',
+                            {'avatar': make_base64_image()}, format='json')
+        self.user.refresh_from_db()
+        return self.user.avatar_variants
+
+    def test_replaced_avatar_removes_old_files(self):
+        old = self.upload_avatar()
+        new = self.upload_avatar()
+        storage = self.user.avatar.storage
+        self.assertFalse(storage.exists(old['card']['webp']))
+        self.assertTrue(storage.exists(new['card']['webp']))
+
+    def test_variants_in_user_responses(self):
+        variants = self.upload_avatar()
+        for url in ('/api/users/me/', f'/api/users/{self.user.pk}/',
+                    '/api/users/'):
+            with self.subTest(url=url):
+                data = self.client.get(url).data
+                if 'results' in data:
+                    data = data['results'][0]
+                self.assertEqual(set(data['avatar_variants']),
+                                 set(variants))
+
+    def test_command_rebuilds_lost_variants(self):
+        self.upload_avatar()
+        create_recipe(self.user, 'Борщ')
+        # Задача пула потеряна: аватар есть, вариантов нет.
+        User.objects.filter(pk=self.user.pk).update(avatar_variants={})
+        response = self.client.get('/api/recipes/')
+        self.assertEqual(
+            response.data['results'][0]['author']['avatar_variants'], {})
+        out = io.StringIO()
+        # Файла картинки рецепта из create_recipe нет: ошибка в журнале.
+        with self.captureOnCommitCallbacks(execute=True), \
+                self.assertLogs('api.images', 'ERROR'):
+            call_command('rebuild_image_variants', stdout=out)
+        self.assertIn('0 rebuilt, 1 failed', out.getvalue())
+        self.assertIn('1 rebuilt, 0 failed', out.getvalue())
+        self.user.refresh_from_db()
+        self.assertEqual(set(self.user.avatar_variants),
+                         {'thumbnail', 'card', 'full'})
+        # Фрагмент рецепта с прежним автором больше не отдаётся.
+        response = self.client.get('/api/recipes/')
+        self.assertEqual(
+            set(response.data['results'][0]['author']['avatar_variants']),
+            {'thumbnail', 'card', 'full'})
+
+
+class UserDeletionTests(APITestCase):
+    """
+    Удаление пользователя каскадом Django: счётчики и индекс обновляются
+    пачкой, остальное — обработчиками строк.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user, cls.other, cls.third = (
+            create_user('leaving'), create_user('other'),
+            create_user('third'))
+        salt = Ingredient.objects.create(name='Соль', measurement_unit='г')
+        cls.own_recipe = create_recipe(cls.user, 'Свой')
+        IngredientInRecipe.objects.create(
+            recipe=cls.own_recipe, ingredient=salt, amount=1)
+        cls.other_recipe = create_recipe(cls.other, 'Чужой')
+        Subscription.objects.create(user=cls.other, author=cls.user)
+        Subscription.objects.create(user=cls.third, author=cls.other)
+        Subscription.objects.create(user=cls.user, author=cls.other)
+        for model in (Favorite, ShoppingCart):
+            for user in (cls.user, cls.third):
+                model.objects.create(user=user, recipe=cls.other_recipe)
+            model.objects.create(user=cls.other, recipe=cls.own_recipe)
+        # Подписка добавила рецепт в ленту other.
+        assert FeedEntry.objects.filter(user=cls.other).exists()
+
+    def assert_deleted(self, pk):
+        self.other_recipe.refresh_from_db()
+        self.other.refresh_from_db()
+        # Счётчики уменьшены ровно на строки удалённого пользователя.
+        self.assertEqual(self.other_recipe.favorites_count, 1)
+        self.assertEqual(self.other_recipe.shopping_cart_count, 1)
+        self.assertEqual(self.other.followers_count, 1)
+        self.assertEqual(self.other.following_count, 0)
+        self.assertFalse(User.objects.filter(pk=pk).exists())
+        for model, lookups in ((FeedEntry, ('user', 'author')),
+                               (Favorite, ('user', 'recipe__author')),
+                               (ShoppingCart, ('user', 'recipe__author')),
+                               (Subscription, ('user', 'author')),
+                               (Recipe, ('author',)), (Token, ('user',))):
+            for lookup in lookups:
+                self.assertFalse(
+                    model.objects.filter(**{lookup: pk}).exists(), model)
+        self.assertEqual(Favorite.objects.count(), 1)
+        if uses_fts_table():
+            with connection.cursor() as cursor:
+                cursor.execute(f'SELECT rowid FROM {FTS_TABLE}')
+                self.assertEqual([row[0] for row in cursor.fetchall()],
+                                 [self.other_recipe.pk])
+
+    def test_orm_delete(self):
+        code = self.own_recipe.short_code
+        short_links.resolve(code)
+        cart_version = get_version('shopping_cart', self.other.pk)
+        pk = self.user.pk
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.delete()
+        self.assert_deleted(pk)
+        self.assertFalse(short_links.cached(code)[0])
+        self.assertGreater(get_version('shopping_cart', self.other.pk),
+                           cart_version)
+
+    def test_api_delete(self):
+        pk = self.user.pk
+        self.client.force_authenticate(self.user)
+        response = self.client.delete(
+            '/api/users/me/', {'current_password': 'pass'}, format='json')
+        self.assertEqual(response.status_code, 204)
+        self.assert_deleted(pk)
+
+
+@override_settings(PASSWORD_HASHERS=[
+    'django.contrib.auth.hashers.MD5PasswordHasher'])
+class UserQueryBudgetTests(QueryBudgetMixin, APITestCase):
+    """Бюджеты запросов маршрутов users/urls.py."""
+    urlconf = 'users.urls'
+    budgets = {
+        'APIRootView.get': (0, 200),
+        'CustomUserViewSet.list': (3, 200),
+        'CustomUserViewSet.create': (5, 201),
+        'CustomUserViewSet.retrieve': (3, 200),
+        'CustomUserViewSet.update': (6, 200),
+        'CustomUserViewSet.partial_update': (4, 200),
+        'CustomUserViewSet.destroy': (26, 204),
+        'CustomUserViewSet.me': (2, 200),
+        'CustomUserViewSet.avatar': (4, 200),
+        'CustomUserViewSet.subscriptions': (4, 200),
+        'CustomUserViewSet.subscribe': (8, 201),
+        'CustomUserViewSet.activation': (1, 403),
+        'CustomUserViewSet.resend_activation': (1, 400),
+        'CustomUserViewSet.reset_password': (1, 204),
+        'CustomUserViewSet.reset_password_confirm': (3, 204),
+        'CustomUserViewSet.reset_username': (1, 204),
+        'CustomUserViewSet.reset_username_confirm': (4, 204),
+        'CustomUserViewSet.set_password': (2, 204),
+        'CustomUserViewSet.set_username': (3, 204),
+        'TokenCreateView.post': (6, 200),
+        'TokenDestroyView.post': (2, 204),
+    }
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.reader = create_user('reader')
+
+    def make_authors(self, count, recipes=1):
+        authors = create_users('author', count)
+        for author in authors:
+            for _ in range(recipes):
+                create_recipe(author)
+        return authors
+
+    def follow(self, authors):
+        for author in authors:
+            Subscription.objects.create(user=self.reader, author=author)
+
+    def call(self, method, url, data=None, authenticated=False):
+        # Свежий объект: сценарии меняют пароль и профиль пользователя.
+        self.client.force_authenticate(
+            User.objects.get(pk=self.reader.pk) if authenticated else None)
+        return lambda: getattr(self.client, method)(url, data, format='json')
+
+    def uid_and_token(self):
+        return {'uid': encode_uid(self.reader.pk),
+                'token': default_token_generator.make_token(self.reader)}
+
+    def scenario_APIRootView__get(self, size):
+        return self.call('get', '/api/')
+
+    def scenario_CustomUserViewSet__list(self, size):
+        self.follow(self.make_authors(size, recipes=0))
+        return self.call('get', f'/api/users/?limit={size}',
+                         authenticated=True)
+
+    def scenario_CustomUserViewSet__create(self, size):
+        self.make_authors(size, recipes=0)
+        return self.call('post', '/api/users/', {
+            'email': 'new@example.com', 'username': 'new',
+            'first_name': 'New', 'last_name': 'User',
+            'password': 'Secret-pass-123'})
+
+    def scenario_CustomUserViewSet__retrieve(self, size):
+        author, = self.make_authors(1, recipes=size)
+        self.follow([author])
+        return self.call('get', f'/api/users/{author.pk}/',
+                         authenticated=True)
+
+    def profile(self):
+        return {'email': 'reader@example.com', 'username': 'reader2',
+                'first_name': 'Reader', 'last_name': 'Changed'}
+
+    def scenario_CustomUserViewSet__update(self, size):
+        self.follow(self.make_authors(size))
+        return self.call('put', f'/api/users/{self.reader.pk}/',
+                         self.profile(), authenticated=True)
+
+    def scenario_CustomUserViewSet__partial_update(self, size):
+        self.follow(self.make_authors(size))
+        return self.call('patch', f'/api/users/{self.reader.pk}/',
+                         {'last_name': 'Changed'}, authenticated=True)
+
+    def scenario_CustomUserViewSet__destroy(self, size):
+        authors = self.make_authors(size)
+        self.follow(authors)
+        for author in authors:
+            Subscription.objects.create(user=author, author=self.reader)
+        for recipe in Recipe.objects.filter(author__in=authors):
+            Favorite.objects.create(user=self.reader, recipe=recipe)
+            ShoppingCart.objects.create(user=self.reader, recipe=recipe)
+        for _ in range(size):
+            create_recipe(self.reader)
+        return self.call('delete', f'/api/users/{self.reader.pk}/',
+                         {'current_password': 'pass'}, authenticated=True)
+
+    def scenario_CustomUserViewSet__me(self, size):
+        self.follow(self.make_authors(size))
+        return self.call('get', '/api/users/me/', authenticated=True)
+
+    def scenario_CustomUserViewSet__avatar(self, size):
+        return self.call('put', '/api/users/me/avatar/',
+                         {'avatar': TINY_IMAGE}, authenticated=True)
+
+    def scenario_CustomUserViewSet__subscriptions(self, size):
+        self.follow(self.make_authors(size, recipes=2))
+        return self.call(
+            'get', f'/api/users/subscriptions/?limit={size}&recipes_limit=1',
+            authenticated=True)
+
+    def scenario_CustomUserViewSet__subscribe(self, size):
+        author, = self.make_authors(1, recipes=size)
+        return self.call('post', f'/api/users/{author.pk}/subscribe/',
+                         authenticated=True)
+
+    def scenario_CustomUserViewSet__activation(self, size):
+        self.make_authors(size, recipes=0)
+        return self.call('post', '/api/users/activation/',
+                         self.uid_and_token())
+
+    def scenario_CustomUserViewSet__resend_activation(self, size):
+        self.make_authors(size, recipes=0)
+        return self.call('post', '/api/users/resend_activation/',
+                         {'email': self.reader.email})
+
+    def scenario_CustomUserViewSet__reset_password(self, size):
+        self.make_authors(size, recipes=0)
+        return self.call('post', '/api/users/reset_password/',
+                         {'email': self.reader.email})
+
+    def scenario_CustomUserViewSet__reset_password_confirm(self, size):
+        self.make_authors(size, recipes=0)
+        return self.call('post', '/api/users/reset_password_confirm/', {
+            **self.uid_and_token(), 'new_password': 'Other-pass-456'})
+
+    def scenario_CustomUserViewSet__reset_username(self, size):
+        self.make_authors(size, recipes=0)
+        return self.call('post', '/api/users/reset_email/',
+                         {'email': self.reader.email})
+
+    def scenario_CustomUserViewSet__reset_username_confirm(self, size):
+        self.make_authors(size, recipes=0)
+        return self.call('post', '/api/users/reset_email_confirm/', {
+            **self.uid_and_token(), 'new_email': 'renamed@example.com'})
+
+    def scenario_CustomUserViewSet__set_password(self, size):
+        self.follow(self.make_authors(size))
+        return self.call('post', '/api/users/set_password/', {
+            'current_password': 'pass', 'new_password': 'Other-pass-456'},
+            authenticated=True)
+
+    def scenario_CustomUserViewSet__set_username(self, size):
+        self.follow(self.make_authors(size))
+        return self.call('post', '/api/users/set_email/', {
+            'current_password': 'pass', 'new_email': 'renamed@example.com'},
+            authenticated=True)
+
+    def scenario_TokenCreateView__post(self, size):
+        self.follow(self.make_authors(size))
+        return self.call('post', '/api/auth/token/login/', {
+            'email': self.reader.email, 'password': 'pass'})
+
+    def scenario_TokenDestroyView__post(self, size):
+        self.follow(self.make_authors(size))
+        Token.objects.create(user=self.reader)
+        return self.call('post', '/api/auth/token/logout/', authenticated=True)
@@ -1,3 +1,5 @@
+from django.db.models import F, Prefetch, Window
+from django.db.models.functions import RowNumber
 from djoser.views import UserViewSet
 from rest_framework import status, parsers
 from rest_framework.decorators import action
@@ -5,6 +7,11 @@ from rest_framework.generics import get_object_or_404
 from rest_framework.permissions import IsAuthenticated, AllowAny
 from rest_framework.response import Response
 
+from api.conditional import conditional, make_etag, viewer_version
+from api.images import delete_variants, schedule_variants
+from api.models import Recipe
+from api.pagination import (OptionalCursorPaginationMixin,
+                            SubscriptionCursorPagination)
 from .models import User, Subscription
 from .serializers import (
     CustomUserSerializer, SubscriptionSerializer, AvatarSerializer,
@@ -12,9 +19,34 @@ from .serializers import (
 )
 
 
-class CustomUserViewSet(UserViewSet):
+def user_validators(request, id=None, *args, **kwargs):
+    # Для /users/me/ djoser вызывает retrieve без id, см. me_validators.
+    if not str(id).isdigit():
+        return None, None
+    updated_at = User.objects.filter(pk=id).values_list(
+        'updated_at', flat=True).first()
+    if updated_at is None:
+        return None, None
+    etag = make_etag('user', id, updated_at, viewer_version(request.user))
+    # is_subscribed зависит от читателя и не отражается в updated_at.
+    if request.user.is_authenticated:
+        return etag, None
+    return etag, updated_at
+
+
+def me_validators(request, *args, **kwargs):
+    # Не по request.user: снимок из кеша токенов может быть старше строки.
+    updated_at = User.objects.filter(pk=request.user.pk).values_list(
+        'updated_at', flat=True).first()
+    if updated_at is None:
+        return None, None
+    return make_etag('me', request.user.pk, updated_at), updated_at
+
+
+class CustomUserViewSet(OptionalCursorPaginationMixin, UserViewSet):
     queryset = User.objects.all()
     serializer_class = CustomUserSerializer
+    read_from_replica = True
     parser_classes = [parsers.MultiPartParser,
                       parsers.JSONParser, parsers.FormParser]
 
@@ -23,6 +55,10 @@ class CustomUserViewSet(UserViewSet):
             return [AllowAny()]
         return super().get_permissions()
 
+    @conditional(user_validators)
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
+
     @action(
         methods=["put", "delete"],
         detail=False,
@@ -33,12 +69,17 @@ class CustomUserViewSet(UserViewSet):
         user = request.user
         if request.method == 'DELETE':
             if user.avatar:
-                user.avatar.delete(save=True)
+                user.avatar.delete(save=False)
+                delete_variants(user, 'avatar')
+                user.save(update_fields=('avatar', 'avatar_variants',
+                                         'updated_at'))
             return Response(status=status.HTTP_204_NO_CONTENT)
 
         serializer = SetAvatarSerializer(user, data=request.data)
         serializer.is_valid(raise_exception=True)
+        delete_variants(user, 'avatar')
         serializer.save()
+        schedule_variants(user, 'avatar')
         response_serializer = AvatarSerializer(
             user, context={'request': request})
         return Response(response_serializer.data, status=status.HTTP_200_OK)
@@ -83,11 +124,27 @@ class CustomUserViewSet(UserViewSet):
     @action(
         detail=False,
         methods=['get'],
-        permission_classes=[IsAuthenticated]
+        permission_classes=[IsAuthenticated],
+        cursor_pagination_class=SubscriptionCursorPagination,
     )
     def subscriptions(self, request):
         user = request.user
-        queryset = User.objects.filter(following__user=user)
+        recipes = Recipe.objects.order_by('-pub_date')
+        recipes_limit = request.query_params.get('recipes_limit')
+        try:
+            recipes_limit = int(recipes_limit)
+        except (ValueError, TypeError):
+            recipes_limit = None
+        if recipes_limit is not None and recipes_limit >= 0:
+            # Первые N рецептов каждого автора страницы одним запросом.
+            recipes = recipes.annotate(row_number=Window(
+                RowNumber(),
+                partition_by=F('author'),
+                order_by=F('pub_date').desc(),
+            )).filter(row_number__lte=recipes_limit)
+        queryset = User.objects.filter(following__user=user).prefetch_related(
+            Prefetch('recipes', queryset=recipes, to_attr='recipes_preview')
+        ).order_by('id')
 
         page = self.paginate_queryset(queryset)
         if page is not None:
@@ -101,5 +158,6 @@ class CustomUserViewSet(UserViewSet):
         detail=False,
         permission_classes=[IsAuthenticated],
     )
+    @conditional(me_validators)
     def me(self, request, *args, **kwargs):
         return super().me(request, *args, **kwargs)